@@ -1,14 +1,20 @@
 import sys
 import pathlib
 from mozidbedit import mozidb, to_json
+from mozidbedit.dedup import DecodeCache
+from mozidbedit.incremental import ChangeTracker
 import json
-def read_objects(sitebase):
+
+# Marks records not read yet, as opposed to stored `null`/`undefined` values
+_UNREAD = object()
+
+def read_objects(sitebase, tracker=None, decode_cache=None):
     dbs = {}
     items = {}
     for db_path in sitebase.iterdir():
         if not db_path.name.endswith(".sqlite"):
             continue
-        with mozidb.IndexedDB(db_path) as conn:
+        with mozidb.IndexedDB(db_path, decode_cache=decode_cache) as conn:
             db_name = conn.get_name()
             if db_name is not None:
                 dbs[db_name] = db_path
@@ -18,12 +24,26 @@ def read_objects(sitebase):
                 conn.execute('alter table object_data add column json_data TEXT')
             except:
                 pass
-            items = conn.list_objects()
+            if tracker is None:
+                keys = conn.list_objects()
+                try:
+                    values = conn.read_many(keys, default=_UNREAD)
+                except Exception as e:
+                    # Fall back to reading records one by one below
+                    print(f"Cannot read all records of {db_path} at once, reading them one by one: {e}",
+                          file=sys.stderr)
+                    values = [_UNREAD] * len(keys)
+                records = zip(keys, values)
+            else:
+                # Only convert records added or modified since the last run
+                records = ((change.key, change.value) for change in tracker.changes(conn)
+                           if change.op == "put")
             update_data_bin = []
             update_data_text = []
-            for key in items:
+            for key, obj in records:
                 try:
-                    obj = conn.read_object(key_name=key)
+                    if obj is _UNREAD:
+                        obj = conn.read_object(key_name=key)
                     if not obj:
                         continue
                     try:
@@ -49,7 +69,7 @@ def read_objects(sitebase):
                                     update_data_bin)
                 if len(update_data_text) > 0:
                     conn.executemany('''
-                                    UPDATE object_data set json_data = ? WHERE key like ?''',
+                                    UPDATE object_data set json_data = ? WHERE key = ?''',
                                     update_data_text)
             except Exception as e:
                 print(e)
@@ -65,5 +85,10 @@ if __name__ == "__main__":
         storage_path = sys.argv[1]
         print(storage_path)
     sitebase = pathlib.Path(storage_path)
-    if read_objects(sitebase=sitebase):
+    # Optional state database: only convert records changed since the last run
+    tracker = ChangeTracker(sys.argv[2]) if len(sys.argv) > 2 else None
+    # Values are only converted to JSON, so identical ones can be shared
+    decode_cache = DecodeCache(shared=True)
+    if read_objects(sitebase=sitebase, tracker=tracker, decode_cache=decode_cache):
+        print(decode_cache.summary())
         print('done')
\ No newline at end of file
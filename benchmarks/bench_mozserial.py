@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+"""Measure StructuredClone decoding throughput for selected value shapes."""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import random
+import sys
+import time
+import typing as ty
+
+import fixtures
+from mozidbedit import mozserial
+
+
+def make_cases(seed: int = 0) -> ty.Dict[str, bytes]:
+	"""Returns the serialized payload of every benchmark case by name"""
+	rng = random.Random(seed)
+	return {
+		"records":       fixtures.serialize([fixtures.make_record(rng, i) for i in range(2000)]),
+		"bigint-1mbit":  fixtures.serialize(rng.getrandbits(2**20) | 2**40),
+		"bigints-small": fixtures.serialize([rng.getrandbits(100) + 2**64 for _ in range(10000)]),
+		"set-100k-int":  fixtures.serialize(set(range(100000))),
+		"set-100k-str":  fixtures.serialize({f"entry-{i}" for i in range(100000)}),
+	}
+
+
+def time_decode(payload: bytes, min_time: float = 0.5) -> float:
+	"""Returns the best observed time (in seconds) of decoding `payload`"""
+	best = float("inf")
+	spent = 0.0
+	while spent < min_time or best == float("inf"):
+		start = time.perf_counter()
+		mozserial.Reader(payload).read()
+		elapsed = time.perf_counter() - start
+		best = min(best, elapsed)
+		spent += elapsed
+	return best
+
+
+def main(argv=sys.argv[1:]) -> int:
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("cases", nargs="*", metavar="CASE",
+	                    help="Names of the cases to run (default: all)")
+	parser.add_argument("--min-time", type=float, default=0.5,
+	                    help="Minimum time to spend per case in seconds (default: %(default)s)")
+	args = parser.parse_args(argv)
+
+	for name, payload in make_cases().items():
+		if args.cases and name not in args.cases:
+			continue
+		best = time_decode(payload, args.min_time)
+		print(f"{name:<14} {len(payload) / 2**20:7.2f} MiB  {best * 1000:9.2f} ms  "
+		      f"{len(payload) / best / 2**20:8.1f} MiB/s")
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,369 @@
+#!/usr/bin/python3
+"""Synthetic test data for benchmarking the IndexedDB reading pipeline."""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import datetime
+import os
+import pathlib
+import random
+import sqlite3
+import struct
+import sys
+import typing as ty
+
+from mozidbedit import ccl_simplesnappy
+from mozidbedit import mozidb
+from mozidbedit import mozserial
+from mozidbedit.mozserial import DataType
+
+
+def _pair(tag: int, data: int = 0) -> bytes:
+	return struct.pack("<Q", (tag << 32) | (data & 0xFFFFFFFF))
+
+
+def _pad(length: int) -> bytes:
+	return b"\0" * (-length % 8)
+
+
+class CloneWriter:
+	"""Minimal SpiderMonkey StructuredClone writer for the value types produced
+	by `mozserial.Reader`
+
+	Python containers are mapped to their natural JavaScript counterparts
+	(`dict` → Object, `list` → Array, `JSMapObj` → Map, `set` → Set),
+	integers that fit into 32 bits are written as Int32 and all other integers
+	as BigInt.
+	"""
+	out: bytearray
+
+	def __init__(self):
+		self.out = bytearray(_pair(DataType.HEADER, mozserial.Scope.DIFFERENT_PROCESS_FOR_INDEX_DB))
+
+	def write(self, value: object) -> None:
+		out = self.out
+		if value is None:
+			out += _pair(DataType.NULL)
+		elif value is NotImplemented:
+			out += _pair(DataType.UNDEFINED)
+		elif isinstance(value, bool):
+			out += _pair(DataType.BOOLEAN, int(value))
+		elif isinstance(value, int) and -0x80000000 <= value <= 0x7FFFFFFF:
+			out += _pair(DataType.INT32, value)
+		elif isinstance(value, int):
+			digits = (abs(value).bit_length() + 63) // 64
+			out += _pair(DataType.BIGINT, digits | ((value < 0) << 31))
+			out += abs(value).to_bytes(digits * 8, "little")
+		elif isinstance(value, float):
+			out += struct.pack("<d", value)
+		elif isinstance(value, str):
+			self.write_string(value)
+		elif isinstance(value, datetime.datetime):
+			out += _pair(DataType.DATE_OBJECT)
+			out += struct.pack("<d", value.timestamp() * 1000)
+		elif isinstance(value, (bytes, bytearray, memoryview)):
+			value = memoryview(value).cast("B")
+			out += _pair(DataType.ARRAY_BUFFER_OBJECT)
+			out += struct.pack("<Q", len(value))
+			out += value
+			out += _pad(len(value))
+		elif isinstance(value, mozserial.JSMapObj):
+			out += _pair(DataType.MAP_OBJECT)
+			for key, item in value.items():
+				self.write(key)
+				self.write(item)
+			out += _pair(DataType.END_OF_KEYS)
+		elif isinstance(value, (set, frozenset, mozserial.JSSetObj)):
+			out += _pair(DataType.SET_OBJECT)
+			for item in value:
+				self.write(item)
+			out += _pair(DataType.END_OF_KEYS)
+		elif isinstance(value, list):
+			out += _pair(DataType.ARRAY_OBJECT, len(value))
+			for index, item in enumerate(value):
+				out += _pair(DataType.INT32, index)
+				self.write(item)
+			out += _pair(DataType.END_OF_KEYS)
+		elif isinstance(value, dict):
+			out += _pair(DataType.OBJECT_OBJECT)
+			for key, item in value.items():
+				self.write(key)
+				self.write(item)
+			out += _pair(DataType.END_OF_KEYS)
+		else:
+			raise TypeError(f"Cannot serialize {value!r}")
+
+	def write_string(self, value: str) -> None:
+		try:
+			encoded = value.encode("latin-1")
+			self.out += _pair(DataType.STRING, len(encoded) | 0x80000000)
+		except UnicodeEncodeError:
+			encoded = value.encode("utf-16le")
+			self.out += _pair(DataType.STRING, len(encoded) // 2)
+		self.out += encoded
+		self.out += _pad(len(encoded))
+
+
+def serialize(value: object) -> bytes:
+	writer = CloneWriter()
+	writer.write(value)
+	return bytes(writer.out)
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+	while value > 0x7F:
+		out.append((value & 0x7F) | 0x80)
+		value >>= 7
+	out.append(value)
+
+
+def _write_literal(out: bytearray, data: bytes) -> None:
+	length = len(data) - 1
+	if length < 60:
+		out.append(length << 2)
+	elif length < 0x100:
+		out.append(60 << 2)
+		out.append(length)
+	elif length < 0x10000:
+		out.append(61 << 2)
+		out += length.to_bytes(2, "little")
+	else:
+		out.append(63 << 2)
+		out += length.to_bytes(4, "little")
+	out += data
+
+
+def snappy_compress(data: bytes) -> bytes:
+	"""Compresses `data` into the raw Snappy format using a simple greedy
+	matcher (the result is valid, but larger than what libsnappy produces)"""
+	out = bytearray()
+	_write_varint(out, len(data))
+
+	table: ty.Dict[bytes, int] = {}
+	pos = literal_start = 0
+	while pos + 4 <= len(data):
+		prefix = data[pos:pos+4]
+		candidate = table.get(prefix)
+		table[prefix] = pos
+		if candidate is None or pos - candidate > 0xFFFF:
+			pos += 1
+			continue
+
+		length = 4
+		while pos + length < len(data) and length < 64 \
+		      and data[candidate + length] == data[pos + length]:
+			length += 1
+
+		if literal_start < pos:
+			_write_literal(out, data[literal_start:pos])
+		out.append(((length - 1) << 2) | 2)  # Copy with 2-byte offset
+		out += (pos - candidate).to_bytes(2, "little")
+
+		pos += length
+		literal_start = pos
+	if literal_start < len(data):
+		_write_literal(out, data[literal_start:])
+	return bytes(out)
+
+
+def make_record(rng: random.Random, index: int, size: int = 8) -> ty.Dict[str, object]:
+	"""Creates a record resembling the typical contents of extension and site
+	databases, containing roughly `size` properties"""
+	record: ty.Dict[str, object] = {
+		"id": index,
+		"url": f"https://example{rng.randrange(100)}.org/path/{rng.randrange(10**6)}",
+		"timestamp": float(1700000000000 + rng.randrange(10**9)),
+		"title": "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randrange(8, 40))),
+		"visits": rng.randrange(1000),
+		"starred": rng.random() < 0.1,
+		"tags": [f"tag{rng.randrange(20)}" for _ in range(rng.randrange(4))],
+		"scores": [rng.randrange(-1000, 1000) for _ in range(16)],
+	}
+	for extra in range(len(record), size):
+		record[f"field{extra}"] = rng.randrange(10**6)
+	return record
+
+
+def snappy_compress_framed(data: bytes) -> bytes:
+	"""Compresses `data` into the Snappy framing format with the checksum
+	variant used by Mozilla for the values stored in `.files` directories"""
+	out = bytearray(b"\xFF\x06\x00\x00" + ccl_simplesnappy.FRAME_MAGIC)
+	for start in range(0, len(data), 0x10000):
+		chunk = data[start:start + 0x10000]
+		crc = ccl_simplesnappy.crc32c(chunk, xor_value=0)
+		crc = (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+		payload = struct.pack("<I", crc) + snappy_compress(chunk)
+		out += b"\x00" + len(payload).to_bytes(3, "little") + payload
+	return bytes(out)
+
+
+SHAPES = ("flat", "nested", "binary")
+KEY_TYPES = ("string", "number", "date", "array", "binary")
+
+
+def make_value(rng: random.Random, index: int, shape: str = "flat", size: int = 8) -> object:
+	"""Creates a value of the given shape
+
+	 * `flat`:   A record with `size` mostly scalar properties.
+	 * `nested`: A settings-like object containing `size` nested records.
+	 * `binary`: A record holding an `ArrayBuffer` of `size` KiB.
+	"""
+	if shape == "flat":
+		return make_record(rng, index, size)
+	elif shape == "nested":
+		return {
+			"version": 3,
+			"updated": datetime.datetime.fromtimestamp(1700000000 + index, datetime.timezone.utc),
+			"entries": [make_record(rng, index * size + i) for i in range(size)],
+			"lookup": mozserial.JSMapObj((f"item{i}", i) for i in range(size)),
+		}
+	elif shape == "binary":
+		return {
+			"id": index,
+			"mime": "image/png",
+			"data": rng.getrandbits(size * 4096).to_bytes(size * 512, "little") * 2,  # Half compressible
+		}
+	raise ValueError(f"Unknown value shape: {shape}")
+
+
+def make_key(index: int, key_type: str = "string") -> object:
+	if key_type == "string":
+		return f"key-{index:08d}"
+	elif key_type == "number":
+		return float(index)
+	elif key_type == "date":
+		return datetime.datetime.fromtimestamp(1700000000 + index, datetime.timezone.utc)
+	elif key_type == "array":
+		return (f"group{index % 16}", float(index))
+	elif key_type == "binary":
+		return index.to_bytes(4, "big")
+	raise ValueError(f"Unknown key type: {key_type}")
+
+
+# Subset of the schema created by Firefox (dom/indexedDB/DBSchema.cpp) that
+# is required to read object stores
+SCHEMA = """
+CREATE TABLE database (
+	name TEXT PRIMARY KEY,
+	origin TEXT NOT NULL,
+	version INTEGER NOT NULL DEFAULT 0,
+	last_vacuum_time INTEGER NOT NULL DEFAULT 0,
+	last_analyze_time INTEGER NOT NULL DEFAULT 0,
+	last_vacuum_size INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE object_store (
+	id INTEGER PRIMARY KEY,
+	auto_increment INTEGER NOT NULL DEFAULT 0,
+	name TEXT NOT NULL,
+	key_path TEXT
+);
+CREATE TABLE object_data (
+	object_store_id INTEGER NOT NULL,
+	key BLOB NOT NULL,
+	index_data_values BLOB DEFAULT NULL,
+	file_ids TEXT,
+	data BLOB NOT NULL,
+	PRIMARY KEY (object_store_id, key),
+	FOREIGN KEY (object_store_id) REFERENCES object_store(id)
+) WITHOUT ROWID;
+CREATE TABLE file (
+	id INTEGER PRIMARY KEY,
+	refcount INTEGER NOT NULL
+);
+"""
+
+
+def write_database(
+		path: ty.Union[os.PathLike, str],
+		values: ty.Iterable[ty.Tuple[object, object]],
+		*,
+		name: str = "benchmark",
+		origin: str = "https://example.org",
+		store_name: str = "store",
+		file_threshold: ty.Optional[int] = None,
+) -> ty.Dict[str, int]:
+	"""Writes the given key/value pairs into a new IndexedDB database file
+
+	Values whose serialized size exceeds `file_threshold` bytes are stored in
+	the database's `.files` directory, like Firefox does for large values.
+	Returns statistics on the written data.
+	"""
+	path = pathlib.Path(path)
+	files_dir = path.with_suffix(".files")
+	if path.exists():
+		path.unlink()
+
+	stats = {"rows": 0, "serialized_bytes": 0, "compressed_bytes": 0, "files": 0}
+	with sqlite3.connect(path) as conn:
+		conn.executescript(SCHEMA)
+		conn.execute("INSERT INTO database (name, origin) VALUES (?, ?)", (name, origin))
+		conn.execute("INSERT INTO object_store (id, name) VALUES (1, ?)", (store_name,))
+
+		for key, value in values:
+			serialized = serialize(value)
+			stats["rows"] += 1
+			stats["serialized_bytes"] += len(serialized)
+
+			file_ids = None
+			if file_threshold is not None and len(serialized) > file_threshold:
+				stats["files"] += 1
+				files_dir.mkdir(exist_ok=True)
+				(files_dir / str(stats["files"])).write_bytes(snappy_compress_framed(serialized))
+				conn.execute("INSERT INTO file (id, refcount) VALUES (?, 1)", (stats["files"],))
+				file_ids = f".{stats['files']}"
+				data = b""
+			else:
+				data = snappy_compress(serialized)
+				stats["compressed_bytes"] += len(data)
+
+			conn.execute(
+				"INSERT INTO object_data (object_store_id, key, file_ids, data) VALUES (1, ?, ?, ?)",
+				(mozidb.KeyCodec.encode(key), file_ids, data)
+			)
+	conn.close()
+	return stats
+
+
+def generate_database(
+		path: ty.Union[os.PathLike, str],
+		rows: int,
+		*,
+		shape: str = "flat",
+		size: int = 8,
+		key_type: str = "string",
+		file_threshold: ty.Optional[int] = None,
+		seed: int = 0,
+) -> ty.Dict[str, int]:
+	rng = random.Random(seed)
+	values = ((make_key(i, key_type), make_value(rng, i, shape, size)) for i in range(rows))
+	return write_database(path, values, file_threshold=file_threshold)
+
+
+def main(argv=sys.argv[1:]) -> int:
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("path", type=pathlib.Path,
+	                    help="Path of the `.sqlite` file to create")
+	parser.add_argument("-n", "--rows", type=int, default=10000,
+	                    help="Number of records to generate (default: %(default)s)")
+	parser.add_argument("--shape", choices=SHAPES, default="flat",
+	                    help="Shape of the generated values (default: %(default)s)")
+	parser.add_argument("--size", type=int, default=8,
+	                    help="Size parameter of the value shape (default: %(default)s)")
+	parser.add_argument("--key-type", choices=KEY_TYPES, default="string",
+	                    help="Type of the generated keys (default: %(default)s)")
+	parser.add_argument("--file-threshold", type=int, metavar="BYTES",
+	                    help="Store values larger than this in the `.files` directory")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args(argv)
+
+	stats = generate_database(args.path, args.rows, shape=args.shape, size=args.size,
+	                          key_type=args.key_type, file_threshold=args.file_threshold,
+	                          seed=args.seed)
+	print(", ".join(f"{k}: {v}" for k, v in stats.items()))
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+"""Measure the memory held by decoded StructuredClone values using `tracemalloc`."""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import io
+import random
+import sys
+import tracemalloc
+
+import fixtures
+from mozidbedit import mozserial
+
+
+def measure(payloads, **reader_args) -> (int, int):
+	"""Decodes all payloads, keeping the results alive, and returns the
+	retained and peak number of bytes allocated while doing so"""
+	tracemalloc.start()
+	values = [
+		mozserial.Reader(io.BufferedReader(io.BytesIO(payload)), **reader_args).read()
+		for payload in payloads
+	]
+	retained, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	del values
+	return retained, peak
+
+
+def main(argv=sys.argv[1:]) -> int:
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("-n", "--records", type=int, default=20000,
+	                    help="Number of records to decode (default: %(default)s)")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args(argv)
+
+	rng = random.Random(args.seed)
+	payloads = [fixtures.serialize(fixtures.make_record(rng, i)) for i in range(args.records)]
+	payload_bytes = sum(map(len, payloads))
+
+	print(f"{args.records} records, {payload_bytes / 2**20:.1f} MiB serialized")
+	for label, reader_args in (
+		("no interning",   {"strings": mozserial.StringTable(max_size=0)}),
+		("JSInt32 values", {}),
+		("plain ints",     {"plain_ints": True}),
+		("shared strings", {"plain_ints": True, "strings": mozserial.StringTable()}),
+		("+ short values", {"plain_ints": True, "strings": mozserial.StringTable(max_value_length=16)}),
+	):
+		retained, peak = measure(payloads, **reader_args)
+		print(f"{label:<16} retained {retained / 2**20:7.1f} MiB, "
+		      f"peak {peak / 2**20:7.1f} MiB, "
+		      f"{retained / args.records:7.0f} B/record")
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
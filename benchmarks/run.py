@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+"""Benchmark the stages of the IndexedDB reading pipeline on synthetic databases.
+
+Results can be written as JSON (`--output`) and compared against the results
+of an earlier run (`--compare`), e.g. one made on a different commit.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import io
+import json
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing as ty
+
+import bench_mozserial
+import fixtures
+from mozidbedit import ccl_simplesnappy
+from mozidbedit import mozidb
+from mozidbedit import mozserial
+
+
+class Stage(ty.NamedTuple):
+	"""A benchmarked unit of work, processing `nbytes` bytes and `rows` rows
+	per call of `run`"""
+	name:   str
+	run:    ty.Callable[[], object]
+	nbytes: int
+	rows:   int
+
+
+def load_rows(db_path: pathlib.Path) -> ty.List[ty.Tuple[bytes, bytes]]:
+	with mozidb.IndexedDB(db_path) as conn:
+		rows = conn.execute("SELECT key, data FROM object_data WHERE file_ids IS NULL").fetchall()
+	conn.close()
+	return rows
+
+
+def make_stages(db_path: pathlib.Path) -> ty.List[Stage]:
+	rows = load_rows(db_path)
+	keys = [key for key, _ in rows]
+	compressed = [data for _, data in rows]
+	decompressed = [ccl_simplesnappy.decompress(io.BytesIO(data)) for data in compressed]
+	decoded_keys = [mozidb.KeyCodec.decode(key) for key in keys]
+
+	def read_objects():
+		with mozidb.IndexedDB(db_path) as conn:
+			result = conn.read_objects()
+		conn.close()
+		return result
+
+	with mozidb.IndexedDB(db_path) as conn:
+		row_count = conn.count_objects()
+	conn.close()
+
+	stages = [
+		Stage("snappy.decompress",
+		      lambda: [ccl_simplesnappy.decompress(io.BytesIO(data)) for data in compressed],
+		      sum(map(len, compressed)), len(compressed)),
+		Stage("mozserial.Reader.read",
+		      lambda: [mozserial.Reader(data).read() for data in decompressed],
+		      sum(map(len, decompressed)), len(decompressed)),
+		Stage("KeyCodec.decode",
+		      lambda: [mozidb.KeyCodec.decode(key) for key in keys],
+		      sum(map(len, keys)), len(keys)),
+		Stage("KeyCodec.encode",
+		      lambda: [mozidb.KeyCodec.encode(key) for key in decoded_keys],
+		      sum(map(len, keys)), len(keys)),
+		Stage("IndexedDB.read_objects", read_objects,
+		      db_path.stat().st_size, row_count),
+	]
+	for name, payload in bench_mozserial.make_cases().items():
+		stages.append(Stage(f"mozserial.Reader.read[{name}]",
+		                    lambda payload=payload: mozserial.Reader(payload).read(),
+		                    len(payload), 1))
+	return stages
+
+
+def measure(stage: Stage, repeat: int) -> ty.Dict[str, float]:
+	best = float("inf")
+	for _ in range(repeat):
+		start = time.perf_counter_ns()
+		stage.run()
+		best = min(best, time.perf_counter_ns() - start)
+	seconds = best / 1e9
+
+	# Measure memory in a separate run as tracing slows down execution a lot
+	tracemalloc.start()
+	stage.run()
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return {
+		"seconds":    seconds,
+		"mb_per_s":   stage.nbytes / seconds / 1e6 if seconds else 0.0,
+		"rows_per_s": stage.rows / seconds if seconds else 0.0,
+		"peak_bytes": peak,
+		"bytes":      stage.nbytes,
+		"rows":       stage.rows,
+	}
+
+
+def git_commit() -> ty.Optional[str]:
+	try:
+		return subprocess.run(
+			["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True,
+			cwd=pathlib.Path(__file__).parent,
+		).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def print_results(results: ty.Dict[str, ty.Dict[str, float]],
+                  baseline: ty.Optional[ty.Dict[str, ty.Dict[str, float]]] = None) -> None:
+	print(f"{'stage':<40} {'MB/s':>9} {'rows/s':>11} {'peak MiB':>9}" + ("  vs baseline" if baseline else ""))
+	for name, result in results.items():
+		line = (f"{name:<40} {result['mb_per_s']:9.2f} {result['rows_per_s']:11.0f} "
+		        f"{result['peak_bytes'] / 2**20:9.1f}")
+		if baseline and name in baseline and baseline[name]["seconds"]:
+			line += f"  {baseline[name]['seconds'] / result['seconds']:6.2f}×"
+		print(line)
+
+
+def main(argv=sys.argv[1:]) -> int:
+	parser = argparse.ArgumentParser(description=__doc__,
+	                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("-n", "--rows", type=int, default=5000,
+	                    help="Number of records in the fixture database (default: %(default)s)")
+	parser.add_argument("--shape", choices=fixtures.SHAPES, default="flat",
+	                    help="Shape of the fixture values (default: %(default)s)")
+	parser.add_argument("--size", type=int, default=8,
+	                    help="Size parameter of the value shape (default: %(default)s)")
+	parser.add_argument("--key-type", choices=fixtures.KEY_TYPES, default="string",
+	                    help="Type of the fixture keys (default: %(default)s)")
+	parser.add_argument("--repeat", type=int, default=3,
+	                    help="Number of timed runs per stage, the best is reported (default: %(default)s)")
+	parser.add_argument("--stage", action="append", metavar="PREFIX",
+	                    help="Only run stages whose name starts with PREFIX (may be repeated)")
+	parser.add_argument("--fixture-dir", type=pathlib.Path,
+	                    help="Directory to keep generated fixture databases in for reuse")
+	parser.add_argument("-o", "--output", type=pathlib.Path,
+	                    help="Write results as JSON to this file")
+	parser.add_argument("--compare", type=pathlib.Path, metavar="JSON",
+	                    help="Compare against the results stored in this file")
+	args = parser.parse_args(argv)
+
+	params = {"rows": args.rows, "shape": args.shape, "size": args.size, "key_type": args.key_type}
+
+	with tempfile.TemporaryDirectory() as tmpdir:
+		fixture_dir = args.fixture_dir or pathlib.Path(tmpdir)
+		fixture_dir.mkdir(parents=True, exist_ok=True)
+		db_path = fixture_dir / "bench-{rows}-{shape}-{size}-{key_type}.sqlite".format(**params)
+		if not db_path.exists():
+			fixtures.generate_database(db_path, args.rows, shape=args.shape, size=args.size,
+			                           key_type=args.key_type)
+
+		results = {}
+		for stage in make_stages(db_path):
+			if args.stage and not any(stage.name.startswith(p) for p in args.stage):
+				continue
+			results[stage.name] = measure(stage, args.repeat)
+
+	baseline = None
+	if args.compare:
+		with open(args.compare, "r", encoding="utf-8") as file:
+			baseline_report = json.load(file)
+		if baseline_report["meta"]["params"] != params:
+			print(f"Warning: Baseline was measured with different parameters: "
+			      f"{baseline_report['meta']['params']}", file=sys.stderr)
+		baseline = baseline_report["results"]
+	print_results(results, baseline)
+
+	if args.output:
+		report = {
+			"meta": {
+				"commit":   git_commit(),
+				"python":   platform.python_version(),
+				"platform": platform.platform(),
+				"time":     time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+				"params":   params,
+			},
+			"results": results,
+		}
+		with open(args.output, "w", encoding="utf-8") as file:
+			json.dump(report, file, indent="\t")
+			file.write("\n")
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""Check that starting the command-line interface stays within a time budget.
+
+Measures the best wall time of fresh interpreters running each snippet below,
+minus that of an interpreter doing nothing, and verifies that modules only
+needed by some commands (or by `--version`) are not imported eagerly. Exits
+with status 1 if any check fails, so it can be used as a regression test.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import subprocess
+import sys
+import time
+import typing as ty
+
+
+SNIPPETS = {
+	"import":    "import mozidbedit",
+	"--help":    "import mozidbedit, contextlib, io\n"
+	             "with contextlib.redirect_stdout(io.StringIO()):\n"
+	             "\ttry: mozidbedit.main(['--help'])\n"
+	             "\texcept SystemExit: pass",
+}
+
+#: Modules that must not be (fully) loaded by just importing the package
+DEFERRED_MODULES = (
+	"importlib.metadata",
+	"jmespath",
+	"pprint",
+	"mozidbedit.mozidb",
+	"mozidbedit.mozserial",
+	"mozidbedit.ccl_simplesnappy",
+)
+
+LOADED_MODULES_SNIPPET = """
+import sys, mozidbedit
+for name, module in sys.modules.items():
+	if type(module).__name__ != "_LazyModule":
+		print(name)
+"""
+
+
+def time_snippet(code: str, repeat: int) -> float:
+	"""Returns the best wall time of running `code` in a new interpreter"""
+	best = float("inf")
+	for _ in range(repeat):
+		start = time.perf_counter()
+		subprocess.run([sys.executable, "-c", code], check=True)
+		best = min(best, time.perf_counter() - start)
+	return best
+
+
+def loaded_modules() -> ty.Set[str]:
+	result = subprocess.run([sys.executable, "-c", LOADED_MODULES_SNIPPET],
+	                        check=True, capture_output=True, text=True)
+	return set(result.stdout.split())
+
+
+def main(argv=sys.argv[1:]) -> int:
+	parser = argparse.ArgumentParser(description=__doc__,
+	                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--budget-ms", type=float, default=30.0,
+	                    help="Maximum time in milliseconds each snippet may add to the "
+	                         "startup of a bare interpreter (default: %(default)s)")
+	parser.add_argument("--repeat", type=int, default=10,
+	                    help="Number of runs per snippet, the best is reported (default: %(default)s)")
+	args = parser.parse_args(argv)
+
+	failed = False
+
+	baseline = time_snippet("pass", args.repeat)
+	print(f"{'bare interpreter':<18} {baseline * 1000:7.1f} ms")
+	for name, code in SNIPPETS.items():
+		added = (time_snippet(code, args.repeat) - baseline) * 1000
+		status = "ok" if added <= args.budget_ms else "OVER BUDGET"
+		failed |= added > args.budget_ms
+		print(f"{name:<18} {added:+7.1f} ms  {status}")
+
+	eager = sorted(loaded_modules().intersection(DEFERRED_MODULES))
+	if eager:
+		failed = True
+		print(f"Eagerly imported: {', '.join(eager)}")
+
+	if failed:
+		print(f"Startup exceeds the budget of {args.budget_ms} ms, see `python3 -X importtime`",
+		      file=sys.stderr)
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+"""Check that values written by `mozidbedit.binfmt` are read back unchanged.
+
+Writes all records of the given databases, or of a generated corpus covering
+string, number, date, array and binary keys, with `binfmt.dump_records` and
+compares what `binfmt.load_records` returns with the records as decoded,
+both with and without `plain_ints`. Also checks a sample value holding every
+JavaScript type `mozserial` produces, and that loaded keys can be used as
+dictionary keys. Exits with status 1 on mismatches.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import array
+import datetime
+import io
+import pathlib
+import sys
+import tempfile
+import typing as ty
+
+import fixtures
+from mozidbedit import binfmt
+from mozidbedit import mozidb
+from mozidbedit import mozserial
+from mozidbedit.pretty import PrettyPrinter
+
+
+#: Generated databases: name → `fixtures.generate_database` arguments
+CORPUS = {
+	"strings": dict(rows=200),
+	"numbers": dict(rows=200, key_type="number"),
+	"dates":   dict(rows=200, key_type="date"),
+	"arrays":  dict(rows=200, key_type="array", shape="nested"),
+	"binary":  dict(rows=200, key_type="binary", shape="binary", size=1),
+}
+
+
+def sample_value() -> object:
+	"""Returns a value holding every type decoded values can have"""
+	map_obj = mozserial.JSMapObj()
+	map_obj[1] = "one"
+	map_obj["two"] = [2]
+	return {
+		"int32":    mozserial.JSInt32(5),
+		"bigint":   mozserial.JSBigInt(-2**70),
+		"objects":  [mozserial.JSBigIntObj(1), mozserial.JSBooleanObj(True),
+		             mozserial.JSNumberObj(1.5), mozserial.JSStringObj("text")],
+		"map":      map_obj,
+		"set":      mozserial.JSSetObj([1, "a"]),
+		"date":     datetime.datetime(2024, 2, 1, 10, 51, 6, 123000, tzinfo=datetime.timezone.utc),
+		"regexp":   mozserial.JSRegExpObj("ab+", mozserial.RegExpFlag(3)),
+		"buffers":  [memoryview(b"raw"), memoryview(array.array("d", [1.0, 2.5]))],
+		"special":  [None, NotImplemented, True, 0.5, "\ud800"],
+		mozserial.JSInt32(0): "integer property name",
+	}
+
+
+def same(expected: object, actual: object) -> bool:
+	# Maps, sets and regular expressions compare by identity, their printed
+	# representation (which includes their contents and types) does not
+	printer = PrettyPrinter()
+	return printer.pformat(expected) == printer.pformat(actual)
+
+
+def check_database(db_path: pathlib.Path) -> ty.List[str]:
+	"""Returns descriptions of all differences found in the given database"""
+	errors: ty.List[str] = []
+	for plain_ints in (False, True):
+		with mozidb.IndexedDB(db_path, readonly=True, plain_ints=plain_ints) as conn:
+			records = list(conn.iter_objects())
+		file = io.BytesIO()
+		binfmt.dump_records(records, file)
+		file.seek(0)
+		loaded = list(binfmt.load_records(file))
+
+		if len(loaded) != len(records):
+			errors.append(f"{db_path}: {len(loaded)} of {len(records)} records loaded")
+		for index, ((key, value), (loaded_key, loaded_value)) in enumerate(zip(records, loaded)):
+			if key != loaded_key or type(loaded_key) is list:
+				errors.append(f"{db_path}: key of record {index} differs: {loaded_key!r}")
+			elif not same(value, loaded_value):
+				errors.append(f"{db_path}: value of record {index} differs (plain_ints={plain_ints})")
+		try:
+			if len(dict(loaded)) != len(loaded):
+				errors.append(f"{db_path}: loaded keys are not distinct")
+		except TypeError as exc:
+			errors.append(f"{db_path}: loaded keys cannot be used as dictionary keys: {exc}")
+	return errors
+
+
+def main(argv=sys.argv[1:]) -> int:
+	parser = argparse.ArgumentParser(description=__doc__,
+	                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("paths", metavar="PATH", type=pathlib.Path, nargs="*",
+	                    help="Databases to check (default: a generated corpus)")
+	args = parser.parse_args(argv)
+
+	errors: ty.List[str] = []
+	value = sample_value()
+	if not same({k: (int(v) if type(v) is mozserial.JSInt32 else v) for k, v in value.items()},
+	            binfmt.loads(binfmt.dumps(value))):
+		errors.append("Sample value differs")
+
+	with tempfile.TemporaryDirectory() as tmpdir:
+		paths = args.paths
+		if not paths:
+			for name, options in CORPUS.items():
+				path = pathlib.Path(tmpdir) / f"{name}.sqlite"
+				fixtures.generate_database(path, **options)
+				paths.append(path)
+
+		for path in paths:
+			db_errors = check_database(path)
+			errors += db_errors
+			print(f"{str(path)[-40:]:<40}  {'MISMATCH' if db_errors else 'ok'}")
+
+	for error in errors:
+		print(error, file=sys.stderr)
+	return 1 if errors else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+"""Check that `mozidbedit.grep` finds the same strings as decoding everything.
+
+Searches the given databases, or a generated corpus holding Latin-1 and
+UTF-16 strings, for fixed text, case-insensitive text and regular expressions
+(including anchored ones) and compares the matches with those found by
+decoding every record and searching all of its strings. Exits with status 1
+on mismatches.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import pathlib
+import sys
+import tempfile
+import typing as ty
+
+import fixtures
+from mozidbedit import grep
+from mozidbedit import mozidb
+
+
+#: Patterns searched for: text → `grep.Pattern` options
+PATTERNS = {
+	"example42.org":    dict(),
+	"EXAMPLE42.ORG":    dict(ignore_case=True),
+	"tag1[0-9]":        dict(regex=True),
+	"^https://example": dict(regex=True),
+	r"\.org$":          dict(regex=True),
+	r"^admin":          dict(regex=True),
+	r"snowman$":        dict(regex=True),
+	r"\A☃\Z":           dict(regex=True, ignore_case=True),
+	r"(?<!\w)key-0+7\b": dict(regex=True),
+	"☃":                dict(),
+}
+
+#: Values with strings matching only anchored patterns at their edges
+STRINGS = [
+	"admin",
+	"admin@example.org",
+	"not an admin",
+	"let it snow, says the snowman",
+	"snowman ☃",
+	"☃",
+	{"nested": ["the snowman", "admin at home"]},
+]
+
+
+def generate_corpus(tmpdir: pathlib.Path) -> ty.List[pathlib.Path]:
+	flat = tmpdir / "flat.sqlite"
+	fixtures.generate_database(flat, rows=500)
+	strings = tmpdir / "strings.sqlite"
+	fixtures.write_database(strings, ((f"key-{index:08d}", value) for index, value in enumerate(STRINGS)))
+	return [flat, strings]
+
+
+def expected_matches(db_path: pathlib.Path, pattern: grep.Pattern) -> ty.List[tuple]:
+	"""Returns the key, path and text of the matches found by decoding and
+	searching every record"""
+	matches: ty.List[tuple] = []
+	with mozidb.IndexedDB(db_path, readonly=True, plain_ints=True) as conn:
+		for key, value in conn.iter_objects():
+			for _, text in grep.find_strings(key, pattern):
+				matches.append((key, (), text))
+			for path, text in grep.find_strings(value, pattern):
+				matches.append((key, path, text))
+	return matches
+
+
+def main(argv=sys.argv[1:]) -> int:
+	parser = argparse.ArgumentParser(description=__doc__,
+	                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("paths", metavar="PATH", type=pathlib.Path, nargs="*",
+	                    help="Databases to check (default: a generated corpus)")
+	args = parser.parse_args(argv)
+
+	errors: ty.List[str] = []
+	with tempfile.TemporaryDirectory() as tmpdir:
+		paths = args.paths or generate_corpus(pathlib.Path(tmpdir))
+
+		for path in paths:
+			for text, options in PATTERNS.items():
+				pattern = grep.Pattern(text, **options)
+				expected = expected_matches(path, pattern)
+				result = grep.grep_database(path, pattern)
+				found = [(match.key, match.path, match.text) for match in result.matches]
+				if result.error is not None or sorted(map(repr, found)) != sorted(map(repr, expected)):
+					errors.append(f"{path}: {text!r} {options}: found {len(result.matches)} "
+					              f"of {len(expected)} matches ({result.error or 'no error'})")
+				print(f"{str(path)[-30:]:<30}  {text:<20} {len(expected):6} matches  "
+				      f"{result.skipped:6} skipped  {result.decoded:6} decoded")
+
+	for error in errors:
+		print(error, file=sys.stderr)
+	return 1 if errors else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
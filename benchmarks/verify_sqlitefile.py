@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+"""Check that reading memory-mapped database files agrees with SQLite.
+
+Compares the `object_data` rows read by `mozidbedit.sqlitefile` with those
+returned by SQLite, and the output of `ccl_simplesnappy.decompress_buffer`
+with that of the stream-based `decompress`, for the given databases or a
+generated corpus covering deep B-trees, records spilling onto overflow pages
+and values stored in `.files` directories. Also prints the time taken to
+fetch and decompress all records both ways. Exits with status 1 on mismatches.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import io
+import pathlib
+import sys
+import tempfile
+import time
+import typing as ty
+
+import fixtures
+from mozidbedit import ccl_simplesnappy
+from mozidbedit import mozidb
+from mozidbedit import sqlitefile
+
+
+#: Generated databases: name → `fixtures.generate_database` arguments
+CORPUS = {
+	"small":     dict(rows=10),
+	"flat":      dict(rows=10000),
+	"nested":    dict(rows=1000, shape="nested"),
+	"overflow":  dict(rows=300, shape="binary", size=2),
+	"huge":      dict(rows=20, shape="binary", size=64),
+	"files":     dict(rows=100, shape="binary", size=8, file_threshold=4096),
+	"arraykeys": dict(rows=3000, key_type="array"),
+}
+
+#: Raw snappy streams using the element types the fixture compressor never writes
+SNAPPY_SAMPLES = (
+	bytes.fromhex("0a 08 61 62 63 0d 03"),           # 1-byte offset copy overlapping its output
+	bytes.fromhex("08 08 61 62 63 13 03 00 00 00"),  # 4-byte offset copy
+	bytes.fromhex("00"),                             # empty
+)
+
+
+def check_database(db_path: pathlib.Path) -> ty.List[str]:
+	"""Returns descriptions of all differences found in the given database"""
+	errors: ty.List[str] = []
+	with mozidb.IndexedDB(db_path, readonly=True) as conn:
+		expected = conn.execute("SELECT key, data, file_ids FROM object_data")
+		actual = sqlitefile.iter_object_data(conn)
+		for index, (row, raw_row) in enumerate(zip(expected, actual)):
+			key, data, file_ids = row
+			raw_key, raw_data, raw_file_ids = raw_row
+			if (key, data, file_ids) != (raw_key, bytes(raw_data), raw_file_ids):
+				errors.append(f"{db_path}: row {index} differs")
+				continue
+			if file_ids is None and \
+			   ccl_simplesnappy.decompress(io.BytesIO(data)) != ccl_simplesnappy.decompress_buffer(raw_data):
+				errors.append(f"{db_path}: decompressed data of row {index} differs")
+
+		# Both iterators must be exhausted at the same time
+		if next(expected, None) is not None or next(actual, None) is not None:
+			errors.append(f"{db_path}: different number of rows")
+	return errors
+
+
+def time_database(db_path: pathlib.Path, use_mmap: bool) -> float:
+	"""Returns the time taken to fetch and decompress all records"""
+	with mozidb.IndexedDB(db_path, readonly=True, mmap=use_mmap) as conn:
+		start = time.perf_counter()
+		if use_mmap:
+			rows = sqlitefile.iter_object_data(conn)
+		else:
+			rows = conn.execute("SELECT key, data, file_ids FROM object_data")
+		for _, data, file_ids in rows:
+			conn._decompress(data, file_ids)
+		return time.perf_counter() - start
+
+
+def main(argv=sys.argv[1:]) -> int:
+	parser = argparse.ArgumentParser(description=__doc__,
+	                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("paths", metavar="PATH", type=pathlib.Path, nargs="*",
+	                    help="Databases to check (default: a generated corpus)")
+	args = parser.parse_args(argv)
+
+	errors: ty.List[str] = []
+	for sample in SNAPPY_SAMPLES:
+		if ccl_simplesnappy.decompress(io.BytesIO(sample)) != ccl_simplesnappy.decompress_buffer(sample):
+			errors.append(f"Snappy sample {sample.hex(' ')} decompresses differently")
+
+	with tempfile.TemporaryDirectory() as tmpdir:
+		paths = args.paths
+		if not paths:
+			for name, options in CORPUS.items():
+				path = pathlib.Path(tmpdir) / f"{name}.sqlite"
+				fixtures.generate_database(path, **options)
+				paths.append(path)
+
+		print(f"{'database':<40} {'rows':>8} {'sqlite3':>10} {'mmap':>10}")
+		for path in paths:
+			db_errors = check_database(path)
+			errors += db_errors
+			with mozidb.IndexedDB(path, readonly=True) as conn:
+				rows = conn.count_objects()
+			sqlite_time = time_database(path, False)
+			mmap_time = time_database(path, True)
+			status = "MISMATCH" if db_errors else ""
+			print(f"{str(path)[-40:]:<40} {rows:>8} {sqlite_time * 1000:>8.1f}ms "
+			      f"{mmap_time * 1000:>8.1f}ms  {status}")
+
+	for error in errors:
+		print(error, file=sys.stderr)
+	return 1 if errors else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
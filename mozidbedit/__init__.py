@@ -7,31 +7,79 @@
 #   - extended by mirabilos, 2023.
 
 import argparse
+import array
+import base64
 import collections.abc
+import contextlib
 import datetime
-import importlib.metadata
+import importlib.util
 import json
 import pathlib
-import pprint
 import re
 import os
 import shlex
 import sys
+import types
 import typing as ty
 
-# import jmespath
+from . import profiling
+from . import stats
 
-from . import mozidb
-from . import mozserial
+
+def _lazy_import(name: str) -> types.ModuleType:
+	"""Imports the submodule `name` of this package, deferring its execution
+	until one of its attributes is first accessed
+	
+	Keeps the startup of commands not needing a module from paying for it.
+	Only used for modules of this package, as the stubs are visible to any
+	code importing them from `sys.modules` meanwhile.
+	"""
+	try:
+		return sys.modules[name]
+	except KeyError:
+		pass
+	spec = importlib.util.find_spec(name)
+	loader = importlib.util.LazyLoader(spec.loader)
+	spec.loader = loader
+	module = importlib.util.module_from_spec(spec)
+	sys.modules[name] = module
+	loader.exec_module(module)
+	return module
+
+
+dedup     = _lazy_import(__name__ + ".dedup")
+mozidb    = _lazy_import(__name__ + ".mozidb")
+mozserial = _lazy_import(__name__ + ".mozserial")
+profile   = _lazy_import(__name__ + ".profile")
 
 __dir__ = pathlib.Path(__file__).parent
-__version__ = importlib.metadata.version("moz-idb-edit")
 
 
-# #HACK: Make `IDBObjectWrapper` be considered a JavaScript Object type in JMESPath
-# import jmespath.functions
-# jmespath.functions.TYPES_MAP["IDBObjectWrapper"] = "object"
-# jmespath.functions.REVERSE_TYPES_MAP["object"] += ("IDBObjectWrapper",)
+def _read_version() -> str:
+	import importlib.metadata
+	return importlib.metadata.version("moz-idb-edit")
+
+
+def __getattr__(name: str) -> object:
+	# Resolving the version scans the installed packages, so only do so on demand
+	if name == "__version__":
+		globals()[name] = value = _read_version()
+		return value
+	elif name == "PrettyPrinter":
+		from .pretty import PrettyPrinter
+		return PrettyPrinter
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _import_jmespath() -> types.ModuleType:
+	import jmespath
+	import jmespath.functions
+	
+	#HACK: Make `IDBObjectWrapper` be considered a JavaScript Object type in JMESPath
+	if "IDBObjectWrapper" not in jmespath.functions.TYPES_MAP:
+		jmespath.functions.TYPES_MAP["IDBObjectWrapper"] = "object"
+		jmespath.functions.REVERSE_TYPES_MAP["object"] += ("IDBObjectWrapper",)
+	return jmespath
 
 
 USER_CONTEXT_WEB_EXT = "userContextIdInternal.webextStorageLocal"
@@ -91,57 +139,48 @@ def find_uuid_by_ext_id(profile_dir: pathlib.Path, ext_id: str) -> ty.Optional[s
 def find_uuid_by_ext_id(profile_dir: pathlib.Path, ext_id: ty.Iterable[str]) -> ty.List[ty.Optional[str]]:
 	...
 
-# def find_uuid_by_ext_id(profile_dir: pathlib.Path, ext_id: str | ty.Iterable[str]) \
-#     -> ty.Optional[str] | ty.List[ty.Optional[str]]:
-def find_uuid_by_ext_id(profile_dir: pathlib.Path, ext_id: str) \
-    -> ty.Optional[str]:
-	for name, value in read_user_prefs(profile_dir / "prefs.js"):
-		if name == "extensions.webextensions.uuids":
-			try:
-				value = json.loads(value)
-				if not isinstance(ext_id, str):
-					return [value.get(x, None) for x in ext_id]
-				else:
-					return value.get(ext_id, None)
-			except ValueError:
-				pass
+def find_uuid_by_ext_id(profile_dir: pathlib.Path, ext_id: ty.Union[str, ty.Iterable[str]]) \
+    -> ty.Union[ty.Optional[str], ty.List[ty.Optional[str]]]:
+	index = profile.get_index(profile_dir)
+	if not isinstance(ext_id, str):
+		return [index.ext_uuid(x) for x in ext_id]
+	return index.ext_uuid(ext_id)
 
-def find_ext_info(profile_dir: pathlib.Path) -> ty.Iterator[ty.Tuple[str, str]]:
-	with open(profile_dir / "extensions.json", "rb") as f:
-		ext_data = json.load(f)
-	assert ext_data.get("schemaVersion") in [36, 33]
-	if not ext_data.get("addons"):
-		return
 
-	for extension in ext_data["addons"]:
-		yield extension["id"], extension["defaultLocale"]["name"]
+def find_ext_info(profile_dir: pathlib.Path) -> ty.Iterator[ty.Tuple[str, str]]:
+	return iter(profile.get_index(profile_dir).extensions())
 
 
 def find_context_id_by_name(profile_dir: pathlib.Path, name: str) -> int:
-	for ctx_id, ctx_name in read_user_contexts(profile_dir):
-		if ctx_name == name:
-			return ctx_id
-
-	if name == USER_CONTEXT_WEB_EXT:
-		return 4294967295  # Default value (-1 as unsigned 32-value)
-	else:
-		raise KeyError(name)
+	return profile.get_index(profile_dir).context_id(name)
 
 
 def find_context_name_by_id(profile_dir: pathlib.Path, id: int) -> str:
-	for ctx_id, ctx_name in read_user_contexts(profile_dir):
-		if ctx_id == id:
-			return ctx_name
-
-	raise KeyError(id)
+	return profile.get_index(profile_dir).context_name(id)
 
 
 class IDBObjectWrapper(collections.abc.Mapping):
-	def __init__(self, conn: mozidb.IndexedDB):
+	"""Read-only mapping of the keys of a database to their decoded values
+
+	Values in `prefetched` are returned without reading them again. The keys
+	of all other records read are collected in `accessed`, which becomes
+	`None` once all records were read.
+	"""
+	accessed: ty.Optional[ty.Set[object]]
+
+	def __init__(self, conn: "mozidb.IndexedDB", prefetched: ty.Optional[ty.Dict[object, object]] = None):
 		self._conn = conn
+		self._prefetched = prefetched or {}
+		self.accessed = set()
 
 	def __getitem__(self, name: str) -> object:
-		return self._conn.read_object(name)
+		try:
+			return self._prefetched[name]
+		except KeyError:
+			value = self._conn.read_object(name)
+			if self.accessed is not None:
+				self.accessed.add(name)
+			return value
 
 	def __iter__(self) -> ty.Iterator[object]:
 		yield from self._conn.list_objects()
@@ -157,145 +196,14 @@ class IDBObjectWrapper(collections.abc.Mapping):
 		return self._conn.list_objects()
 
 	def items(self) -> ty.Iterable[ty.Tuple[object, object]]:
+		self.accessed = None
 		return self._conn.read_objects().items()
 
 	def values(self) -> ty.Iterable[object]:
+		self.accessed = None
 		return self._conn.read_objects().values()
 
 
-def _safe_repr(object, context, maxlevels, level, sort_dicts):
-	"""A repr function that returns more JSON-like output for primitive types
-
-	Code copied from Python 3.9 stdlib pprint.py module.
-	"""
-	if object is NotImplemented:
-		return "undefined", True, False
-
-	typ = type(object)
-	if typ in _builtin_scalars:
-		# This is the actual patch: Use the JSON library to generate `repr` for
-		# all primitive types
-		return json.dumps(object, ensure_ascii=False), True, False
-
-	r = getattr(typ, "__repr__", None)
-	# Also allow our custom type to be treated as dict
-	if issubclass(typ, (dict, IDBObjectWrapper)) and \
-	   r in (dict.__repr__, IDBObjectWrapper.__repr__):
-		if not object:
-			return "{}", True, False
-		objid = id(object)
-		if maxlevels and level >= maxlevels:
-			return "{...}", False, objid in context
-		if objid in context:
-			return _recursion(object), False, True
-		context[objid] = 1
-		readable = True
-		recursive = False
-		components = []
-		append = components.append
-		level += 1
-		if sort_dicts:
-			items = sorted(object.items(), key=_safe_tuple)
-		else:
-			items = object.items()
-		for k, v in items:
-			krepr, kreadable, krecur = _safe_repr(k, context, maxlevels, level, sort_dicts)
-			vrepr, vreadable, vrecur = _safe_repr(v, context, maxlevels, level, sort_dicts)
-			append("%s: %s" % (krepr, vrepr))
-			readable = readable and kreadable and vreadable
-			if krecur or vrecur:
-				recursive = True
-		del context[objid]
-		return "{%s}" % ", ".join(components), readable, recursive
-
-	if (issubclass(typ, list) and r is list.__repr__) or \
-	   (issubclass(typ, tuple) and r is tuple.__repr__):
-		if issubclass(typ, list):
-			if not object:
-				return "[]", True, False
-			format = "[%s]"
-		elif len(object) == 1:
-			format = "(%s,)"
-		else:
-			if not object:
-				return "()", True, False
-			format = "(%s)"
-		objid = id(object)
-		if maxlevels and level >= maxlevels:
-			return format % "...", False, objid in context
-		if objid in context:
-			return _recursion(object), False, True
-		context[objid] = 1
-		readable = True
-		recursive = False
-		components = []
-		append = components.append
-		level += 1
-		for o in object:
-			orepr, oreadable, orecur = _safe_repr(o, context, maxlevels, level, sort_dicts)
-			append(orepr)
-			if not oreadable:
-				readable = False
-			if orecur:
-				recursive = True
-		del context[objid]
-		return format % ", ".join(components), readable, recursive
-
-	rep = repr(object)
-	return rep, (rep and not rep.startswith("<")), False
-
-_builtin_scalars = frozenset({str, bytes, bytearray, int, float, complex,
-                              bool, type(None)})
-
-def _recursion(object):
-	return ("<Recursion on %s with id=%s>"
-	        % (type(object).__name__, id(object)))
-
-class _safe_key:
-	"""Helper function for key functions when sorting unorderable objects.
-
-	The wrapped-object will fallback to a Py2.x style comparison for
-	unorderable types (sorting first comparing the type name and then by
-	the obj ids).  Does not work recursively, so dict.items() must have
-	_safe_key applied to both the key and the value.
-	"""
-
-	__slots__ = ["obj"]
-
-	def __init__(self, obj):
-		self.obj = obj
-
-	def __lt__(self, other):
-		try:
-			return self.obj < other.obj
-		except TypeError:
-			return ((str(type(self.obj)), id(self.obj)) < \
-			        (str(type(other.obj)), id(other.obj)))
-
-def _safe_tuple(t):
-	"Helper function for comparing 2-tuples"
-	return _safe_key(t[0]), _safe_key(t[1])
-
-
-class PrettyPrinter(pprint.PrettyPrinter):
-	def format(self, object, context, maxlevels, level):
-		return _safe_repr(object, context, maxlevels, level, self._sort_dicts)
-
-	# Break the maximum line length rules of pprint for strings (for which JSON
-	# doesn't support the multiline string concatenation) and all other types
-	# that were moded to have a non-default formatting to more closely align
-	# with JSON
-	_dispatch = pprint.PrettyPrinter._dispatch.copy()
-	for tp in (str, bool):
-		try:
-			del _dispatch[tp.__repr__]
-		except (AttributeError, KeyError):
-			pass
-
-	# Have our custom type be treated like a regular dict would
-	_dispatch[IDBObjectWrapper.__repr__] = pprint.PrettyPrinter._pprint_dict
-
-
 def find_default_profile_dir() -> ty.Optional[pathlib.Path]:
 	# Determine system default Mozilla directory
 	import platform
@@ -339,6 +247,13 @@ def discover_idbs(sitebase):
 	return dbs
 
 
+def find_profile_databases(profile_dir: pathlib.Path) -> ty.Iterator[pathlib.Path]:
+	"""Yields the paths of the IndexedDB databases of all sites and extensions
+	in the given profile directory"""
+	for repository in ("permanent", "default", "temporary"):
+		yield from sorted((profile_dir / "storage" / repository).glob("*/idb/*.sqlite"))
+
+
 def to_json(obj):
 	# Convert JS object types to basic types
 	if isinstance(obj, bool) or isinstance(obj, mozserial.JSBooleanObj):
@@ -357,8 +272,12 @@ def to_json(obj):
 		return value if not value.endswith("+00:00") else value[:-6] + "Z"
 	elif isinstance(obj, mozserial.JSRegExpObj):  # JS RegExp → string
 		return str(obj)
+	elif isinstance(obj, mozserial.Float16Array):  # binary → base64 (of the 16-bit floats)
+		return base64.b64encode(obj.tobytes()).decode("ascii")
+	elif isinstance(obj, (bytes, bytearray, memoryview, array.array)):  # binary → base64
+		return base64.b64encode(obj).decode("ascii")
 	
-	elif isinstance(obj, list):  # Note: Set isn’t implemented
+	elif isinstance(obj, (list, tuple, mozserial.JSSetObj)):
 		return [to_json(item) for item in obj]
 	elif isinstance(obj, collections.abc.Mapping):
 		return {
@@ -385,18 +304,30 @@ def resolve_profile_dir(
 	return profile_path, profile_path / "storage" / "permanent" #"default"
 
 
-def handle_list_extensions(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
-	profile_path, storage_path = resolve_profile_dir(parser, args)
+def decode_origin(dir_name: str) -> ty.Tuple[str, str]:
+	"""Returns the origin encoded in the name of a site's storage directory
+	and the user context ID it is suffixed with (empty if none)"""
+	encoded_origin, ctx_name = dir_name, ""
+	if "^userContextId=" in encoded_origin:
+		encoded_origin, ctx_name = encoded_origin.split("^userContextId=", 1)
 	
-	# Special extension storage ID
-	ctx_id = find_context_id_by_name(profile_path, USER_CONTEXT_WEB_EXT)
-	
-	ext_infos = sorted(find_ext_info(profile_path))
-	ext_uuids = find_uuid_by_ext_id(profile_path, map(lambda x: x[0], ext_infos))
+	scheme, netloc = encoded_origin.split("+++", 1)
+	if scheme == "file":
+		netloc = netloc.replace("+", "/")
+	else:
+		netloc = netloc.replace("+", ":")
+	return scheme + "://" + netloc, ctx_name
 
-	for (ext_id, ext_name), ext_uuid in zip(ext_infos, ext_uuids):
-		db_path = storage_path / f"moz-extension+++{ext_uuid}^userContextId={ctx_id}"
-		db_path = db_path / "idb" / "3647222921wleabcEoxlt-eengsairo.sqlite"
+
+def handle_list_extensions(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+	profile_path, _ = resolve_profile_dir(parser, args)
+	index = profile.get_index(profile_path)
+	
+	for ext_id, ext_name in sorted(index.extensions()):
+		ext_dir = index.extension_dir(ext_id)
+		if ext_dir is None:
+			continue
+		db_path = ext_dir / "idb" / "3647222921wleabcEoxlt-eengsairo.sqlite"
 		if db_path.exists():
 			print("--extension", shlex.quote(ext_id), " #", ext_name)
 	return 0
@@ -417,9 +348,8 @@ def handle_list_sites(parser: argparse.ArgumentParser, args: argparse.Namespace)
 			# Skip sites not having any indexed IB stored
 			continue
 		
-		encoded_origin, ctx_name = dirpath.name, ""
-		if "^userContextId=" in encoded_origin:
-			encoded_origin, ctx_name = encoded_origin.split("^userContextId=", 1)
+		origin, ctx_name = decode_origin(dirpath.name)
+		if ctx_name:
 			try:
 				ctx_id = int(ctx_name)
 			except ValueError:
@@ -430,13 +360,6 @@ def handle_list_sites(parser: argparse.ArgumentParser, args: argparse.Namespace)
 				except KeyError:
 					pass  # Also keep unknown context IDs as-is
 		
-		scheme, netloc = encoded_origin.split("+++", 1)
-		if scheme == "file":
-			netloc = netloc.replace("+", "/")
-		else:
-			netloc = netloc.replace("+", ":")
-		origin = scheme + "://" + netloc
-		
 		dbs = list(discover_idbs(storage_path / dirpath.name / "idb"))
 		sites.append((origin, ctx_name, dbs))
 	sites.sort()
@@ -453,77 +376,478 @@ def handle_list_sites(parser: argparse.ArgumentParser, args: argparse.Namespace)
 	return 0
 
 
-def handle_read(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
-	profile_path, storage_path = resolve_profile_dir(parser, args)
-	db_path: ty.Optional[pathlib.Path] = args.dbpath
+def find_db_path(
+		profile_path: pathlib.Path,
+		storage_path: pathlib.Path,
+		*,
+		extension: ty.Optional[str] = None,
+		site: ty.Optional[str] = None,
+		sdb: ty.Optional[str] = None,
+		userctx: ty.Optional[str] = None,
+		dbpath: ty.Optional[pathlib.Path] = None,
+) -> pathlib.Path:
+	"""Determines the path of the database of the given extension or site
+	
+	Raises `KeyError` if the extension is not installed and `ValueError` if the
+	given options do not refer to an existing database.
+	"""
+	db_path = dbpath
 	
 	ctx_id = 0  # Use default
-	if args.userctx:
+	if userctx:
 		try:
-			ctx_id = int(args.userctx)
+			ctx_id = int(userctx)
 		except ValueError:
-			ctx_id = find_context_id_by_name(profile_path, args.userctx)
-	
-	# Collect required extra data for figuring out extension paths
-	if args.extension:
-		# Map extension ID to browser internal UUID
-		ext_uuid = find_uuid_by_ext_id(profile_path, args.extension)
-		if ext_uuid is None:
-			print(f"Failed to look up internal UUID for extension ID: {ext_uuid} (is the extension installed?)", file=sys.stderr)
-			return 1
-		
-		# Use special extension storage ID if no other was set
-		if userctx == 0:
-			ctx_id = find_context_id_by_name(profile_path, USER_CONTEXT_WEB_EXT)
-		
-		origin_label = f"moz-extension+++{ext_uuid}"
+			ctx_id = find_context_id_by_name(profile_path, userctx)
+	
+	if extension:
+		# Map extension ID to its storage directory, using the special extension
+		# storage context if no other was set
+		ext_dir = profile.get_index(profile_path).extension_dir(extension, ctx_id or None)
+		if ext_dir is None:
+			raise KeyError(extension)
 		
 		if not db_path:
-			if ctx_id:
-				origin_label += f"^userContextId={ctx_id}"
-			
-			db_path = storage_path / origin_label
-			db_path = db_path / "idb" / "3647222921wleabcEoxlt-eengsairo.sqlite"
-	elif args.site:
-		site_name = args.site.replace(":", "+").replace("/", "+")
+			db_path = ext_dir / "idb" / "3647222921wleabcEoxlt-eengsairo.sqlite"
+	elif site:
+		site_name = site.replace(":", "+").replace("/", "+")
 		if ctx_id != 0:
 			site_name += f"^userContextId={ctx_id}"
 		
 		site_base = storage_path / site_name / "idb"
 		if not site_base.is_dir():
-			parser.error("Invalid --site given (pass --list-sites to list)")
-			return 1
+			raise ValueError("Invalid --site given (pass --list-sites to list)")
 		
-		db_path = site_base / args.sdb
+		db_path = site_base / (sdb or "")
 		if not db_path.is_file():
 			dbs = discover_idbs(site_base)
-			if args.sdb in dbs:
-				db_path = dbs[args.sdb]
-		if not db_path.exists():
-			parser.error("Invalid --sdb given (omit --sdb with --site to list)")
+			if sdb in dbs:
+				db_path = dbs[sdb]
+		if not db_path.is_file():
+			raise ValueError("Invalid --sdb given (omit --sdb with --site to list)")
 	else:
+		if not db_path or not db_path.is_file():
+			raise ValueError("Invalid --dbpath given")
+	
+	return db_path
+
+
+def resolve_db_path(
+		parser: argparse.ArgumentParser,
+		args: argparse.Namespace,
+) -> ty.Optional[pathlib.Path]:
+	db_path: ty.Optional[pathlib.Path] = args.dbpath
+	if db_path and not args.extension and not args.site:
 		if not db_path.is_file():
 			parser.error("Invalid --dbpath given")
+		return db_path
+	
+	profile_path, storage_path = resolve_profile_dir(parser, args)
+	
+	try:
+		db_path = find_db_path(profile_path, storage_path, extension=args.extension,
+		                       site=args.site, sdb=args.sdb, userctx=args.userctx,
+		                       dbpath=db_path)
+	except KeyError:
+		print(f"Failed to look up internal UUID for extension ID: {args.extension} (is the extension installed?)", file=sys.stderr)
+		return None
+	except ValueError as exc:
+		parser.error(str(exc))
 	
 	print(f"Using database path: {db_path}", file=sys.stderr)
+	return db_path
+
+
+def new_stats(args: argparse.Namespace) -> ty.Optional[stats.Stats]:
+	if args.stats or args.stats_json:
+		return stats.Stats()
+	return None
+
+
+def report_stats(args: argparse.Namespace, run_stats: ty.Optional[stats.Stats]) -> None:
+	if run_stats is None:
+		return
+	
+	if args.stats:
+		print(run_stats.format_table(), file=sys.stderr)
+	if args.stats_json:
+		with open(args.stats_json, "w", encoding="utf-8") as file:
+			json.dump(run_stats.to_dict(), file, indent="\t")
+			file.write("\n")
+
+
+def new_decode_cache(args: argparse.Namespace) -> ty.Optional["dedup.DecodeCache"]:
+	if args.decode_cache or args.decode_cache_path:
+		from . import diskcache
+		return diskcache.DiskCache(args.decode_cache_path,
+		                           max_disk_bytes=int(args.decode_cache_size * 2**20))
+	if args.dedup:
+		# Values are only printed or serialized, so they may be shared
+		return dedup.DecodeCache(shared=True)
+	return None
+
+
+def close_decode_cache(decode_cache: ty.Optional["dedup.DecodeCache"]) -> None:
+	if decode_cache is not None:
+		decode_cache.close()
+		print(decode_cache.summary(), file=sys.stderr)
+
+
+def check_mmap(args: argparse.Namespace, db_path: pathlib.Path) -> bool:
+	if args.mmap:
+		from . import sqlitefile
+		journal_path = sqlitefile.pending_journal(db_path)
+		if journal_path is not None:
+			print(f"Cannot use --mmap, database has pending changes in: {journal_path} "
+			      f"(is it in use?)", file=sys.stderr)
+			return False
+	return True
+
+
+@contextlib.contextmanager
+def open_snapshot(args: argparse.Namespace, db_path: pathlib.Path,
+                  run_stats: ty.Optional[stats.Stats]) -> ty.Iterator[ty.Optional[pathlib.Path]]:
+	"""Yields the path of a snapshot of the database if requested (or `None`
+	if taking it failed), or else the path of the database itself"""
+	if not args.snapshot:
+		yield db_path
+		return
+	
+	import sqlite3
+	from . import snapshot
+	try:
+		db_snapshot = snapshot.Snapshot(db_path, directory=args.snapshot_dir, stats=run_stats)
+	except (OSError, sqlite3.Error) as exc:
+		print(f"Cannot take snapshot of database: {exc}", file=sys.stderr)
+		yield None
+		return
+	
+	with db_snapshot:
+		seconds = db_snapshot.time_ns / 1e9
+		rate = db_snapshot.bytes_copied / seconds / 2**20 if seconds else 0.0
+		print(f"Took snapshot of {db_snapshot.bytes_copied / 2**20:.2f} MiB in {seconds * 1000:.1f} ms "
+		      f"({rate:.0f} MiB/s): {db_snapshot.path}", file=sys.stderr)
+		yield db_snapshot.path
+
+
+def handle_read(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+	db_path = resolve_db_path(parser, args)
+	if db_path is None:
+		return 1
+	
+	run_stats = new_stats(args)
+	decode_cache = new_decode_cache(args)
+	with open_snapshot(args, db_path, run_stats) as db_path:
+		if db_path is None or not check_mmap(args, db_path):
+			return 1
+		read_database(args, db_path, run_stats, decode_cache)
+	
+	report_stats(args, run_stats)
+	close_decode_cache(decode_cache)
+	return 0
+
+
+def read_database(args: argparse.Namespace, db_path: pathlib.Path,
+                  run_stats: ty.Optional[stats.Stats],
+                  decode_cache: ty.Optional["dedup.DecodeCache"] = None) -> None:
+	from . import query
+	
+	explain = None
+	if args.explain:
+		explain = lambda line: print(line, file=sys.stderr)
+	
+	with mozidb.IndexedDB(db_path, stats=run_stats, mmap=args.mmap,
+	                      decode_cache=decode_cache) as conn:
+		value = query.search(conn, args.key_name, explain=explain)
+		if args.output == "json":
+			with conn.stage("to_json"):
+				value = to_json(value)
+		with conn.stage("output") as stage:
+			# Only count the output size when it is reported
+			output = sys.stdout if run_stats is None else stats.CountingWriter(sys.stdout, stage)
+			if args.output == "full":
+				from .pretty import PrettyPrinter
+				PrettyPrinter(stream=output).pprint(value)
+			else:
+				json.dump(value, output, ensure_ascii=False, indent="\t")
+
+
+def handle_export(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+	db_path = resolve_db_path(parser, args)
+	if db_path is None:
+		return 1
+	
+	try:
+		if args.format == "msgpack":
+			from . import binfmt
+		else:
+			from . import columnar
+	except ImportError as exc:
+		print(f"Cannot export: {exc}", file=sys.stderr)
+		return 1
+	
+	# Columns are typed by Arrow (and MessagePack keeps integers apart from
+	# floats), so there is no need for `JSInt32` wrappers
+	run_stats = new_stats(args)
+	decode_cache = new_decode_cache(args)
+	with open_snapshot(args, db_path, run_stats) as db_path:
+		if db_path is None or not check_mmap(args, db_path):
+			return 1
+		with mozidb.IndexedDB(db_path, plain_ints=True, stats=run_stats, mmap=args.mmap,
+		                      decode_cache=decode_cache) as conn:
+			if args.format == "msgpack":
+				with open(args.output_path, "wb") as file:
+					row_count = binfmt.dump_records(conn.iter_objects(), file)
+			else:
+				row_count = columnar.write_table(conn, args.output_path, args.format,
+				                                 batch_size=args.batch_size)
+	
+	print(f"Exported {row_count} records to: {args.output_path}", file=sys.stderr)
+	report_stats(args, run_stats)
+	close_decode_cache(decode_cache)
+	return 0
+
+
+class _VersionAction(argparse.Action):
+	"""Like `action="version"`, but only looks up the version when requested"""
+	def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS,
+	             help="show program's version number and exit"):
+		super().__init__(option_strings=option_strings, dest=dest, default=default,
+		                 nargs=0, help=help)
+	
+	def __call__(self, parser, namespace, values, option_string=None):
+		print(f"{parser.prog} {_read_version()}")
+		parser.exit()
+
+
+def handle_changes(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+	db_path = resolve_db_path(parser, args)
+	if db_path is None:
+		return 1
+	
+	from . import incremental
+	
+	counts = {"put": 0, "delete": 0}
+	with mozidb.IndexedDB(db_path, plain_ints=True) as conn, \
+	     incremental.ChangeTracker(args.state) as tracker:
+		for change in tracker.changes(conn, full=args.full):
+			event = {"op": change.op, "store": change.store, "key": to_json(change.key)}
+			if change.op == "put":
+				event["value"] = to_json(change.value)
+			json.dump(event, sys.stdout, ensure_ascii=False)
+			sys.stdout.write("\n")
+			counts[change.op] += 1
+	
+	print(f"{counts['put']} records added or modified, {counts['delete']} deleted", file=sys.stderr)
+	return 0
+
+
+def handle_watch(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+	from . import watch
+
+	find_databases: ty.Callable[[], ty.Iterable[pathlib.Path]]
+	if args.all:
+		if args.extension or args.site or args.dbpath:
+			parser.error("argument --all cannot be combined with a database selection")
+		profile_path, _ = resolve_profile_dir(parser, args)
+		find_databases = lambda: find_profile_databases(profile_path)
+	else:
+		db_path = resolve_db_path(parser, args)
+		if db_path is None:
+			return 1
+		find_databases = lambda: [db_path] if db_path.is_file() else []
+
+	decode_cache = new_decode_cache(args)
+	watcher = watch.Watcher(find_databases, interval=args.interval,
+	                        use_inotify=not args.no_inotify, decode_cache=decode_cache)
+	try:
+		for db_path, change in watcher.run(initial=args.initial):
+			event = {"op": change.op, "store": change.store, "key": to_json(change.key)}
+			if args.all:
+				event = {"db": str(db_path), **event}
+			if change.op == "put":
+				event["value"] = to_json(change.value)
+			json.dump(event, sys.stdout, ensure_ascii=False)
+			sys.stdout.write("\n")
+			sys.stdout.flush()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		watcher.close()
+	close_decode_cache(decode_cache)
+	return 0
+
+
+def handle_carve(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+	db_path = resolve_db_path(parser, args)
+	if db_path is None:
+		return 1
+	
+	from . import carve
+	
+	count = 0
+	for record in carve.carve(db_path, jobs=args.jobs, all_pages=args.all_pages,
+	                          include_live=args.include_live, unique=args.unique):
+		event = {"source": record.source, "offset": record.offset, "page": record.page,
+		         "region": record.region, "key": record.key, "value": record.value}
+		if record.file_ids is not None:
+			event["file_ids"] = record.file_ids
+		json.dump(event, sys.stdout, ensure_ascii=False)
+		sys.stdout.write("\n")
+		count += 1
+	
+	print(f"{count} records recovered", file=sys.stderr)
+	return 0
+
+
+def resolve_db_paths(parser: argparse.ArgumentParser, args: argparse.Namespace) \
+    -> ty.Tuple[ty.Optional[ty.List[pathlib.Path]], ty.Optional["profile.ProfileIndex"]]:
+	"""Returns the selected database (or all databases of the profile if
+	`--all` was passed) and the index of the profile, if any"""
+	if args.all:
+		if args.extension or args.site or args.dbpath:
+			parser.error("argument --all cannot be combined with a database selection")
+		profile_path, _ = resolve_profile_dir(parser, args)
+		return list(find_profile_databases(profile_path)), profile.get_index(profile_path)
+	
+	db_path = resolve_db_path(parser, args)
+	if db_path is None:
+		return None, None
+	if args.profile or args.extension or args.site:
+		return [db_path], profile.get_index(resolve_profile_dir(parser, args)[0])
+	return [db_path], None
+
+
+def origin_label(db_path: pathlib.Path, index: ty.Optional["profile.ProfileIndex"]) -> str:
+	"""Describes the site or extension a database belongs to"""
+	# Databases of a profile are stored as `<origin>/idb/<name>.sqlite`
+	if db_path.parent.name != "idb":
+		return str(db_path.parent)
+	site_dir = db_path.parent.parent
+	ext_id = index.extension_by_dir(site_dir) if index is not None else None
+	if ext_id is not None:
+		return f"{ext_id} (extension)"
+	if "+++" not in site_dir.name:
+		return site_dir.name
 	
-	# with mozidb.IndexedDB(db_path) as conn:
-	# 	value = jmespath.search(args.key_name, IDBObjectWrapper(conn))
-	# 	if args.output == "full":
-	# 		pretty_printer = PrettyPrinter()
-	# 		pretty_printer.pprint(value)
-	# 	else:  # JSON
-	# 		json.dump(to_json(value), sys.stdout, ensure_ascii=False, indent="\t")
+	origin, ctx_name = decode_origin(site_dir.name)
+	if ctx_name and index is not None:
+		try:
+			ctx_name = index.context_name(int(ctx_name))
+		except (ValueError, KeyError):
+			pass  # Keep invalid or unknown context IDs as-is
+	return f"{origin} ({ctx_name})" if ctx_name else origin
+
+
+def handle_analyze(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+	from . import analyze
+	
+	db_paths, index = resolve_db_paths(parser, args)
+	if db_paths is None:
+		return 1
+	
+	report = analyze.Report()
+	for usage in analyze.analyze(db_paths, top=args.top, jobs=args.jobs):
+		origin = origin_label(usage.path, index)
+		report.add(usage, origin, f"{origin} {usage.name or usage.path.name}")
+	
+	for path, error in report.errors:
+		print(f"Could not analyze {path}: {error}", file=sys.stderr)
+	if args.json:
+		json.dump(report.to_dict(args.sort, args.top), sys.stdout, ensure_ascii=False, indent=2)
+		sys.stdout.write("\n")
+	else:
+		print(report.format_text(args.sort, args.top))
+	return 0
+
+
+def handle_grep(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+	from . import grep
+	
+	db_paths, index = resolve_db_paths(parser, args)
+	if db_paths is None:
+		return 1
+	
+	try:
+		pattern = grep.Pattern(args.pattern, regex=args.regex, ignore_case=args.ignore_case)
+	except re.error as exc:
+		parser.error(f"invalid regular expression: {exc}")
+	
+	databases = records = skipped = decoded = failed = found = 0
+	for result in grep.grep(db_paths, pattern, jobs=args.jobs):
+		databases += 1
+		records   += result.records
+		skipped   += result.skipped
+		decoded   += result.decoded
+		failed    += result.failed
+		if result.error is not None:
+			print(f"Could not search {result.path}: {result.error}", file=sys.stderr)
+			continue
+	
+		origin = origin_label(result.path, index)
+		database = result.name or result.path.name
+		for match in result.matches:
+			path = grep.format_path(match.key, match.path)
+			if args.json:
+				json.dump({"origin": origin, "database": database, "store": match.store,
+				           "key": to_json(match.key), "path": path, "text": match.text},
+				          sys.stdout, ensure_ascii=False)
+				sys.stdout.write("\n")
+			else:
+				print(f"{origin} {database}: {path}: {json.dumps(match.text, ensure_ascii=False)}")
+		found += len(result.matches)
+		sys.stdout.flush()
+	
+	print(f"Found {found} matches in {records} records of {databases} databases "
+	      f"({skipped} skipped without decompressing, {decoded} decoded"
+	      + (f", {failed} unreadable" if failed else "") + ")", file=sys.stderr)
+	return 0 if found else 1
+
+
+def handle_serve(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+	from . import server
+	
+	# Selecting databases by extension or site requires a profile, but
+	# databases may also be given by path only
+	profile = None
+	profile_path = args.profile or find_default_profile_dir()
+	if profile_path and profile_path.exists():
+		profile = resolve_profile_dir(parser, args)
 	
+	pool = server.ConnectionPool(idle_timeout=args.idle_timeout, max_size=args.max_connections)
+	rpc_server = server.Server(pool, profile)
+	try:
+		if args.socket:
+			print(f"Listening on: {args.socket}", file=sys.stderr)
+			server.serve_unix(rpc_server, args.socket)
+		else:
+			server.serve_stdio(rpc_server)
+	except FileExistsError as exc:
+		print(f"Cannot listen on {exc.filename}: {exc.strerror}", file=sys.stderr)
+		return 1
+	except KeyboardInterrupt:
+		pass
+	finally:
+		pool.close()
 	return 0
 
 
 def main(argv=sys.argv[1:], program=sys.argv[0]) -> int:
 	# Global parameters
 	parser = argparse.ArgumentParser(description=__doc__, prog=pathlib.Path(program).name)
-	parser.add_argument("-V", "--version", action="version", version="%(prog)s {0}".format(__version__))
+	parser.add_argument("-V", "--version", action=_VersionAction)
 	parser.add_argument("-profile", "--profile", metavar="PROFILE", type=pathlib.Path,
 	                    help="Path to the Firefox/MozTK application profile directory.")
+	parser.add_argument("--profile-run", choices=profiling.PROFILERS,
+	                    help="Run the command under the `cProfile` deterministic profiler or "
+	                         "a low-overhead sampling profiler and print the hottest functions.")
+	parser.add_argument("--profile-output", metavar="PREFIX", default="moz-idb-edit-profile",
+	                    help="Path prefix of the `.pstats` file (and `.collapsed` stack file "
+	                         "for flamegraphs when sampling) to write (default: %(default)s).")
+	parser.add_argument("--profile-own", action="store_true",
+	                    help="Only keep functions of moz-idb-edit itself in the profile.")
+	parser.add_argument("--profile-top", metavar="N", type=int, default=20,
+	                    help="Number of functions to print sorted by own time (default: %(default)s).")
 
 	# Specific parser actions:
 	subparsers = parser.add_subparsers(required=True)
@@ -541,7 +865,7 @@ def main(argv=sys.argv[1:], program=sys.argv[0]) -> int:
 	subparser_lsites.set_defaults(handler=handle_list_sites)
 	
 	#  → Read value(s) – structured or JSON
-	def add_read_args(subparser: argparse.ArgumentParser):
+	def add_db_args(subparser: argparse.ArgumentParser):
 		subparser.add_argument(
 			"-x", "--extension", action="store", metavar="EXT_ID",
 			help="Use database of the extension with the given Extension ID."
@@ -562,10 +886,74 @@ def main(argv=sys.argv[1:], program=sys.argv[0]) -> int:
 			help="Use given user context (“Firefox container”) when determining the "
 			     "database path."
 		)
+	
+	def add_stats_args(subparser: argparse.ArgumentParser):
+		subparser.add_argument(
+			"--stats", action="store_true",
+			help="Print time spent, bytes and records processed per stage of reading "
+			     "to stderr when done."
+		)
+		subparser.add_argument(
+			"--stats-json", action="store", metavar="PATH", type=pathlib.Path,
+			help="Write time spent, bytes and records processed per stage and database "
+			     "as JSON to the given file."
+		)
+	
+	def add_mmap_arg(subparser: argparse.ArgumentParser):
+		subparser.add_argument(
+			"--mmap", action="store_true",
+			help="Read records directly from the memory-mapped database file rather "
+			     "than through SQLite (only for copies not in use by Firefox)."
+		)
+	
+	def add_cache_args(subparser: argparse.ArgumentParser):
+		subparser.add_argument(
+			"--dedup", action="store_true",
+			help="Decode identical stored values only once, reusing the result for "
+			     "further copies, and print how many were reused to stderr."
+		)
+		subparser.add_argument(
+			"--decode-cache", action="store_true",
+			help="Keep decoded values in a cache database, so later runs reading the "
+			     "same values skip decoding them (implies --dedup)."
+		)
+		subparser.add_argument(
+			"--decode-cache-path", action="store", metavar="PATH", type=pathlib.Path,
+			help="Cache database to use (implies --decode-cache, default: "
+			     "~/.cache/moz-idb-edit/values.sqlite)."
+		)
+		subparser.add_argument(
+			"--decode-cache-size", action="store", metavar="MIB", type=float, default=1024,
+			help="Size of the cached values above which the least recently used ones "
+			     "are removed (default: %(default)s)."
+		)
+	
+	def add_snapshot_args(subparser: argparse.ArgumentParser):
+		subparser.add_argument(
+			"--snapshot", action="store_true",
+			help="Read from a consistent copy of the database, its write-ahead log and "
+			     "stored files rather than from the database itself (for databases in "
+			     "use by Firefox)."
+		)
+		subparser.add_argument(
+			"--snapshot-dir", action="store", metavar="DIR", type=pathlib.Path,
+			help="Directory to create the copy in (default: /dev/shm if available)."
+		)
+	
+	def add_read_args(subparser: argparse.ArgumentParser):
+		add_db_args(subparser)
+		add_stats_args(subparser)
+		add_mmap_arg(subparser)
+		add_snapshot_args(subparser)
+		add_cache_args(subparser)
 		subparser.add_argument(
 			"key_name", metavar="KEY", default="@", nargs="?",
 			help="JMESPath of the key to query."
 		)
+		subparser.add_argument(
+			"--explain", action="store_true",
+			help="Print which records were decoded to evaluate the query to stderr."
+		)
 	
 	subparser_read = subparsers.add_parser(
 		"read", help="Reads a value (possibly containing further values) belonging "
@@ -581,13 +969,186 @@ def main(argv=sys.argv[1:], program=sys.argv[0]) -> int:
 	subparser_read_json.set_defaults(handler=handle_read, output="json")
 	add_read_args(subparser_read_json)
 	
+	#  → Export all values in columnar form
+	subparser_export = subparsers.add_parser(
+		"export", help="Exports all values of the specified site or extension database "
+		               "as Apache Parquet or Feather file (requires `pyarrow`), or as "
+		               "type-preserving MessagePack file (requires `msgpack`).")
+	subparser_export.set_defaults(handler=handle_export)
+	add_db_args(subparser_export)
+	add_stats_args(subparser_export)
+	add_mmap_arg(subparser_export)
+	add_snapshot_args(subparser_export)
+	add_cache_args(subparser_export)
+	subparser_export.add_argument(
+		"-o", "--output", action="store", metavar="PATH", type=pathlib.Path,
+		required=True, dest="output_path",
+		help="Path of the file to write."
+	)
+	subparser_export.add_argument(
+		"-f", "--format", action="store", choices=("parquet", "feather", "msgpack"), default="parquet",
+		help="File format to write (default: %(default)s)."
+	)
+	subparser_export.add_argument(
+		"--batch-size", action="store", metavar="ROWS", type=int, default=10000,
+		help="Number of records decoded and written per record batch (default: %(default)s)."
+	)
+	
+	#  → Report changes since the last run
+	subparser_changes = subparsers.add_parser(
+		"changes", help="Prints the records of the specified site or extension database "
+		                "added, modified or deleted since the previous run as JSON lines, "
+		                "decoding only those records.")
+	subparser_changes.set_defaults(handler=handle_changes)
+	add_db_args(subparser_changes)
+	subparser_changes.add_argument(
+		"--state", action="store", metavar="PATH", type=pathlib.Path, required=True,
+		help="Database storing the state of previous runs (created if missing)."
+	)
+	subparser_changes.add_argument(
+		"--full", action="store_true",
+		help="Report all records as added, rather than only changes since the previous run."
+	)
+	
+	#  → Follow changes as they happen
+	subparser_watch = subparsers.add_parser(
+		"watch", help="Follows the specified site or extension database (or all databases "
+		              "of the profile) and prints records as they are added, modified or "
+		              "deleted as JSON lines until interrupted.")
+	subparser_watch.set_defaults(handler=handle_watch)
+	add_db_args(subparser_watch)
+	add_cache_args(subparser_watch)
+	subparser_watch.add_argument(
+		"--all", action="store_true",
+		help="Follow all site and extension databases of the profile, including ones "
+		     "created later, adding the database path to each line."
+	)
+	subparser_watch.add_argument(
+		"--interval", action="store", metavar="SECONDS", type=float, default=1.0,
+		help="How often to check for changes (default: %(default)s)."
+	)
+	subparser_watch.add_argument(
+		"--no-inotify", action="store_true",
+		help="Always check all databases every interval rather than waiting for "
+		     "file system notifications where available."
+	)
+	subparser_watch.add_argument(
+		"--initial", action="store_true",
+		help="Print all existing records first, rather than only later changes."
+	)
+
+	#  → Recover deleted records
+	subparser_carve = subparsers.add_parser(
+		"carve", help="Searches the unused space of the specified site or extension database "
+		              "and its write-ahead log for deleted records and prints them with "
+		              "their location as JSON lines.")
+	subparser_carve.set_defaults(handler=handle_carve)
+	add_db_args(subparser_carve)
+	subparser_carve.add_argument(
+		"-j", "--jobs", action="store", metavar="N", type=int,
+		help="Number of processes scanning pages in parallel (default: one per CPU)."
+	)
+	subparser_carve.add_argument(
+		"--all-pages", action="store_true",
+		help="Scan all pages entirely, not just free pages and the unused space of "
+		     "B-tree pages (for damaged files)."
+	)
+	subparser_carve.add_argument(
+		"--include-live", action="store_true",
+		help="Also report copies of records that still exist in the database."
+	)
+	subparser_carve.add_argument(
+		"--unique", action="store_true",
+		help="Report each distinct record only at the first location it was found at."
+	)
+	
+	#  → Report storage space used
+	subparser_analyze = subparsers.add_parser(
+		"analyze", help="Reports the origins, databases, object stores and records taking "
+		                "up the most space, compressed and uncompressed, without decoding "
+		                "any values.")
+	subparser_analyze.set_defaults(handler=handle_analyze)
+	add_db_args(subparser_analyze)
+	subparser_analyze.add_argument(
+		"--all", action="store_true",
+		help="Analyze all site and extension databases of the profile."
+	)
+	subparser_analyze.add_argument(
+		"-j", "--jobs", action="store", metavar="N", type=int,
+		help="Number of processes analyzing databases in parallel (default: one per CPU)."
+	)
+	subparser_analyze.add_argument(
+		"-n", "--top", action="store", metavar="N", type=int, default=10,
+		help="Number of entries listed per section (default: %(default)s)."
+	)
+	subparser_analyze.add_argument(
+		"--sort", action="store", choices=("stored", "uncompressed"), default="stored",
+		help="Size to rank entries by (default: %(default)s)."
+	)
+	subparser_analyze.add_argument(
+		"--json", action="store_true",
+		help="Print the report as JSON, with sizes in bytes."
+	)
+	
+	#  → Search values for text
+	subparser_grep = subparsers.add_parser(
+		"grep", help="Prints the path of each string matching the given text within the "
+		             "keys and values of the specified site or extension database (or of "
+		             "all databases of the profile), decoding only values containing it.")
+	subparser_grep.set_defaults(handler=handle_grep)
+	add_db_args(subparser_grep)
+	subparser_grep.add_argument(
+		"pattern", metavar="PATTERN",
+		help="Text to search for."
+	)
+	subparser_grep.add_argument(
+		"-E", "--regex", action="store_true",
+		help="Interpret PATTERN as Python regular expression."
+	)
+	subparser_grep.add_argument(
+		"-i", "--ignore-case", action="store_true",
+		help="Ignore case distinctions."
+	)
+	subparser_grep.add_argument(
+		"--all", action="store_true",
+		help="Search all site and extension databases of the profile."
+	)
+	subparser_grep.add_argument(
+		"-j", "--jobs", action="store", metavar="N", type=int,
+		help="Number of processes searching databases in parallel (default: one per CPU)."
+	)
+	subparser_grep.add_argument(
+		"--json", action="store_true",
+		help="Print each match as JSON line, with its object store and record key."
+	)
+	
+	#  → Answer queries from other processes
+	subparser_serve = subparsers.add_parser(
+		"serve", help="Answers JSON-RPC requests (`list`, `get`, `range` and `query`) "
+		              "read line by line from stdin or a Unix domain socket, keeping "
+		              "database connections open between requests.")
+	subparser_serve.set_defaults(handler=handle_serve)
+	subparser_serve.add_argument(
+		"--socket", action="store", metavar="PATH", type=pathlib.Path,
+		help="Listen on a Unix domain socket at the given path instead of using stdin/stdout "
+		     "(replacing a socket, but no other file, already there)."
+	)
+	subparser_serve.add_argument(
+		"--idle-timeout", action="store", metavar="SECONDS", type=float, default=300.0,
+		help="Close database connections unused for this long (default: %(default)s)."
+	)
+	subparser_serve.add_argument(
+		"--max-connections", action="store", metavar="N", type=int, default=16,
+		help="Maximum number of database connections kept open (default: %(default)s)."
+	)
 
 	
 	# Parse command-line arguments using `argparse`
 	args = parser.parse_args(argv)
 	
 	# Special condition checking: Mutual dependency between --sdb and --site
-	if args.handler is handle_read:
+	if args.handler in (handle_read, handle_export, handle_changes, handle_watch, handle_carve,
+	                    handle_analyze, handle_grep):
 		if args.sdb and not args.site:
 			parser.error("argument --site is required when using --sdb")
 			return 1
@@ -597,6 +1158,9 @@ def main(argv=sys.argv[1:], program=sys.argv[0]) -> int:
 			return 1
 	
 	# Dispatch to handler (calls the `.set_defaults(handler=…)` from above)
+	if args.profile_run:
+		return profiling.run(args.profile_run, lambda: args.handler(parser, args),
+		                     args.profile_output, own_only=args.profile_own, top=args.profile_top)
 	return args.handler(parser, args)
 
 
@@ -0,0 +1,222 @@
+"""asyncio interface for reading IndexedDB databases without blocking the event loop."""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import os
+import pathlib
+import typing as ty
+
+from . import mozidb
+from . import scheduler
+
+
+T = ty.TypeVar("T")
+
+
+class ByteLimiter:
+	"""Limits the total decompressed size of the values being decoded at the
+	same time, as read from their Snappy length headers
+
+	A value larger than `max_bytes` on its own is only admitted once nothing
+	else is being decoded, and nothing else is admitted until it is done.
+	"""
+	max_bytes: int
+	in_use:    int
+
+	def __init__(self, max_bytes: int = scheduler.DEFAULT_MAX_BYTES):
+		self.max_bytes = max_bytes
+		self.in_use    = 0
+		self._condition = asyncio.Condition()
+
+	@contextlib.asynccontextmanager
+	async def reserve(self, size: int) -> ty.AsyncIterator[None]:
+		async with self._condition:
+			await self._condition.wait_for(
+				lambda: self.in_use == 0 or self.in_use + size <= self.max_bytes
+			)
+			self.in_use += size
+		try:
+			yield
+		finally:
+			async with self._condition:
+				self.in_use -= size
+				self._condition.notify_all()
+
+
+class AsyncIndexedDB:
+	"""Reads an IndexedDB database from asyncio code
+
+	All SQLite calls run on a thread dedicated to this database, while values
+	are decoded using `executor` (the event loop's default executor if `None`).
+	At most `max_concurrency` values, of at most `max_decode_bytes` once
+	decompressed in total, are being decoded at any time; pass the same
+	`asyncio.Semaphore` as `limiter` and the same `ByteLimiter` as
+	`byte_limiter` to several databases to share the limits between them
+	instead.
+
+	Use as `async with AsyncIndexedDB(path) as db: …`, or call `open` and
+	`close` explicitly.
+	"""
+	dbpath:   ty.Union[os.PathLike, str]
+	executor: ty.Optional[concurrent.futures.Executor]
+
+	def __init__(
+			self,
+			dbpath: ty.Union[os.PathLike, str],
+			*,
+			executor: ty.Optional[concurrent.futures.Executor] = None,
+			max_concurrency: int = 4,
+			limiter: ty.Optional[asyncio.Semaphore] = None,
+			max_decode_bytes: int = scheduler.DEFAULT_MAX_BYTES,
+			byte_limiter: ty.Optional[ByteLimiter] = None,
+			**db_args,
+	):
+		self.dbpath   = dbpath
+		self.executor = executor
+		self._db_args = db_args
+		self._max_concurrency = max_concurrency
+		self._limiter = limiter
+		self._max_decode_bytes = max_decode_bytes
+		self._byte_limiter = byte_limiter
+		self._conn: ty.Optional[mozidb.IndexedDB] = None
+		self._io: ty.Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+	async def __aenter__(self) -> "AsyncIndexedDB":
+		await self.open()
+		return self
+
+	async def __aexit__(self, *exc_info) -> None:
+		await self.close()
+
+	async def open(self) -> None:
+		if self._limiter is None:
+			self._limiter = asyncio.Semaphore(self._max_concurrency)
+		if self._byte_limiter is None:
+			self._byte_limiter = ByteLimiter(self._max_decode_bytes)
+		self._io = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="mozidb-io")
+		self._conn = await self._call_io(mozidb.IndexedDB, self.dbpath, **self._db_args)
+
+	async def close(self) -> None:
+		if self._io is None:
+			return
+		try:
+			if self._conn is not None:
+				await self._call_io(self._conn.close)
+		finally:
+			self._conn = None
+			self._io.shutdown(wait=False)
+			self._io = None
+
+	async def _call_io(self, func: ty.Callable[..., T], *args, **kwargs) -> T:
+		if self._io is None:
+			raise ValueError("Database is not open")
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self._io, functools.partial(func, *args, **kwargs))
+
+	async def _call_decode(self, func: ty.Callable[..., T], *args, size: int = 0) -> T:
+		assert self._limiter is not None and self._byte_limiter is not None
+		async with self._limiter, self._byte_limiter.reserve(size):
+			loop = asyncio.get_running_loop()
+			return await loop.run_in_executor(self.executor, func, *args)
+
+	def _row_sizes(self, rows: ty.Iterable[ty.Sequence[ty.Any]]) -> ty.List[int]:
+		"""Returns the decompressed size of the values of `object_data` rows
+		(ending with their data and file IDs)"""
+		assert self._conn is not None
+		return [scheduler.uncompressed_size(row[-2], row[-1], self._conn.files_dir) for row in rows]
+
+	async def get(self, key_name: object) -> object:
+		"""Returns the decoded value of the given key, raising `KeyError` if
+		there is no such key"""
+		assert self._conn is not None
+		data, file_ids = await self._call_io(self._conn.read_raw_object, key_name)
+		size, = await self._call_io(self._row_sizes, [(data, file_ids)])
+		return await self._call_decode(self._conn._decode_data, data, file_ids, size=size)
+
+	async def list_objects(self) -> ty.List[object]:
+		assert self._conn is not None
+		return await self._call_io(self._conn.list_objects)
+
+	async def count_objects(self) -> int:
+		assert self._conn is not None
+		return await self._call_io(self._conn.count_objects)
+
+	async def iter_objects(self, batch_size: int = 256) -> ty.AsyncIterator[ty.Tuple[object, object]]:
+		"""Yields each key and its decoded value in storage order
+
+		Rows are fetched `batch_size` at a time and only as fast as they are
+		consumed: Once `max_concurrency` values are being decoded ahead of the
+		consumer, reading pauses until it catches up.
+		"""
+		assert self._conn is not None and self._limiter is not None
+		cur = await self._call_io(self._conn.execute, "SELECT key, data, file_ids FROM object_data")
+		pending: ty.Deque[asyncio.Future] = collections.deque()
+		try:
+			while True:
+				rows = await self._call_io(cur.fetchmany, batch_size)
+				if not rows:
+					break
+				sizes = await self._call_io(self._row_sizes, rows)
+				for row, size in zip(rows, sizes):
+					pending.append(asyncio.ensure_future(
+						self._call_decode(self._conn.decode_record, *row, size=size)
+					))
+					if len(pending) >= self._max_concurrency:
+						yield await pending.popleft()
+			while pending:
+				yield await pending.popleft()
+		finally:
+			for future in pending:
+				future.cancel()
+			if self._io is not None:
+				await self._call_io(cur.close)
+
+	async def read_objects(self) -> ty.Dict[object, object]:
+		return {key: value async for key, value in self.iter_objects()}
+
+
+async def gather(
+		db_paths: ty.Iterable[ty.Union[os.PathLike, str]],
+		*,
+		max_databases: int = 4,
+		max_concurrency: int = 4,
+		max_decode_bytes: int = scheduler.DEFAULT_MAX_BYTES,
+		return_exceptions: bool = False,
+		**db_args,
+) -> ty.Dict[pathlib.Path, ty.Union[ty.Dict[object, object], BaseException]]:
+	"""Reads all records of all given databases, at most `max_databases` of
+	them at the same time, and returns their contents by path
+
+	At most `max_concurrency` values, of at most `max_decode_bytes` once
+	decompressed in total, are decoded at the same time across all databases.
+	If `return_exceptions` is set, databases failing to be read map to their
+	exception rather than aborting everything.
+	"""
+	open_limiter   = asyncio.Semaphore(max_databases)
+	decode_limiter = asyncio.Semaphore(max_concurrency)
+	byte_limiter   = ByteLimiter(max_decode_bytes)
+
+	async def read(db_path: pathlib.Path) -> ty.Dict[object, object]:
+		async with open_limiter:
+			async with AsyncIndexedDB(db_path, max_concurrency=max_concurrency,
+			                          limiter=decode_limiter, byte_limiter=byte_limiter,
+			                          **db_args) as db:
+				return await db.read_objects()
+
+	paths = [pathlib.Path(db_path) for db_path in db_paths]
+	results = await asyncio.gather(*map(read, paths), return_exceptions=return_exceptions)
+	return dict(zip(paths, results))
+
+
+async def gather_profile(profile_dir: ty.Union[os.PathLike, str], **kwargs) \
+    -> ty.Dict[pathlib.Path, ty.Union[ty.Dict[object, object], BaseException]]:
+	"""Reads all records of all site and extension databases of a profile
+	(see `gather` for the parameters)"""
+	from . import find_profile_databases
+	return await gather(find_profile_databases(pathlib.Path(profile_dir)), **kwargs)
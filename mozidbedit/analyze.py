@@ -0,0 +1,338 @@
+"""Report which databases, object stores and records take up storage space.
+
+Sizes are determined without decoding any values: The stored size of a record
+is the length of its compressed value (as reported by SQLite) plus the sizes
+of the files it refers to in the database's `.files` directory, and its
+uncompressed size is read from the length header of its Snappy stream (or of
+each frame of the framed Snappy stream of values stored in files).
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import os
+import pathlib
+import sqlite3
+import typing as ty
+
+from . import ccl_simplesnappy
+from .mozidb import KeyCodec
+
+
+class Usage:
+	"""Number of records and their sizes, summed over a group of records"""
+	__slots__ = ("records", "stored", "uncompressed", "files")
+
+	records:      int
+	stored:       int  # Bytes of compressed values and referenced files
+	uncompressed: int  # Bytes of values once decompressed, plus referenced blobs
+	files:        int  # Records referring to stored files
+
+	def __init__(self):
+		self.records      = 0
+		self.stored       = 0
+		self.uncompressed = 0
+		self.files        = 0
+
+	def __iadd__(self, other: "Usage") -> "Usage":
+		self.records      += other.records
+		self.stored       += other.stored
+		self.uncompressed += other.uncompressed
+		self.files        += other.files
+		return self
+
+	def to_dict(self) -> ty.Dict[str, int]:
+		return {
+			"records":      self.records,
+			"stored":       self.stored,
+			"uncompressed": self.uncompressed,
+			"files":        self.files,
+		}
+
+
+class KeyUsage(ty.NamedTuple):
+	"""Sizes of a single record"""
+	store:        str
+	key:          object
+	stored:       int
+	uncompressed: int
+
+
+class DatabaseUsage(ty.NamedTuple):
+	"""Sizes of the records of a database, per object store, with its largest
+	records
+
+	`disk` is the size of the database file, its write-ahead log and all files
+	in its `.files` directory (including ones no record refers to anymore).
+	If the database could not be read, `error` tells why.
+	"""
+	path:   pathlib.Path
+	name:   ty.Optional[str]
+	disk:   int
+	total:  Usage
+	stores: ty.Dict[str, Usage]
+	keys:   ty.List[KeyUsage]
+	error:  ty.Optional[str] = None
+
+
+def _file_size(path: pathlib.Path) -> int:
+	try:
+		return path.stat().st_size
+	except FileNotFoundError:
+		return 0
+
+
+def _stored_files(files_dir: pathlib.Path) -> ty.Dict[str, int]:
+	"""Returns the size of each file in a `.files` directory by name"""
+	try:
+		with os.scandir(files_dir) as entries:
+			return {entry.name: entry.stat().st_size for entry in entries if entry.is_file()}
+	except FileNotFoundError:
+		return {}
+
+
+def _file_sizes(file_ids: str, files_dir: pathlib.Path, sizes: ty.Dict[str, int]) -> ty.Tuple[int, int]:
+	"""Returns the stored and uncompressed size of the files referred to by a
+	record's space-separated list of file IDs
+
+	The structured clone data of the value itself (its ID prefixed with a dot)
+	is a framed Snappy stream, other files hold blobs as they are.
+	"""
+	stored = uncompressed = 0
+	for file_id in file_ids.split():
+		name = file_id.lstrip(".-")
+		size = sizes.get(name, 0)
+		stored += size
+		if file_id.startswith(".") and size:
+			try:
+				with open(files_dir / name, "rb") as file:
+					uncompressed += ccl_simplesnappy.framed_uncompressed_length(file)
+			except (OSError, ValueError):
+				uncompressed += size
+		else:
+			uncompressed += size
+	return stored, uncompressed
+
+
+def _decode_key(key: bytes) -> object:
+	try:
+		return KeyCodec.decode(key)
+	except Exception:
+		return key.hex()
+
+
+def analyze_database(db_path: pathlib.Path, top: int = 10) -> DatabaseUsage:
+	"""Sums up the sizes of the records of the given database per object store
+	and determines its `top` largest records by stored and uncompressed size"""
+	files_dir = db_path.with_name(db_path.name.removesuffix(".sqlite") + ".files")
+	file_sizes = _stored_files(files_dir)
+	disk = (_file_size(db_path) + _file_size(pathlib.Path(os.fspath(db_path) + "-wal"))
+	        + sum(file_sizes.values()))
+
+	total = Usage()
+	stores: ty.Dict[str, Usage] = {}
+	# Bounded min-heaps of (size, sequence number, store, key, stored, uncompressed)
+	largest: ty.Tuple[ty.List[tuple], ty.List[tuple]] = ([], [])
+	counter = itertools.count()
+
+	uri = db_path.absolute().as_uri() + "?mode=ro"
+	try:
+		with contextlib.closing(sqlite3.connect(uri, uri=True)) as conn:
+			row = conn.execute("SELECT name FROM database").fetchone()
+			name = row[0] if row is not None else None
+			store_names = dict(conn.execute("SELECT id, name FROM object_store"))
+
+			# Only the first bytes of each value, holding its length once
+			# decompressed, are passed from SQLite
+			rows = conn.execute("SELECT object_store_id, key, length(data), substr(data, 1, 10), "
+			                    "file_ids FROM object_data")
+			for store_id, key, stored, head, file_ids in rows:
+				uncompressed = 0
+				if stored:
+					try:
+						uncompressed = ccl_simplesnappy.uncompressed_length(head)
+					except ValueError:
+						uncompressed = stored
+				if file_ids is not None:
+					files_stored, files_uncompressed = _file_sizes(file_ids, files_dir, file_sizes)
+					stored       += files_stored
+					uncompressed += files_uncompressed
+
+				store_name = store_names.get(store_id, str(store_id))
+				usage = stores.get(store_name)
+				if usage is None:
+					usage = stores[store_name] = Usage()
+				usage.records      += 1
+				usage.stored       += stored
+				usage.uncompressed += uncompressed
+				usage.files        += file_ids is not None
+
+				if top > 0:
+					seq = next(counter)
+					for heap, size in zip(largest, (stored, uncompressed)):
+						entry = (size, seq, store_name, key, stored, uncompressed)
+						if len(heap) < top:
+							heapq.heappush(heap, entry)
+						elif entry > heap[0]:
+							heapq.heapreplace(heap, entry)
+	except sqlite3.Error as exc:
+		return DatabaseUsage(db_path, None, disk, total, {}, [], str(exc))
+
+	for usage in stores.values():
+		total += usage
+
+	# Records among the largest by both sizes are only listed once
+	entries = {entry[1]: entry for heap in largest for entry in heap}
+	keys = [KeyUsage(store_name, _decode_key(key), stored, uncompressed)
+	        for _, _, store_name, key, stored, uncompressed in entries.values()]
+	return DatabaseUsage(db_path, name, disk, total, stores, keys)
+
+
+def _analyze_task(task: ty.Tuple[pathlib.Path, int]) -> DatabaseUsage:
+	return analyze_database(*task)
+
+
+def analyze(
+		db_paths: ty.Iterable[pathlib.Path],
+		*,
+		top: int = 10,
+		jobs: ty.Optional[int] = None,
+) -> ty.Iterator[DatabaseUsage]:
+	"""Yields the usage of each of the given databases, in order
+
+	Databases are analysed by `jobs` processes (one per CPU if `None`).
+	"""
+	tasks = [(db_path, top) for db_path in db_paths]
+	if jobs == 1 or len(tasks) <= 1:
+		yield from map(_analyze_task, tasks)
+		return
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+		yield from executor.map(_analyze_task, tasks)
+
+
+def format_size(size: int) -> str:
+	"""Formats a number of bytes with a binary unit"""
+	if size < 1024:
+		return f"{size} B"
+	value = float(size)
+	for unit in ("KiB", "MiB", "GiB"):
+		value /= 1024
+		if value < 1024:
+			break
+	return f"{value:.1f} {unit}"
+
+
+class _Entry(ty.NamedTuple):
+	name:  str
+	usage: Usage
+	disk:  ty.Optional[int] = None
+
+
+class Report:
+	"""Usage of a set of databases summed up per origin, database and object
+	store, with their largest records"""
+	databases: ty.List[_Entry]
+	origins:   ty.Dict[str, _Entry]
+	stores:    ty.List[_Entry]
+	keys:      ty.List[ty.Tuple[str, KeyUsage]]  # Database name, record
+	errors:    ty.List[ty.Tuple[pathlib.Path, str]]
+
+	def __init__(self):
+		self.databases = []
+		self.origins   = {}
+		self.stores    = []
+		self.keys      = []
+		self.errors    = []
+
+	def add(self, usage: DatabaseUsage, origin: str, database: str) -> None:
+		"""Adds the usage of a database of `origin`, referring to it as `database`"""
+		if usage.error is not None:
+			self.errors.append((usage.path, usage.error))
+			return
+		self.databases.append(_Entry(database, usage.total, usage.disk))
+		entry = self.origins.get(origin) or _Entry(origin, Usage(), 0)
+		origin_usage = entry.usage
+		origin_usage += usage.total
+		self.origins[origin] = entry._replace(disk=(entry.disk or 0) + usage.disk)
+		self.stores.extend(_Entry(f"{database} / {store}", store_usage)
+		                   for store, store_usage in usage.stores.items())
+		self.keys.extend((database, key) for key in usage.keys)
+
+	def total(self) -> ty.Tuple[Usage, int]:
+		"""Returns the usage and the size on disk of all databases"""
+		total = Usage()
+		for entry in self.databases:
+			total += entry.usage
+		return total, sum(entry.disk or 0 for entry in self.databases)
+
+	def largest_keys(self, sort: str = "stored", top: int = 10) -> ty.List[ty.Tuple[str, KeyUsage]]:
+		"""Returns the `top` largest records by `sort` with their database name"""
+		return heapq.nlargest(top, self.keys, key=lambda item: getattr(item[1], sort))
+
+	def sections(self, sort: str = "stored", top: int = 10) \
+	    -> ty.Iterator[ty.Tuple[str, int, ty.List[_Entry]]]:
+		"""Yields the title, total number and `top` largest entries by `sort` of
+		origins, databases, stores and records"""
+		def largest(entries: ty.Collection[_Entry]) -> ty.List[_Entry]:
+			return heapq.nlargest(top, entries, key=lambda entry: getattr(entry.usage, sort))
+
+		from . import to_json
+		records = []
+		for database, key in self.largest_keys(sort, top):
+			usage = Usage()
+			usage.records      = 1
+			usage.stored       = key.stored
+			usage.uncompressed = key.uncompressed
+			records.append(_Entry(f"{database} / {key.store} / {to_json(key.key)!r}", usage))
+
+		yield "Origins", len(self.origins), largest(self.origins.values())
+		yield "Databases", len(self.databases), largest(self.databases)
+		yield "Stores", len(self.stores), largest(self.stores)
+		yield "Records", sum(entry.usage.records for entry in self.databases), records
+
+	def to_dict(self, sort: str = "stored", top: int = 10) -> ty.Dict[str, object]:
+		def entry_dict(entry: _Entry) -> ty.Dict[str, object]:
+			result: ty.Dict[str, object] = {"name": entry.name, **entry.usage.to_dict()}
+			if entry.disk is not None:
+				result["disk"] = entry.disk
+			return result
+
+		from . import to_json
+		total, disk = self.total()
+		result: ty.Dict[str, object] = {
+			title.lower(): [entry_dict(entry) for entry in entries]
+			for title, _, entries in self.sections(sort, top)
+		}
+		result["records"] = [
+			{"database": database, "store": key.store, "key": to_json(key.key),
+			 "stored": key.stored, "uncompressed": key.uncompressed}
+			for database, key in self.largest_keys(sort, top)
+		]
+		result["total"] = {**total.to_dict(), "disk": disk, "databases": len(self.databases)}
+		result["errors"] = [{"path": str(path), "error": error} for path, error in self.errors]
+		return result
+
+	def format_text(self, sort: str = "stored", top: int = 10) -> str:
+		"""Formats the report as human-readable tables"""
+		lines = []
+		for title, count, entries in self.sections(sort, top):
+			lines.append(f"{title} by {sort} size (top {len(entries)} of {count})")
+			lines.append(f"{'stored':>11} {'uncompressed':>13} {'ratio':>6} {'records':>9} "
+			             f"{'on disk':>11}  name")
+			for entry in entries:
+				usage = entry.usage
+				ratio = f"{usage.uncompressed / usage.stored:6.2f}" if usage.stored else f"{'-':>6}"
+				disk = format_size(entry.disk) if entry.disk is not None else "-"
+				lines.append(f"{format_size(usage.stored):>11} {format_size(usage.uncompressed):>13} "
+				             f"{ratio} {usage.records:9} {disk:>11}  {entry.name}")
+			lines.append("")
+
+		total, disk = self.total()
+		lines.append(f"Total: {len(self.databases)} databases, {total.records} records "
+		             f"({total.files} with stored files), {format_size(total.stored)} stored, "
+		             f"{format_size(total.uncompressed)} uncompressed, {format_size(disk)} on disk")
+		return "\n".join(lines)
@@ -0,0 +1,203 @@
+"""Binary serialization of decoded values keeping all of their types, using
+MessagePack extension types for the JavaScript types without equivalent.
+
+Files written by `dump_records` start with a header object, followed by one
+`[key, value]` array per record, and can be read back by `load_records`.
+Integers are loaded as plain `int`s (as decoded with `plain_ints=True`),
+since MessagePack keeps them apart from floating point numbers anyway.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import array
+import datetime
+import enum
+import struct
+import sys
+import typing as ty
+
+try:
+	import msgpack
+except ImportError:
+	raise ImportError("Binary output requires the optional `msgpack` package "
+	                  "(install `moz-idb-edit[msgpack]`)") from None
+
+from . import mozserial
+
+
+#: First object of files written by `dump_records`
+HEADER = {"format": "moz-idb-edit", "version": 1}
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+_INT64 = struct.Struct(">q")
+_DOUBLE = struct.Struct(">d")
+
+
+class ExtType(enum.IntEnum):
+	"""MessagePack extension type codes of the JavaScript types"""
+	UNDEFINED      = 0   # No data
+	DATE           = 1   # Microseconds since the epoch (UTC), 64-bit big-endian
+	REGEXP         = 2   # [expression, flags]
+	BIGINT         = 3   # Two's complement, big-endian
+	BIGINT_OBJECT  = 4   # Like `BIGINT`
+	BOOLEAN_OBJECT = 5   # One byte
+	NUMBER_OBJECT  = 6   # 64-bit float, big-endian
+	STRING_OBJECT  = 7   # UTF-8
+	MAP            = 8   # [key, value, key, value, …]
+	SET            = 9   # [item, …]
+	BUFFER         = 10  # `struct` format character, then the little-endian items
+	ARRAY_KEY      = 11  # [item, …] (array keys are tuples, so they remain hashable)
+
+
+def _pack_buffer(value: ty.Union[memoryview, array.array]) -> bytes:
+	if type(value) is array.array:
+		if sys.byteorder != "little" and value.itemsize > 1:
+			value = array.array(value.typecode, value)
+			value.byteswap()
+		return value.typecode.encode("ascii") + value.tobytes()
+	return value.format.encode("ascii") + value.tobytes()
+
+
+def _unpack_buffer(data: bytes) -> ty.Union[memoryview, array.array]:
+	fmt = chr(data[0])
+	view = memoryview(data)[1:]
+	if fmt == "e":
+		return mozserial.Float16Array.from_bytes(view)
+	if sys.byteorder != "little" and fmt not in "bB":
+		# Native formats cannot express the little-endian wire format
+		result = array.array(fmt, view.tobytes())
+		result.byteswap()
+		return result
+	return view.cast(fmt)
+
+
+# Types packed as they are (`bytes` and `bytearray` only occur as binary keys)
+_NATIVE_TYPES = frozenset((str, int, float, bool, type(None), bytes, bytearray))
+
+
+def _prepare(obj: object) -> object:
+	"""Replaces the values MessagePack cannot represent by extension types
+
+	This has to happen before packing, since MessagePack would otherwise
+	store `memoryview`s as plain binary data, losing their item format.
+	"""
+	obj_type = type(obj)
+	if obj_type in _NATIVE_TYPES:
+		return obj
+	elif obj_type is list:
+		return [_prepare(item) for item in obj]
+	elif obj_type is dict:
+		return {key if type(key) is str else _prepare(key): _prepare(value)
+		        for key, value in obj.items()}
+	elif obj_type is mozserial.JSInt32:
+		return int(obj)
+	elif obj is NotImplemented:
+		return msgpack.ExtType(ExtType.UNDEFINED, b"")
+	elif obj_type is datetime.datetime:
+		if obj.tzinfo is None:
+			obj = obj.replace(tzinfo=datetime.timezone.utc)
+		return msgpack.ExtType(ExtType.DATE, _INT64.pack((obj - _EPOCH) // _MICROSECOND))
+	elif obj_type is mozserial.JSRegExpObj:
+		return msgpack.ExtType(ExtType.REGEXP, _packb([obj.expr, int(obj.flags)]))
+	elif obj_type in (mozserial.JSBigInt, mozserial.JSBigIntObj):
+		data = int(obj).to_bytes(int(obj).bit_length() // 8 + 1, "big", signed=True)
+		return msgpack.ExtType(ExtType.BIGINT if obj_type is mozserial.JSBigInt
+		                       else ExtType.BIGINT_OBJECT, data)
+	elif obj_type is mozserial.JSBooleanObj:
+		return msgpack.ExtType(ExtType.BOOLEAN_OBJECT, b"\x01" if obj else b"\x00")
+	elif obj_type is mozserial.JSNumberObj:
+		return msgpack.ExtType(ExtType.NUMBER_OBJECT, _DOUBLE.pack(obj))
+	elif obj_type is mozserial.JSStringObj:
+		return msgpack.ExtType(ExtType.STRING_OBJECT, str.encode(obj, "utf-8", "surrogatepass"))
+	elif obj_type is mozserial.JSMapObj:
+		return msgpack.ExtType(ExtType.MAP, _packb([item for pair in obj.items() for item in pair]))
+	elif obj_type is mozserial.JSSetObj:
+		return msgpack.ExtType(ExtType.SET, _packb(list(obj)))
+	elif obj_type in (memoryview, array.array, mozserial.Float16Array):
+		return msgpack.ExtType(ExtType.BUFFER, _pack_buffer(obj))
+	elif isinstance(obj, tuple):  # Array keys
+		return msgpack.ExtType(ExtType.ARRAY_KEY, _packb(list(obj)))
+	elif isinstance(obj, list):
+		return [_prepare(item) for item in obj]
+	elif isinstance(obj, dict):
+		return {_prepare(key): _prepare(value) for key, value in obj.items()}
+	elif isinstance(obj, (str, int, float)):
+		return obj_type.__mro__[-2](obj)  # Other subclasses as their base type
+	raise TypeError(f"Cannot serialize {obj!r}")
+
+
+def _ext_hook(code: int, data: bytes) -> object:
+	if code == ExtType.UNDEFINED:
+		return NotImplemented
+	elif code == ExtType.DATE:
+		return _EPOCH + _INT64.unpack(data)[0] * _MICROSECOND
+	elif code == ExtType.REGEXP:
+		expr, flags = _unpackb(data)
+		return mozserial.JSRegExpObj(expr, mozserial.RegExpFlag(flags))
+	elif code == ExtType.BIGINT:
+		return mozserial.JSBigInt(int.from_bytes(data, "big", signed=True))
+	elif code == ExtType.BIGINT_OBJECT:
+		return mozserial.JSBigIntObj(int.from_bytes(data, "big", signed=True))
+	elif code == ExtType.BOOLEAN_OBJECT:
+		return mozserial.JSBooleanObj(data != b"\x00")
+	elif code == ExtType.NUMBER_OBJECT:
+		return mozserial.JSNumberObj(_DOUBLE.unpack(data)[0])
+	elif code == ExtType.STRING_OBJECT:
+		return mozserial.JSStringObj(data.decode("utf-8", "surrogatepass"))
+	elif code == ExtType.MAP:
+		items = _unpackb(data)
+		return mozserial.JSMapObj(zip(items[0::2], items[1::2]))
+	elif code == ExtType.SET:
+		return mozserial.JSSetObj(_unpackb(data))
+	elif code == ExtType.BUFFER:
+		return _unpack_buffer(data)
+	elif code == ExtType.ARRAY_KEY:
+		return tuple(_unpackb(data))
+	return msgpack.ExtType(code, data)
+
+
+def _packb(value: object) -> bytes:
+	return msgpack.packb(_prepare(value), strict_types=True, datetime=False,
+	                     unicode_errors="surrogatepass")
+
+
+def _unpackb(data: bytes) -> object:
+	return msgpack.unpackb(data, ext_hook=_ext_hook, strict_map_key=False,
+	                       unicode_errors="surrogatepass")
+
+
+def dumps(value: object) -> bytes:
+	"""Serializes a decoded value"""
+	return _packb(value)
+
+
+def loads(data: bytes) -> object:
+	"""Deserializes a value serialized by `dumps`"""
+	return _unpackb(data)
+
+
+def dump_records(records: ty.Iterable[ty.Tuple[object, object]], file: ty.BinaryIO) -> int:
+	"""Writes the given keys and values to a binary file, returning the number
+	of records written"""
+	packer = msgpack.Packer(strict_types=True, datetime=False, unicode_errors="surrogatepass")
+	file.write(packer.pack(HEADER))
+	count = 0
+	for key, value in records:
+		file.write(packer.pack([_prepare(key), _prepare(value)]))
+		count += 1
+	return count
+
+
+def load_records(file: ty.BinaryIO) -> ty.Iterator[ty.Tuple[object, object]]:
+	"""Yields the keys and values of a file written by `dump_records`"""
+	unpacker = msgpack.Unpacker(file, ext_hook=_ext_hook, strict_map_key=False,
+	                            unicode_errors="surrogatepass", max_buffer_size=2**31 - 1)
+	header = next(unpacker, None)
+	if not isinstance(header, dict) or header.get("format") != HEADER["format"]:
+		raise ValueError("Not a moz-idb-edit binary dump")
+	if header.get("version") != HEADER["version"]:
+		raise ValueError(f"Unsupported binary dump version: {header.get('version')}")
+	for key, value in unpacker:
+		yield key, value
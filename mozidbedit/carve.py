@@ -0,0 +1,500 @@
+"""Recover deleted records from the unused space of IndexedDB database files.
+
+Deleted `object_data` rows remain in pages SQLite put on its freelist, in the
+unallocated space and freeblocks of B-tree pages and in older frames of the
+write-ahead log until they happen to be overwritten. Every stored value is a
+Snappy stream whose first literal starts with the StructuredClone header, so
+candidates are located by searching for that header and only accepted if they
+decompress and parse as StructuredClone data. The key of a recovered value is
+looked up in the record header preceding it where that is still intact.
+Records spilling onto overflow pages are reassembled from the freed cell's
+overflow page pointer, or from the cell itself on pages scanned entirely.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import concurrent.futures
+import contextlib
+import itertools
+import mmap
+import os
+import pathlib
+import re
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import typing as ty
+
+from . import ccl_simplesnappy
+from . import mozserial
+from . import sqlitefile
+from .incremental import row_hash
+from .mozidb import KeyCodec
+
+
+# Header pair (`SCTAG_HEADER` with scope `DifferentProcess` or
+# `DifferentProcessForIndexedDB`) at the start of all stored values, either
+# within the first literal or (as compressors usually do) with its run of zero
+# bytes encoded as copy of the preceding byte
+CLONE_HEADER_RE = re.compile(
+	rb"(?P<literal>[\x02\x03]\x00\x00\x00\x00\x00\xf1\xff)"
+	rb"|(?P<copy>\x04[\x02\x03]\x00(?:\x01\x01|\x0e\x01\x00|\x0f\x01\x00\x00\x00).{1,3}\xf1\xff)",
+	re.DOTALL,
+)
+
+WAL_MAGIC             = (0x377F0682, 0x377F0683)
+WAL_HEADER_SIZE       = 32
+WAL_FRAME_HEADER_SIZE = 24
+
+#: Number of pages (or WAL frames) scanned by each parallel task
+PAGES_PER_TASK = 1024
+#: Maximum distance between a record header and the value it describes
+MAX_KEY_DISTANCE = 2048
+
+
+class Recovered(ty.NamedTuple):
+	"""A value found in unused space, with its key if it could be determined
+
+	`source` is `"db"` or `"wal"`, `offset` the position of the compressed
+	value (or of the B-tree cell of a record continuing on overflow pages) in
+	that file and `page` the number of the database page it was found in.
+	`region` tells which kind of space that was: `"freelist"`, `"unallocated"`,
+	`"freeblock"`, `"superseded"` (a page with a newer version in the
+	write-ahead log), `"wal"` or (when scanning all pages) `"page"`. `key` and
+	`value` are converted to JSON-compatible types.
+	"""
+	source:   str
+	offset:   int
+	page:     int
+	region:   str
+	length:   int
+	digest:   bytes
+	key:      object
+	file_ids: ty.Optional[str]
+	value:    object
+
+
+class _Task(ty.NamedTuple):
+	source:      str
+	path:        pathlib.Path
+	page_size:   int
+	first:       int  # First page or frame number
+	last:        int  # Page or frame number after the last one
+	whole_pages: ty.Dict[int, str]  # Pages scanned entirely → kind of region
+	all_pages:   bool
+
+
+def _encode_varint(value: int) -> bytes:
+	"""Encodes `value` as SQLite big-endian variable-length integer (up to 2⁵⁶)"""
+	out = bytearray([value & 0x7F])
+	value >>= 7
+	while value:
+		out.append((value & 0x7F) | 0x80)
+		value >>= 7
+	return bytes(reversed(out))
+
+
+def _btree_regions(view: memoryview, page: int, page_offset: int, page_size: int) \
+    -> ty.Iterator[ty.Tuple[int, int, str]]:
+	"""Yields the unallocated space and freeblocks of a B-tree page"""
+	header = page_offset + 100 if page == 1 else page_offset
+	page_type = view[header]
+	if page_type not in (sqlitefile.INDEX_INTERIOR, sqlitefile.TABLE_INTERIOR,
+	                     sqlitefile.INDEX_LEAF, sqlitefile.TABLE_LEAF):
+		return
+
+	first_freeblock, cell_count, content_start = struct.unpack_from(">HHH", view, header + 1)
+	header_size = 8 if page_type in (sqlitefile.INDEX_LEAF, sqlitefile.TABLE_LEAF) else 12
+	pointers_end = header + header_size + 2 * cell_count
+	content_start = content_start or 65536
+	if pointers_end < page_offset + content_start <= page_offset + page_size:
+		yield pointers_end, page_offset + content_start, "unallocated"
+
+	freeblock = first_freeblock
+	seen: ty.Set[int] = set()
+	while 0 < freeblock <= page_size - 4 and freeblock not in seen:
+		seen.add(freeblock)
+		next_freeblock, size = struct.unpack_from(">HH", view, page_offset + freeblock)
+		yield page_offset + freeblock, page_offset + min(freeblock + size, page_size), "freeblock"
+		freeblock = next_freeblock
+
+
+def _stream_starts(view: memoryview, match: "re.Match[bytes]", page_offset: int) -> ty.Iterator[int]:
+	"""Yields the possible start offsets of a Snappy stream beginning with the
+	clone header found by `match`"""
+	tag_positions: ty.List[int] = []
+	if match.lastgroup == "copy":
+		tag_positions.append(match.start())
+	else:
+		# Find the tag of the literal containing the header
+		for tag_size in range(1, 6):
+			tag_pos = match.start() - tag_size
+			if tag_pos <= page_offset:
+				break
+			tag = view[tag_pos]
+			if tag & 0x03:
+				continue  # Not a literal
+			if tag_size == 1:
+				if 7 <= (tag >> 2) < 60:  # Long enough for the header, length inline
+					tag_positions.append(tag_pos)
+			elif (tag >> 2) == 58 + tag_size:  # Length stored in the following bytes
+				tag_positions.append(tag_pos)
+
+	for tag_pos in tag_positions:
+		# The uncompressed length precedes the literal as little-endian varint
+		start = tag_pos - 1
+		if start < page_offset or view[start] >= 0x80:
+			continue
+		yield start
+		while start > page_offset and start > tag_pos - 5 and view[start - 1] >= 0x80:
+			start -= 1
+			yield start
+
+
+def _find_key(view: memoryview, page_offset: int, start: int, length: int) \
+    -> ty.Tuple[object, ty.Optional[str]]:
+	"""Looks for the record header describing the value of `length` bytes at
+	`start` and returns the key and file IDs of the record, if found
+
+	The first bytes of deleted cells are overwritten, but the serial types of
+	the key, `index_data_values`, `file_ids` and `data` columns (which are
+	stored last in the header) usually remain, followed by the object store
+	ID (stored in at most one byte) and the key.
+	"""
+	window = bytes(view[max(page_offset, start - MAX_KEY_DISTANCE):start])
+	data_type = _encode_varint(length * 2 + 12)
+	pos = window.rfind(data_type)
+	while pos > 0:
+		body_start = pos + len(data_type)
+		for key_size, index_size, file_ids_size in itertools.product((1, 2, 3), (1, 2), (1, 2)):
+			types_start = pos - file_ids_size - index_size - key_size
+			if types_start < 0:
+				continue
+			try:
+				key_type, next_pos = sqlitefile._read_varint(window, types_start)
+				index_type, next_pos = sqlitefile._read_varint(window, next_pos)
+				file_ids_type, next_pos = sqlitefile._read_varint(window, next_pos)
+			except IndexError:
+				continue
+			if next_pos != pos or key_type < 14 or key_type & 1 \
+			   or (index_type != 0 and (index_type < 12 or index_type & 1)) \
+			   or (file_ids_type != 0 and (file_ids_type < 13 or not file_ids_type & 1)):
+				continue
+
+			key_length = (key_type - 12) >> 1
+			file_ids_length = (file_ids_type - 13) >> 1 if file_ids_type else 0
+			index_length = (index_type - 12) >> 1 if index_type else 0
+			for store_id_size in (0, 1):
+				key_start = body_start + store_id_size
+				if key_start + key_length + index_length + file_ids_length != len(window):
+					continue
+				try:
+					key = KeyCodec.decode(window[key_start:key_start + key_length])
+				except Exception:
+					continue
+				file_ids = None
+				if file_ids_length:
+					file_ids = window[-file_ids_length:].decode("utf-8", "replace")
+				return key, file_ids
+		pos = window.rfind(data_type, 0, pos)
+	return None, None
+
+
+def _decode(compressed: sqlitefile.Buffer) -> ty.Optional[ty.Tuple[object, int]]:
+	"""Returns the value stored in the Snappy stream at the start of
+	`compressed` and the length of the stream, if it is intact"""
+	try:
+		data, length = ccl_simplesnappy.decompress_prefix(compressed)
+		return mozserial.Reader(data, plain_ints=True).read(), length
+	except Exception:
+		return None
+
+
+def _overflow_data(db: sqlitefile.SQLiteFile, page: int, limit: int) -> bytes:
+	"""Returns the content of the chain of overflow pages starting at `page`,
+	stopping once `limit` bytes were read"""
+	page_count = len(db.view) // db.page_size
+	parts: ty.List[sqlitefile.Buffer] = []
+	size = 0
+	seen: ty.Set[int] = set()
+	while 0 < page <= page_count and page not in seen and size < limit:
+		seen.add(page)
+		page_offset = (page - 1) * db.page_size
+		page, = struct.unpack_from(">I", db.view, page_offset)
+		parts.append(db.view[page_offset + 4:page_offset + db.usable_size])
+		size += db.usable_size - 4
+	return b"".join(parts)
+
+
+def _scan_region(view: memoryview, db: ty.Optional[sqlitefile.SQLiteFile], start: int, end: int,
+                 page_offset: int, page_end: int, region: str, chained: bool = False) \
+    -> ty.Iterator[ty.Tuple[int, str, bytes, object, object, ty.Optional[str]]]:
+	"""Yields the offset, region, compressed data, value, key and file IDs of
+	each value found between `start` and `end`
+
+	If `chained` is set, values running past `end` may continue on the overflow
+	pages listed in the last four bytes of the region, as is the case for
+	deleted cells that became a freeblock or the start of the unallocated space.
+	"""
+	skip_until = start
+	for match in CLONE_HEADER_RE.finditer(view, start, end):
+		if match.start() < skip_until:
+			continue  # Part of the previous value
+		for stream_start in _stream_starts(view, match, page_offset):
+			compressed: sqlitefile.Buffer = view[stream_start:page_end]
+			decoded = _decode(compressed)
+			if decoded is None and chained and db is not None and stream_start < end - 4:
+				# Compressed data is never much larger than the uncompressed data
+				uncompressed_length = 0
+				for shift, byte in zip(range(0, 35, 7), view[stream_start:stream_start + 5]):
+					uncompressed_length |= (byte & 0x7F) << shift
+					if byte < 0x80:
+						break
+				overflow_page, = struct.unpack_from(">I", view, end - 4)
+				compressed = bytes(view[stream_start:end - 4]) + _overflow_data(
+					db, overflow_page, uncompressed_length + uncompressed_length // 6 + 32)
+				decoded = _decode(compressed)
+			if decoded is None:
+				continue  # Not an intact value
+			value, length = decoded
+			key, file_ids = _find_key(view, page_offset, stream_start, length)
+			yield stream_start, region, bytes(compressed[:length]), value, key, file_ids
+			skip_until = stream_start + length
+			break
+
+
+def _scan_free_space(view: memoryview, db: ty.Optional[sqlitefile.SQLiteFile], page: int,
+                     page_offset: int, page_size: int, region: ty.Optional[str] = None) \
+    -> ty.Iterator[ty.Tuple[int, str, bytes, object, object, ty.Optional[str]]]:
+	"""Scans the unallocated space and freeblocks of a B-tree page, reporting
+	them as `region` if given"""
+	for start, end, kind in _btree_regions(view, page, page_offset, page_size):
+		yield from _scan_region(view, db, start, end, page_offset, page_offset + page_size,
+		                        region or kind, True)
+
+
+def _scan_cells(db: sqlitefile.SQLiteFile, page: int, page_offset: int, region: str) \
+    -> ty.Iterator[ty.Tuple[int, str, bytes, object, object, ty.Optional[str]]]:
+	"""Yields the `object_data` records stored in the cells of an intact index
+	B-tree page, following their overflow pages
+
+	The offset given is that of the value, or of its cell if the record
+	continues on overflow pages.
+	"""
+	view = db.view
+	header = page_offset + 100 if page == 1 else page_offset
+	page_type = view[header]
+	cell_count, = struct.unpack_from(">H", view, header + 3)
+	pointers_start = header + (8 if page_type == sqlitefile.INDEX_LEAF else 12)
+	if pointers_start + 2 * cell_count > page_offset + db.page_size:
+		return
+	for cell_ptr in struct.unpack_from(f">{cell_count}H", view, pointers_start):
+		# Cells of interior pages start with the number of their left child page
+		cell = page_offset + cell_ptr + (0 if page_type == sqlitefile.INDEX_LEAF else 4)
+		try:
+			payload = db._payload(cell)
+			values = db.parse_record(payload)
+			# Columns of `object_data` records: object_store_id, key,
+			# index_data_values, file_ids, data
+			if len(values) < 5 or not isinstance(values[4], (bytes, memoryview)):
+				continue
+			data = bytes(values[4])
+			value = mozserial.Reader(ccl_simplesnappy.decompress_buffer(data), plain_ints=True).read()
+			key = KeyCodec.decode(bytes(values[1]))
+		except Exception:
+			continue  # Not an intact `object_data` record
+		file_ids = values[3] if isinstance(values[3], str) else None
+		size, payload_start = sqlitefile._read_varint(view, cell)
+		offset = payload_start + size - len(data) if isinstance(payload, memoryview) else cell
+		yield offset, region, data, value, key, file_ids
+
+
+def _scan(task: _Task) -> ty.List[Recovered]:
+	if task.source == "db":
+		with sqlitefile.SQLiteFile(task.path, ignore_journal=True) as db:
+			return _scan_pages(task, db.view, db)
+
+	with open(task.path, "rb") as file, \
+	     mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+		view = memoryview(mapped)
+		try:
+			return _scan_pages(task, view, None)
+		finally:
+			view.release()
+
+
+def _scan_page(task: _Task, view: memoryview, db: ty.Optional[sqlitefile.SQLiteFile], number: int) \
+    -> ty.Tuple[int, ty.Iterable[ty.Tuple[int, str, bytes, object, object, ty.Optional[str]]]]:
+	"""Returns the database page number of the given page (or WAL frame) and
+	an iterable of the values found in it"""
+	page_size = task.page_size
+	if task.source == "wal":
+		frame_offset = WAL_HEADER_SIZE + number * (WAL_FRAME_HEADER_SIZE + page_size)
+		page, = struct.unpack_from(">I", view, frame_offset)
+		page_offset = frame_offset + WAL_FRAME_HEADER_SIZE
+		return page, _scan_region(view, None, page_offset, page_offset + page_size,
+		                          page_offset, page_offset + page_size, "wal")
+
+	assert db is not None
+	page_offset = (number - 1) * page_size
+	region = task.whole_pages.get(number, "page" if task.all_pages else None)
+	if region is None:
+		return number, _scan_free_space(view, db, number, page_offset, page_size)
+
+	page_type = view[page_offset + 100 if number == 1 else page_offset]
+	if page_type in (sqlitefile.INDEX_INTERIOR, sqlitefile.INDEX_LEAF):
+		# Pages of the freelist and old versions of pages usually still hold
+		# complete B-tree pages, whose records may continue on overflow pages
+		return number, itertools.chain(
+			_scan_cells(db, number, page_offset, region),
+			_scan_free_space(view, db, number, page_offset, page_size, region),
+		)
+	return number, _scan_region(view, db, page_offset, page_offset + page_size,
+	                            page_offset, page_offset + page_size, region)
+
+
+def _scan_pages(task: _Task, view: memoryview, db: ty.Optional[sqlitefile.SQLiteFile]) \
+    -> ty.List[Recovered]:
+	from . import to_json
+
+	results: ty.List[Recovered] = []
+	for number in range(task.first, task.last):
+		page, found = _scan_page(task, view, db, number)
+		for offset, region, data, value, key, file_ids in found:
+			results.append(Recovered(
+				task.source, offset, page, region, len(data), row_hash(data, None),
+				to_json(key), file_ids, to_json(value),
+			))
+	return results
+
+
+def _freelist_pages(db: sqlitefile.SQLiteFile, page_count: int) -> ty.Set[int]:
+	"""Returns the numbers of all trunk and leaf pages of the freelist"""
+	pages: ty.Set[int] = set()
+	trunk, = struct.unpack_from(">I", db.view, 32)
+	while 0 < trunk <= page_count and trunk not in pages:
+		pages.add(trunk)
+		trunk_offset = (trunk - 1) * db.page_size
+		next_trunk, leaf_count = struct.unpack_from(">II", db.view, trunk_offset)
+		leaf_count = min(leaf_count, db.usable_size // 4 - 2)
+		pages.update(leaf for leaf in struct.unpack_from(f">{leaf_count}I", db.view, trunk_offset + 8)
+		             if 0 < leaf <= page_count)
+		trunk = next_trunk
+	return pages
+
+
+def _wal_frames(wal_path: pathlib.Path) -> ty.Tuple[int, int, ty.Set[int]]:
+	"""Returns the page size, the number of frames and the numbers of the pages
+	stored in the frames of the given write-ahead log (if any)"""
+	try:
+		with open(wal_path, "rb") as file, \
+		     mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as wal:
+			if len(wal) < WAL_HEADER_SIZE or struct.unpack_from(">I", wal)[0] not in WAL_MAGIC:
+				return 0, 0, set()
+			page_size, = struct.unpack_from(">I", wal, 8)
+			frame_size = WAL_FRAME_HEADER_SIZE + page_size
+			frame_count = (len(wal) - WAL_HEADER_SIZE) // frame_size
+			pages = {struct.unpack_from(">I", wal, WAL_HEADER_SIZE + index * frame_size)[0]
+			         for index in range(frame_count)}
+			return page_size, frame_count, pages
+	except (FileNotFoundError, ValueError):  # Missing or empty
+		return 0, 0, set()
+
+
+def _plan(db_path: pathlib.Path, all_pages: bool) -> ty.Iterator[_Task]:
+	wal_path = pathlib.Path(os.fspath(db_path) + "-wal")
+	wal_page_size, frame_count, wal_pages = _wal_frames(wal_path)
+
+	with sqlitefile.SQLiteFile(db_path, ignore_journal=True) as db:
+		page_size = db.page_size
+		page_count = len(db.view) // page_size
+		# Pages with a newer version in the write-ahead log only hold old data
+		whole_pages = dict.fromkeys(wal_pages, "superseded")
+		whole_pages.update(dict.fromkeys(_freelist_pages(db, page_count), "freelist"))
+
+	for first in range(1, page_count + 1, PAGES_PER_TASK):
+		last = min(first + PAGES_PER_TASK, page_count + 1)
+		yield _Task("db", db_path, page_size, first, last,
+		            {page: region for page, region in whole_pages.items() if first <= page < last},
+		            all_pages)
+
+	for first in range(0, frame_count, PAGES_PER_TASK):
+		yield _Task("wal", wal_path, wal_page_size, first, min(first + PAGES_PER_TASK, frame_count),
+		            {}, True)
+
+
+def _live_digests(db_path: pathlib.Path) -> ty.Set[bytes]:
+	"""Returns the hashes of the values of all current rows of the database
+	without modifying any of its files
+
+	SQLite would create a shared-memory file next to a database in WAL mode
+	even when opening it read-only, and roll back the interrupted transaction
+	of a hot rollback journal, so databases with a pending journal are copied
+	(together with the journal) first.
+	"""
+	def read(path: pathlib.Path) -> ty.Set[bytes]:
+		uri = path.absolute().as_uri() + "?immutable=1"
+		with contextlib.closing(sqlite3.connect(uri, uri=True)) as conn:
+			return {row_hash(data, None) for data, in conn.execute("SELECT data FROM object_data")}
+
+	try:
+		journal_path = sqlitefile.pending_journal(db_path)
+		if journal_path is None:
+			return read(db_path)
+		suffix = journal_path.name[len(db_path.name):]  # "-wal" or "-journal"
+		with tempfile.TemporaryDirectory() as tmpdir:
+			copy_path = pathlib.Path(tmpdir) / db_path.name
+			shutil.copyfile(db_path, copy_path)
+			shutil.copyfile(journal_path, os.fspath(copy_path) + suffix)
+			with contextlib.closing(sqlite3.connect(copy_path)) as conn:
+				if suffix == "-wal":
+					# Apply the write-ahead log to the copy
+					conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+				else:
+					# Reading the copy rolls back the changes of the hot journal
+					conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+			return read(copy_path)
+	except (OSError, sqlite3.Error) as exc:
+		print(f"Cannot read existing records of {db_path}, reporting all records found: {exc}",
+		      file=sys.stderr)
+		return set()
+
+
+def carve(
+		db_path: ty.Union[os.PathLike, str],
+		*,
+		jobs: ty.Optional[int] = None,
+		all_pages: bool = False,
+		include_live: bool = False,
+		unique: bool = False,
+) -> ty.Iterator[Recovered]:
+	"""Yields the values found in the unused space of the given database file
+	and its write-ahead log, in file order
+
+	Pages are scanned by `jobs` processes (one per CPU if `None`). If
+	`all_pages` is set, all pages are scanned entirely rather than only the
+	unused space in them. Values identical to one of an existing record are
+	skipped unless `include_live` is set. If `unique` is set, each distinct
+	value is only reported the first time it is found.
+	"""
+	db_path = pathlib.Path(db_path)
+	tasks = list(_plan(db_path, all_pages))
+	live = set() if include_live else _live_digests(db_path)
+	seen: ty.Set[bytes] = set()
+
+	def filtered(results: ty.Iterable[ty.List[Recovered]]) -> ty.Iterator[Recovered]:
+		for task_results in results:
+			for record in task_results:
+				if record.digest in live or (unique and record.digest in seen):
+					continue
+				seen.add(record.digest)
+				yield record
+
+	if jobs == 1 or len(tasks) <= 1:
+		yield from filtered(map(_scan, tasks))
+		return
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+		yield from filtered(executor.map(_scan, tasks))
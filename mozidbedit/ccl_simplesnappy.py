@@ -218,6 +218,94 @@ def decompress(data: typing.BinaryIO) -> bytes:
     return result
 
 
+def decompress_buffer(data: typing.Union[bytes, bytearray, memoryview]) -> bytes:
+    """Decompresses snappy compressed data held in a buffer (such as a slice of a
+    memory-mapped file), indexing it directly rather than reading it as a stream"""
+    return _decompress_buffer(data, False)[0]
+
+
+def decompress_prefix(data: typing.Union[bytes, bytearray, memoryview]) -> typing.Tuple[bytes, int]:
+    """Decompresses the snappy compressed data at the start of a buffer, ignoring
+    whatever follows it, and returns the result and the number of bytes used"""
+    return _decompress_buffer(data, True)
+
+
+def uncompressed_length(data: typing.Union[bytes, bytearray, memoryview]) -> int:
+    """Returns the length of snappy compressed data once decompressed, as stored in
+    its header (only the first few bytes of the data are needed)"""
+    return _read_buffer_varint(memoryview(data))[0]
+
+
+def _read_buffer_varint(data: memoryview) -> typing.Tuple[int, int]:
+    value = 0
+    pos = 0
+    shift = 0
+    while True:
+        if pos >= len(data) or shift > 63:
+            raise ValueError("Couldn't read uncompressed length")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _decompress_buffer(data: typing.Union[bytes, bytearray, memoryview],
+                       prefix: bool) -> typing.Tuple[bytes, int]:
+    data = memoryview(data)
+    data_length = len(data)
+
+    uncompressed_length, pos = _read_buffer_varint(data)
+
+    out = bytearray()
+    while pos < data_length:
+        if prefix and len(out) >= uncompressed_length:
+            break
+        type_byte = data[pos]
+        pos += 1
+        tag = type_byte & 0x03
+
+        if tag == 0:  # ElementType.Literal
+            length = (type_byte >> 2) + 1
+            if length > 60:  # length stored in the following 1-4 bytes
+                size = length - 60
+                length = int.from_bytes(data[pos:pos + size], "little") + 1
+                pos += size
+            if pos + length > data_length:
+                raise ValueError("Couldn't read enough literal data")
+            out += data[pos:pos + length]
+            pos += length
+            continue
+
+        if tag == 1:  # ElementType.CopyOneByte
+            length = ((type_byte & 0x1C) >> 2) + 4
+            offset = ((type_byte & 0xE0) << 3) | data[pos]
+            pos += 1
+        elif tag == 2:  # ElementType.CopyTwoByte
+            length = (type_byte >> 2) + 1
+            offset = int.from_bytes(data[pos:pos + 2], "little")
+            pos += 2
+        else:  # ElementType.CopyFourByte
+            length = (type_byte >> 2) + 1
+            offset = int.from_bytes(data[pos:pos + 4], "little")
+            pos += 4
+
+        start = len(out) - offset
+        if offset == 0 or start < 0:
+            raise ValueError(f"Invalid backreference offset: {offset}")
+        if offset >= length:
+            out += out[start:start + length]
+        else:
+            # Backreference overlaps the data it produces, repeat what is there
+            out += (out[start:] * (length // offset + 1))[:length]
+
+    if uncompressed_length != len(out):
+        raise ValueError("Wrong data length in uncompressed data")
+
+    return bytes(out), pos
+
+
 def check_masked_crc(crc, data, xor_value=0xffffffff):
     check = crc32c(data, xor_value=xor_value)
 
@@ -292,6 +380,41 @@ def decompress_framed(frame_stream: typing.BinaryIO, out_stream: typing.BinaryIO
             raise ValueError("unexpected frame")
 
 
+def framed_uncompressed_length(frame_stream: typing.BinaryIO) -> int:
+    """
+    Returns the length of a Snappy framed format stream once decompressed, reading
+    only the frame headers and the length header of each compressed frame.
+
+    :param frame_stream: Seekable stream containing the Snappy Framed data
+    :return: The total length of the decompressed data
+    """
+    header_type, header_raw = read_frame(frame_stream)
+    if header_type != 0xff or header_raw != FRAME_MAGIC:
+        raise ValueError("Invalid magic")
+
+    total = 0
+    while True:
+        frame_header = frame_stream.read(4)
+        if not frame_header:
+            break
+        if len(frame_header) < 4:
+            raise ValueError("Could not read entire frame header")
+        frame_id = frame_header[0]
+        frame_length, = struct.unpack("<I", frame_header[1:] + b"\x00")
+        frame_end = frame_stream.tell() + frame_length
+
+        if frame_id == 0x00:  # compressed, CRC followed by the length header
+            head = frame_stream.read(min(frame_length, 4 + 10))
+            total += uncompressed_length(head[4:])
+        elif frame_id == 0x01:  # decompressed, CRC followed by the data
+            total += frame_length - 4
+        elif 0x02 <= frame_id <= 0x7f:  # reserved, unskippable
+            raise ValueError("Reserved unskippable data")
+        frame_stream.seek(frame_end)
+
+    return total
+
+
 def _main(in_path, out_path):
     import pathlib
 
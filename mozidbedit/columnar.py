@@ -0,0 +1,217 @@
+"""Columnar export of IndexedDB object store contents using Apache Arrow."""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import itertools
+import json
+import os
+import typing as ty
+
+try:
+	import pyarrow
+	import pyarrow.ipc
+except ImportError:
+	raise ImportError("Columnar export requires the optional `pyarrow` package "
+	                  "(install `moz-idb-edit[arrow]`)") from None
+
+from . import mozidb
+from . import mozserial
+
+
+KEY_COLUMN  = "key"
+REST_COLUMN = "_rest"
+
+_INT64_MIN = -0x8000000000000000
+_INT64_MAX =  0x7FFFFFFFFFFFFFFF
+
+_TIMESTAMP_TYPE = pyarrow.timestamp("ms", tz="UTC")
+
+
+def _infer_type(value: object) -> ty.Optional[pyarrow.DataType]:
+	"""Determines the Arrow type of a single scalar value, or `None` if the value
+	cannot be represented by any of the supported column types"""
+	if isinstance(value, (bool, mozserial.JSBooleanObj)):
+		return pyarrow.bool_()
+	elif isinstance(value, int):
+		if _INT64_MIN <= value <= _INT64_MAX:
+			return pyarrow.int64()
+		return None
+	elif isinstance(value, float):
+		return pyarrow.float64()
+	elif isinstance(value, str):
+		return pyarrow.string()
+	elif isinstance(value, datetime.datetime):
+		return _TIMESTAMP_TYPE
+	return None
+
+
+def _merge_types(a: ty.Optional[pyarrow.DataType], b: ty.Optional[pyarrow.DataType]) \
+    -> ty.Optional[pyarrow.DataType]:
+	if a == b:
+		return a
+	# Integers and floats are both JavaScript numbers
+	if {a, b} == {pyarrow.int64(), pyarrow.float64()}:
+		return pyarrow.float64()
+	return None
+
+
+def _fits_type(value: object, type: pyarrow.DataType) -> bool:
+	value_type = _infer_type(value)
+	return value_type == type or (type == pyarrow.float64() and value_type == pyarrow.int64())
+
+
+def _to_json_text(value: object) -> str:
+	from . import to_json
+	return json.dumps(to_json(value), ensure_ascii=False)
+
+
+def _is_plain_object(value: object) -> bool:
+	return isinstance(value, dict) and not isinstance(value, mozserial.JSMapObj)
+
+
+def _key_to_text(key: object) -> str:
+	if isinstance(key, str):
+		return key
+	elif isinstance(key, (bytes, bytearray)):
+		return key.hex()
+	return _to_json_text(key)
+
+
+def infer_schema(records: ty.Sequence[ty.Tuple[object, object]]) -> pyarrow.Schema:
+	"""Infers the column layout from a sample of records
+
+	Every top-level property of object values that holds the same scalar type
+	in all sampled records (ignoring `null` and `undefined`) becomes a column of
+	its own, everything else is collected into the JSON-encoded `_rest` column.
+	"""
+	candidates: ty.Dict[str, ty.Optional[pyarrow.DataType]] = {}
+	for _, value in records:
+		if not _is_plain_object(value):
+			continue
+
+		for name, item in value.items():
+			if not isinstance(name, str) or name in (KEY_COLUMN, REST_COLUMN):
+				continue
+			if item is None or item is NotImplemented:
+				candidates.setdefault(name, pyarrow.null())
+				continue
+
+			item_type = _infer_type(item)
+			if name not in candidates or candidates[name] == pyarrow.null():
+				candidates[name] = item_type
+			else:
+				candidates[name] = _merge_types(candidates[name], item_type)
+
+	fields = [pyarrow.field(KEY_COLUMN, pyarrow.string(), nullable=False)]
+	for name, type in candidates.items():
+		if type is not None and type != pyarrow.null():
+			fields.append(pyarrow.field(name, type))
+	fields.append(pyarrow.field(REST_COLUMN, pyarrow.string()))
+	return pyarrow.schema(fields)
+
+
+def to_record_batch(records: ty.Sequence[ty.Tuple[object, object]], schema: pyarrow.Schema) \
+    -> pyarrow.RecordBatch:
+	"""Flattens the given records into a record batch of the given schema
+
+	Property values not matching the type of their column are moved to the
+	`_rest` column for that record, so that no information is dropped.
+	"""
+	columns = [field for field in schema if field.name not in (KEY_COLUMN, REST_COLUMN)]
+
+	keys = []
+	values: ty.Dict[str, ty.List[object]] = {field.name: [] for field in columns}
+	rest = []
+	for key, value in records:
+		keys.append(_key_to_text(key))
+
+		if not _is_plain_object(value):
+			for field in columns:
+				values[field.name].append(None)
+			rest.append(_to_json_text(value) if value is not NotImplemented else None)
+			continue
+
+		remaining = dict(value)
+		for field in columns:
+			item = remaining.pop(field.name, None)
+			if item is None or item is NotImplemented:
+				values[field.name].append(None)
+			elif _fits_type(item, field.type):
+				if field.type == pyarrow.bool_():
+					item = bool(item)
+				elif field.type == pyarrow.float64():
+					item = float(item)
+				values[field.name].append(item)
+			else:
+				values[field.name].append(None)
+				remaining[field.name] = item
+		rest.append(_to_json_text(remaining) if remaining else None)
+
+	arrays = [pyarrow.array(keys, pyarrow.string())]
+	arrays.extend(pyarrow.array(values[field.name], field.type) for field in columns)
+	arrays.append(pyarrow.array(rest, pyarrow.string()))
+	return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def iter_record_batches(
+		conn: mozidb.IndexedDB,
+		batch_size: int = 10000,
+		schema: ty.Optional[pyarrow.Schema] = None,
+) -> ty.Iterator[pyarrow.RecordBatch]:
+	"""Decodes all records of the given database and yields them in record
+	batches of (at most) `batch_size` rows
+
+	If no `schema` is given, it is inferred from the first batch of records.
+	"""
+	objects = conn.iter_objects()
+	while True:
+		records = list(itertools.islice(objects, batch_size))
+		if not records:
+			break
+
+		if schema is None:
+			schema = infer_schema(records)
+		with conn.stage("columnar.convert") as stage:
+			batch = to_record_batch(records, schema)
+			stage.rows += batch.num_rows
+			stage.bytes_out += batch.nbytes
+		yield batch
+
+
+def write_table(
+		conn: mozidb.IndexedDB,
+		path: ty.Union[os.PathLike, str],
+		format: str = "parquet",
+		*,
+		batch_size: int = 10000,
+) -> int:
+	"""Writes all records of the given database to a Parquet or Feather file,
+	one record batch at a time
+
+	Returns the number of records written.
+	"""
+	batches = iter_record_batches(conn, batch_size)
+	first_batch = next(batches, None)
+	if first_batch is None:
+		first_batch = pyarrow.RecordBatch.from_pylist([], schema=infer_schema([]))
+
+	if format == "parquet":
+		import pyarrow.parquet as parquet
+		writer = parquet.ParquetWriter(os.fspath(path), first_batch.schema)
+	elif format == "feather":
+		# Feather version 2 is the Arrow IPC file format
+		writer = pyarrow.ipc.new_file(os.fspath(path), first_batch.schema)
+	else:
+		raise ValueError(f"Unknown columnar format: {format}")
+
+	row_count = 0
+	with writer:
+		for batch in itertools.chain((first_batch,), batches):
+			with conn.stage("output") as stage:
+				writer.write_batch(batch)
+				stage.rows += batch.num_rows
+				stage.bytes_in += batch.nbytes
+			row_count += batch.num_rows
+	return row_count
@@ -0,0 +1,158 @@
+"""Decode identical stored values only once.
+
+Extensions and sites often store byte-identical values under many keys, in
+several user contexts or in several databases (default settings, cached
+manifests, …). `DecodeCache` remembers decoded values by a hash of their
+compressed data, so that repeated copies are neither decompressed nor parsed
+again, as long as the same cache is passed to every `mozidb.IndexedDB` of a
+run.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+import hashlib
+import io
+import pickle
+import threading
+import typing as ty
+
+
+#: Default limit of the decompressed size of the values held by a cache
+DEFAULT_MAX_BYTES = 64 << 20
+
+# Values of these types cannot be modified, so they are never copied
+_IMMUTABLE_TYPES = (str, int, float, bool, type(None), type(NotImplemented))
+
+
+class _Pickler(pickle.Pickler):
+	"""Pickler keeping `memoryview`s (read-only slices of a decompressed value,
+	such as `ArrayBuffer` contents) aside rather than copying them"""
+	def __init__(self, file: ty.BinaryIO, views: ty.List[memoryview]):
+		super().__init__(file, protocol=5)
+		self.views = views
+
+	def persistent_id(self, obj: object) -> ty.Optional[int]:
+		if type(obj) is memoryview:
+			self.views.append(obj)
+			return len(self.views) - 1
+		return None
+
+
+class _Unpickler(pickle.Unpickler):
+	def __init__(self, file: ty.BinaryIO, views: ty.List[memoryview]):
+		super().__init__(file)
+		self.views = views
+
+	def persistent_load(self, pid: int) -> memoryview:
+		return self.views[pid]
+
+
+class _Entry(ty.NamedTuple):
+	value:   object  # Value as decoded, or pickled copy of it
+	pickled: bool
+	views:   ty.Optional[ty.List[memoryview]]  # Views kept aside while pickling
+	size:    int
+
+
+class DecodeCache:
+	"""Decoded values by hash of their compressed data, keeping the most
+	recently used ones up to a decompressed size of `max_bytes`
+
+	Unless `shared` is set, each lookup returns a separate copy of the cached
+	value (restored from a pickled copy, which is much faster than decoding
+	it again), so callers may modify it. Callers that never modify values
+	(such as when only printing or serializing them) may pass `shared=True`
+	to get the very same object every time instead.
+
+	Can be used from several threads at once.
+	"""
+	max_bytes:     int
+	shared:        bool
+	lookups:       int  # Number of values looked up
+	hits:          int  # Number of values found in the cache
+	bytes_looked:  int  # Decompressed size of values looked up
+	bytes_reused:  int  # Decompressed size of values found in the cache
+	cached_bytes:  int  # Decompressed size of values held
+
+	def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, *, shared: bool = False):
+		self.max_bytes    = max_bytes
+		self.shared       = shared
+		self.lookups      = 0
+		self.hits         = 0
+		self.bytes_looked = 0
+		self.bytes_reused = 0
+		self.cached_bytes = 0
+		self._entries: ty.OrderedDict[bytes, _Entry] = collections.OrderedDict()
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def digest(data: ty.Union[bytes, memoryview], plain_ints: bool = False) -> bytes:
+		"""Returns the cache key of a compressed value decoded with the given
+		`plain_ints` setting"""
+		return hashlib.blake2b(data, digest_size=16, salt=b"plain" if plain_ints else b"").digest()
+
+	def decode(self, digest: bytes, size: int, decode: ty.Callable[[], object]) -> object:
+		"""Returns the cached value with the given digest, or else the result of
+		`decode()`, caching it with its decompressed `size`"""
+		with self._lock:
+			self.lookups      += 1
+			self.bytes_looked += size
+			entry = self._entries.get(digest)
+			if entry is not None:
+				self._entries.move_to_end(digest)
+				self.hits         += 1
+				self.bytes_reused += size
+		if entry is not None:
+			return self._restore(entry)
+
+		value = decode()
+		if size <= self.max_bytes:
+			entry = self._store(value, size)
+			with self._lock:
+				if digest not in self._entries:
+					self._entries[digest] = entry
+					self.cached_bytes += size
+					while self.cached_bytes > self.max_bytes:
+						_, evicted = self._entries.popitem(last=False)
+						self.cached_bytes -= evicted.size
+		return value
+
+	def _store(self, value: object, size: int) -> _Entry:
+		if self.shared or type(value) in _IMMUTABLE_TYPES:
+			return _Entry(value, False, None, size)
+		try:
+			return _Entry(pickle.dumps(value, protocol=5), True, None, size)
+		except TypeError:
+			views: ty.List[memoryview] = []
+			file = io.BytesIO()
+			_Pickler(file, views).dump(value)
+			return _Entry(file.getvalue(), True, views, size)
+
+	def _restore(self, entry: _Entry) -> object:
+		if not entry.pickled:
+			return entry.value
+		assert isinstance(entry.value, bytes)
+		if entry.views is None:
+			return pickle.loads(entry.value)
+		return _Unpickler(io.BytesIO(entry.value), entry.views).load()
+
+	def clear(self) -> None:
+		with self._lock:
+			self._entries.clear()
+			self.cached_bytes = 0
+
+	def close(self) -> None:
+		"""Releases the cached values"""
+		self.clear()
+
+	def ratio(self) -> float:
+		"""Returns the share of values looked up that were found in the cache"""
+		return self.hits / self.lookups if self.lookups else 0.0
+
+	def summary(self) -> str:
+		"""Describes how many values were decoded only once as human-readable text"""
+		return (f"Reused {self.hits} of {self.lookups} decoded values ({self.ratio():.1%}), "
+		        f"skipping decoding of {self.bytes_reused / 2**20:.2f} of "
+		        f"{self.bytes_looked / 2**20:.2f} MiB")
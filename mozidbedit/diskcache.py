@@ -0,0 +1,216 @@
+"""Keep decoded values between runs.
+
+`DiskCache` stores pickled decoded values in an SQLite database, keyed by a
+hash of their compressed data, so that later runs over the same profile (or
+over any data containing the same values) skip decompressing and parsing
+them. The least recently used values are removed once the stored values
+exceed the configured size.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import importlib.metadata
+import io
+import os
+import pathlib
+import pickle
+import sqlite3
+import threading
+import time
+import typing as ty
+
+from . import dedup
+from . import mozserial
+
+
+#: Version of the stored data, entries of other versions (or stored by other
+#: versions of the package or its decoder) are discarded
+FORMAT_VERSION = 1
+#: Default limit of the size of the stored (pickled) values
+DEFAULT_MAX_DISK_BYTES = 1 << 30
+#: Number of writes collected into each transaction
+WRITES_PER_COMMIT = 512
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+	name  TEXT PRIMARY KEY,
+	value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS value (
+	digest BLOB PRIMARY KEY,
+	data   BLOB NOT NULL,
+	size   INTEGER NOT NULL,
+	used   INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS value_used ON value (used);
+"""
+
+
+def cache_version() -> str:
+	"""Returns the version stored values are kept for"""
+	try:
+		package_version = importlib.metadata.version("moz-idb-edit")
+	except importlib.metadata.PackageNotFoundError:
+		package_version = "unknown"
+	return f"{FORMAT_VERSION}/{mozserial.DECODER_VERSION}/{package_version}"
+
+
+def default_path() -> pathlib.Path:
+	"""Returns the path of the cache database in the user's cache directory"""
+	cache_home = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+	return pathlib.Path(cache_home) / "moz-idb-edit" / "values.sqlite"
+
+
+class _Pickler(pickle.Pickler):
+	"""Pickler storing `memoryview`s (which cannot be pickled) as the bytes,
+	format and shape they are restored from"""
+	def persistent_id(self, obj: object) -> ty.Optional[ty.Tuple[bytes, str, ty.Tuple[int, ...]]]:
+		if type(obj) is memoryview:
+			return obj.tobytes(), obj.format, obj.shape or ()
+		return None
+
+
+class _Unpickler(pickle.Unpickler):
+	def persistent_load(self, pid: ty.Tuple[bytes, str, ty.Tuple[int, ...]]) -> memoryview:
+		data, fmt, shape = pid
+		try:
+			return memoryview(data).cast("B").cast(fmt, shape)
+		except (TypeError, ValueError) as exc:  # Format `memoryview` cannot be cast to
+			raise pickle.UnpicklingError(f"Cannot restore memoryview: {exc}") from None
+
+
+def _dumps(value: object) -> bytes:
+	try:
+		return pickle.dumps(value, protocol=5)
+	except TypeError:
+		file = io.BytesIO()
+		_Pickler(file, protocol=5).dump(value)
+		return file.getvalue()
+
+
+def _loads(data: bytes) -> object:
+	return _Unpickler(io.BytesIO(data)).load()
+
+
+class DiskCache(dedup.DecodeCache):
+	"""`dedup.DecodeCache` keeping decoded values in the database at `path`
+	(`default_path()` if `None`), up to `max_disk_bytes` of pickled values
+
+	Values are restored from the database rather than decoded if found there,
+	so lookups always return separate copies. New values and the use of
+	existing ones are written every `WRITES_PER_COMMIT` values and on `close`,
+	values used least recently being removed as needed then; values not
+	written yet are reused from memory.
+	"""
+	path:              pathlib.Path
+	max_disk_bytes:    int
+	disk_bytes:        int  # Size of the stored values
+	disk_hits:         int  # Number of values restored from the database
+	disk_bytes_reused: int  # Decompressed size of values restored from the database
+
+	def __init__(self, path: ty.Union[os.PathLike, str, None] = None, *,
+	             max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES):
+		# Values are only held as pickled data (`_new`), rather than twice
+		super().__init__(max_bytes=-1)
+		self.path = default_path() if path is None else pathlib.Path(path)
+		self.max_disk_bytes    = max_disk_bytes
+		self.disk_hits         = 0
+		self.disk_bytes_reused = 0
+
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		self._db = sqlite3.connect(self.path, check_same_thread=False)
+		self._db.execute("PRAGMA journal_mode=WAL")
+		self._db.execute("PRAGMA synchronous=NORMAL")
+		self._db.executescript(CACHE_SCHEMA)
+		version = cache_version()
+		row = self._db.execute("SELECT value FROM meta WHERE name='version'").fetchone()
+		if row is None or row[0] != version:
+			self._db.execute("DELETE FROM value")
+			self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('version', ?)",
+			                 (version,))
+			self._db.commit()
+		self.disk_bytes, = self._db.execute("SELECT total(size) FROM value").fetchone()
+		self.disk_bytes = int(self.disk_bytes)
+		self._db_lock = threading.Lock()
+		self._new: ty.Dict[bytes, bytes] = {}   # Digest → pickled value, not yet written
+		self._used: ty.Dict[bytes, int] = {}    # Digest → time of last use, not yet written
+
+	def __enter__(self) -> "DiskCache":
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
+
+	def decode(self, digest: bytes, size: int, decode: ty.Callable[[], object]) -> object:
+		return super().decode(digest, size, lambda: self._load(digest, size, decode))
+
+	def _load(self, digest: bytes, size: int, decode: ty.Callable[[], object]) -> object:
+		with self._db_lock:
+			data = self._new.get(digest)
+			if data is None:
+				row = self._db.execute("SELECT data FROM value WHERE digest=?", (digest,)).fetchone()
+				data = row[0] if row is not None else None
+			if data is not None:
+				self.disk_hits         += 1
+				self.disk_bytes_reused += size
+				self._used[digest] = time.time_ns()
+				self._maybe_flush()
+		if data is not None:
+			try:
+				return _loads(data)
+			except Exception:
+				pass  # Decode values that cannot be restored again
+
+		value = decode()
+		data = _dumps(value)
+		if len(data) <= self.max_disk_bytes:
+			with self._db_lock:
+				self._new[digest] = data
+				self._maybe_flush()
+		return value
+
+	def _maybe_flush(self) -> None:
+		if len(self._new) + len(self._used) >= WRITES_PER_COMMIT:
+			self._flush()
+
+	def _flush(self) -> None:
+		"""Writes new values and the time of use of existing ones, then removes
+		the least recently used values beyond the size limit"""
+		now = time.time_ns()
+		with self._db:
+			for digest, data in self._new.items():
+				cursor = self._db.execute("INSERT OR IGNORE INTO value (digest, data, size, used) "
+				                          "VALUES (?, ?, ?, ?)", (digest, data, len(data), now))
+				# Values already written by another process are not counted twice
+				if cursor.rowcount > 0:
+					self.disk_bytes += len(data)
+			self._db.executemany("UPDATE value SET used=? WHERE digest=?",
+			                     ((used, digest) for digest, used in self._used.items()))
+			self._new.clear()
+			self._used.clear()
+
+			if self.disk_bytes > self.max_disk_bytes:
+				digests = []
+				for digest, size in self._db.execute("SELECT digest, size FROM value ORDER BY used"):
+					if self.disk_bytes <= self.max_disk_bytes:
+						break
+					digests.append((digest,))
+					self.disk_bytes -= size
+				self._db.executemany("DELETE FROM value WHERE digest=?", digests)
+
+	def flush(self) -> None:
+		"""Writes all pending changes to the database"""
+		with self._db_lock:
+			self._flush()
+
+	def close(self) -> None:
+		self.flush()
+		self._db.close()
+
+	def summary(self) -> str:
+		return (f"Reused {self.hits + self.disk_hits} of {self.lookups} decoded values "
+		        f"({(self.hits + self.disk_hits) / self.lookups if self.lookups else 0.0:.1%}, "
+		        f"{self.disk_hits} from {self.path}), skipping decoding of "
+		        f"{(self.bytes_reused + self.disk_bytes_reused) / 2**20:.2f} of "
+		        f"{self.bytes_looked / 2**20:.2f} MiB")
@@ -0,0 +1,261 @@
+"""Search the stored values of databases for text.
+
+Strings are stored in the decompressed structured clone data as they are,
+either as Latin-1 or as UTF-16LE (starting at an 8-byte boundary), so each
+value is searched for the pattern in both encodings before decoding it, and
+only values containing it are decoded to find where the matching strings are.
+
+Since Snappy only copies data that occurred before, every byte of a
+decompressed value also occurs in the literal data of its compressed form:
+When searching for fixed text, values whose compressed data lacks any of the
+bytes of the text in both encodings are not even decompressed.
+
+Regular expressions are matched against each decoded string, since anchors
+such as `^` and `$` and lookarounds refer to the start and end of a string,
+which cannot be told from the raw data: every value is decoded for them.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import concurrent.futures
+import contextlib
+import io
+import json
+import pathlib
+import re
+import sqlite3
+import typing as ty
+
+from . import ccl_simplesnappy
+from . import mozserial
+from .mozidb import KeyCodec
+
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+#: Number of characters shown around the match of long strings
+EXCERPT_CONTEXT = 40
+
+
+class Pattern:
+	"""Text to search for, either fixed or as regular expression"""
+	text:        str
+	regex:       bool
+	ignore_case: bool
+
+	def __init__(self, text: str, *, regex: bool = False, ignore_case: bool = False):
+		self.text        = text
+		self.regex       = regex
+		self.ignore_case = ignore_case
+		self._compiled   = re.compile(text if regex else re.escape(text),
+		                              re.IGNORECASE if ignore_case else 0)
+
+		# Fixed text is looked up as bytes in each encoding it can be stored
+		# in, UTF-16 code units always starting at even offsets
+		self._needles: ty.List[ty.Tuple[bytes, int]] = []
+		if not regex and not ignore_case:
+			try:
+				self._needles.append((text.encode("latin-1"), 1))
+			except UnicodeEncodeError:
+				pass  # Only stored as UTF-16
+			self._needles.append((text.encode("utf-16-le", "surrogatepass"), 2))
+		self._needle_bytes = [frozenset(needle) for needle, _ in self._needles]
+
+	def may_match_compressed(self, data: bytes) -> bool:
+		"""Tells whether the given Snappy-compressed data may contain the
+		pattern once decompressed"""
+		if not self._needles:
+			return True
+		return any(all(byte in data for byte in needle_bytes)
+		           for needle_bytes in self._needle_bytes)
+
+	def may_match_buffer(self, buffer: bytes) -> bool:
+		"""Tells whether the given decompressed structured clone data may
+		contain a matching string"""
+		if self._needles:
+			return any(_find_aligned(buffer, needle, alignment)
+			           for needle, alignment in self._needles)
+		if self.regex:
+			return True
+		if self._compiled.search(buffer.decode("latin-1")) is not None:
+			return True
+		utf16 = buffer[:len(buffer) & ~1].decode("utf-16-le", "surrogatepass")
+		return self._compiled.search(utf16) is not None
+
+	def search(self, text: str) -> ty.Optional[ty.Match[str]]:
+		return self._compiled.search(text)
+
+
+def _find_aligned(buffer: bytes, needle: bytes, alignment: int) -> bool:
+	"""Tells whether `needle` occurs in `buffer` at an offset that is a
+	multiple of `alignment`"""
+	pos = buffer.find(needle)
+	while pos >= 0 and pos % alignment:
+		pos = buffer.find(needle, pos + 1)
+	return pos >= 0
+
+
+class Match(ty.NamedTuple):
+	"""String matching a pattern in a record"""
+	store: str
+	key:   object
+	path:  ty.Tuple[object, ...]  # Property names and array indices below the record
+	text:  str  # Matching string (shortened around the match if long)
+
+
+class DatabaseMatches(ty.NamedTuple):
+	"""Matches found in a database, with the number of records that were
+	searched, skipped without decompressing them and decoded
+
+	If the database could not be read, `error` tells why. `failed` counts the
+	records that could not be decompressed or decoded.
+	"""
+	path:     pathlib.Path
+	name:     ty.Optional[str]
+	matches:  ty.List[Match]
+	records:  int
+	skipped:  int
+	decoded:  int
+	failed:   int = 0
+	error:    ty.Optional[str] = None
+
+
+def excerpt(text: str, match: ty.Match[str], context: int = EXCERPT_CONTEXT) -> str:
+	"""Returns the match with up to `context` characters around it"""
+	start = max(match.start() - context, 0)
+	end   = min(match.end() + context, len(text))
+	return ("…" if start > 0 else "") + text[start:end] + ("…" if end < len(text) else "")
+
+
+def find_strings(value: object, pattern: Pattern, path: ty.Tuple[object, ...] = ()) \
+    -> ty.Iterator[ty.Tuple[ty.Tuple[object, ...], str]]:
+	"""Yields the path and excerpt of each string (or property name) within
+	`value` matching the pattern"""
+	if isinstance(value, str):
+		match = pattern.search(value)
+		if match is not None:
+			yield path, excerpt(value, match)
+	elif isinstance(value, dict):
+		for key, item in value.items():
+			if isinstance(key, str):
+				match = pattern.search(key)
+				if match is not None:
+					yield path + (key,), excerpt(key, match)
+			yield from find_strings(item, pattern, path + (key,))
+	elif isinstance(value, (list, tuple, mozserial.JSSetObj)):
+		for index, item in enumerate(value):
+			yield from find_strings(item, pattern, path + (index,))
+	elif isinstance(value, mozserial.JSRegExpObj):
+		yield from find_strings(value.expr, pattern, path)
+
+
+def format_path(key: object, path: ty.Sequence[object]) -> str:
+	"""Formats the path of a value as JMESPath expression, as accepted by
+	`read`, if the record key is a string"""
+	if isinstance(key, str):
+		parts = [json.dumps(key, ensure_ascii=False)]
+	else:
+		from . import to_json
+		parts = [json.dumps(to_json(key), ensure_ascii=False)]
+	for item in path:
+		if isinstance(item, int) and not isinstance(item, bool):
+			parts.append(f"[{item}]")
+		elif isinstance(item, str) and _IDENTIFIER.fullmatch(item):
+			parts.append(f".{item}")
+		elif isinstance(item, str):
+			parts.append("." + json.dumps(item, ensure_ascii=False))
+		else:  # Non-string `Map` keys
+			parts.append("." + json.dumps(str(item), ensure_ascii=False))
+	return "".join(parts)
+
+
+def _decode_key(key: bytes) -> object:
+	try:
+		return KeyCodec.decode(key)
+	except Exception:
+		return key.hex()
+
+
+def _read_value_file(file_ids: str, files_dir: pathlib.Path) -> ty.Optional[bytes]:
+	"""Returns the framed Snappy data of a value stored in a file, if any"""
+	for file_id in file_ids.split():
+		if file_id.startswith(".") and file_id[1:].isnumeric():
+			return (files_dir / file_id[1:]).read_bytes()
+	return None
+
+
+def grep_database(db_path: pathlib.Path, pattern: Pattern) -> DatabaseMatches:
+	"""Searches the keys and values of all records of the given database for
+	strings matching the pattern"""
+	files_dir = db_path.with_name(db_path.name.removesuffix(".sqlite") + ".files")
+	matches: ty.List[Match] = []
+	records = skipped = decoded = failed = 0
+	name = None
+
+	uri = db_path.absolute().as_uri() + "?mode=ro"
+	try:
+		with contextlib.closing(sqlite3.connect(uri, uri=True)) as conn:
+			row = conn.execute("SELECT name FROM database").fetchone()
+			name = row[0] if row is not None else None
+			store_names = dict(conn.execute("SELECT id, name FROM object_store"))
+
+			rows = conn.execute("SELECT object_store_id, key, data, file_ids FROM object_data")
+			for store_id, raw_key, data, file_ids in rows:
+				records += 1
+				store_name = store_names.get(store_id, str(store_id))
+
+				# Keys are stored separately and much smaller, so simply decode them
+				key = _decode_key(raw_key)
+				for _, text in find_strings(key, pattern):
+					matches.append(Match(store_name, key, (), text))
+
+				try:
+					framed = _read_value_file(file_ids, files_dir) if file_ids is not None else None
+					compressed = framed if framed is not None else data
+					if not pattern.may_match_compressed(compressed):
+						skipped += 1
+						continue
+
+					if framed is not None:
+						buffer = io.BytesIO()
+						ccl_simplesnappy.decompress_framed(io.BytesIO(framed), buffer, mozilla_mode=True)
+						decompressed = buffer.getvalue()
+					else:
+						decompressed = ccl_simplesnappy.decompress_buffer(data)
+					if not pattern.may_match_buffer(decompressed):
+						continue
+
+					decoded += 1
+					value = mozserial.Reader(decompressed, plain_ints=True).read()
+				except Exception:  # Damaged values are counted, not reported
+					failed += 1
+					continue
+				for path, text in find_strings(value, pattern):
+					matches.append(Match(store_name, key, path, text))
+	except sqlite3.Error as exc:
+		return DatabaseMatches(db_path, name, matches, records, skipped, decoded, failed, str(exc))
+
+	return DatabaseMatches(db_path, name, matches, records, skipped, decoded, failed)
+
+
+def _grep_task(task: ty.Tuple[pathlib.Path, Pattern]) -> DatabaseMatches:
+	return grep_database(*task)
+
+
+def grep(
+		db_paths: ty.Iterable[pathlib.Path],
+		pattern: Pattern,
+		*,
+		jobs: ty.Optional[int] = None,
+) -> ty.Iterator[DatabaseMatches]:
+	"""Yields the matches found in each of the given databases, in order
+
+	Databases are searched by `jobs` processes (one per CPU if `None`).
+	"""
+	tasks = [(db_path, pattern) for db_path in db_paths]
+	if jobs == 1 or len(tasks) <= 1:
+		yield from map(_grep_task, tasks)
+		return
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+		yield from executor.map(_grep_task, tasks)
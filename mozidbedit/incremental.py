@@ -0,0 +1,200 @@
+"""Track which records of IndexedDB databases changed between runs."""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import os
+import sqlite3
+import typing as ty
+
+from . import mozidb
+
+
+#: Version of `STATE_SCHEMA`, state databases of other versions are reset
+#: (reporting all records again)
+STATE_VERSION = 2
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermark (
+	db_path      TEXT PRIMARY KEY,
+	size         INTEGER NOT NULL,
+	mtime_ns     INTEGER NOT NULL,
+	wal_size     INTEGER NOT NULL,
+	wal_mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS row_hash (
+	db_path  TEXT NOT NULL,
+	store_id INTEGER NOT NULL,
+	key      BLOB NOT NULL,
+	hash     BLOB NOT NULL,
+	PRIMARY KEY (db_path, store_id, key)
+) WITHOUT ROWID;
+"""
+
+
+class Change(ty.NamedTuple):
+	"""A record of object store `store` that was added or modified
+	(`op == "put"`) or deleted (`op == "delete"`, `value` being `None`)"""
+	op:    str
+	store: str
+	key:   object
+	value: object = None
+
+
+class Watermark(ty.NamedTuple):
+	"""File metadata of a database that changes whenever its contents do"""
+	size:         int
+	mtime_ns:     int
+	wal_size:     int
+	wal_mtime_ns: int
+
+	@classmethod
+	def of(cls, db_path: ty.Union[os.PathLike, str]) -> "Watermark":
+		stat = os.stat(db_path)
+		try:
+			# Firefox uses write-ahead logging, so changes may only be visible
+			# in the log file until it is checkpointed
+			wal_stat = os.stat(os.fsdecode(db_path) + "-wal")
+		except FileNotFoundError:
+			wal_size = wal_mtime_ns = 0
+		else:
+			wal_size, wal_mtime_ns = wal_stat.st_size, wal_stat.st_mtime_ns
+		return cls(stat.st_size, stat.st_mtime_ns, wal_size, wal_mtime_ns)
+
+
+def row_hash(data: bytes, file_ids: ty.Optional[str]) -> bytes:
+	"""Hashes the stored (compressed) form of a record"""
+	digest = hashlib.blake2b(data, digest_size=16)
+	if file_ids is not None:
+		digest.update(b"\0" + file_ids.encode("utf-8"))
+	return digest.digest()
+
+
+class ChangeTracker:
+	"""Remembers the watermark and row hashes of databases in a separate state
+	database, so that later runs only need to decode records that changed
+
+	`PRAGMA data_version` is only comparable between calls on the same
+	connection, so it is kept in memory to cheaply skip unchanged databases when
+	the same `IndexedDB` object is checked repeatedly (such as when watching a
+	database), while the file watermark is persisted between runs.
+	"""
+	def __init__(self, state_path: ty.Union[os.PathLike, str]):
+		self._state = sqlite3.connect(state_path)
+		if self._state.execute("PRAGMA user_version").fetchone()[0] != STATE_VERSION:
+			with self._state:
+				self._state.execute("DROP TABLE IF EXISTS watermark")
+				self._state.execute("DROP TABLE IF EXISTS row_hash")
+				self._state.execute(f"PRAGMA user_version = {STATE_VERSION}")
+		self._state.executescript(STATE_SCHEMA)
+		self._data_versions: ty.Dict[str, ty.Tuple[mozidb.IndexedDB, int]] = {}
+
+	def __enter__(self) -> "ChangeTracker":
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
+
+	def close(self) -> None:
+		self._state.close()
+
+	@staticmethod
+	def _db_key(conn: mozidb.IndexedDB) -> str:
+		return os.fsdecode(conn.path.absolute())
+
+	def _data_version(self, conn: mozidb.IndexedDB) -> int:
+		return conn.execute("PRAGMA data_version").fetchone()[0]
+
+	def is_unchanged(self, conn: mozidb.IndexedDB) -> bool:
+		"""Cheaply checks whether the database certainly did not change since
+		its changes were last collected"""
+		db_key = self._db_key(conn)
+		known = self._data_versions.get(db_key)
+		if known is not None and known[0] is conn:
+			return known[1] == self._data_version(conn)
+
+		row = self._state.execute(
+			"SELECT size, mtime_ns, wal_size, wal_mtime_ns FROM watermark WHERE db_path=?", (db_key,)
+		).fetchone()
+		return row is not None and Watermark(*row) == Watermark.of(conn.path)
+
+	def changes(
+			self,
+			conn: mozidb.IndexedDB,
+			*,
+			full: bool = False,
+			on_error: ty.Optional[ty.Callable[[str, object, Exception], None]] = None,
+	) -> ty.Iterator[Change]:
+		"""Yields the records added, modified or deleted since the last time the
+		changes of this database were collected (all records on the first run
+		or if `full` is set)
+
+		Only the changed records are decompressed and decoded. The new state is
+		stored once all changes were consumed, so an interrupted run reports
+		the same changes again the next time.
+
+		If `on_error` is given, records that cannot be decoded are skipped after
+		passing their store name, key and the exception to it (they are only
+		reported again once they change), rather than ending the iteration.
+		"""
+		store_names = dict(conn.execute("SELECT id, name FROM object_store"))
+		for op, store_id, key_name, data, file_ids in self._diff(conn, full):
+			store_name = store_names.get(store_id, str(store_id))
+			if op == "put":
+				try:
+					key, value = conn.decode_record(key_name, data, file_ids)
+				except mozidb.DECODE_ERRORS as exc:
+					if on_error is None:
+						raise
+					on_error(store_name, conn._decode_key(key_name), exc)
+					continue
+				yield Change("put", store_name, key, value)
+			else:
+				yield Change("delete", store_name, conn._decode_key(key_name))
+
+	def mark_seen(self, conn: mozidb.IndexedDB) -> None:
+		"""Records the current state of the database without decoding anything,
+		so that only later changes are reported"""
+		for _ in self._diff(conn, False):
+			pass
+
+	def _diff(self, conn: mozidb.IndexedDB, full: bool) \
+	    -> ty.Iterator[ty.Tuple[str, int, bytes, ty.Optional[bytes], ty.Optional[str]]]:
+		db_key = self._db_key(conn)
+		if not full and self.is_unchanged(conn):
+			return
+
+		# Take the watermark first, so that changes made while reading are
+		# caught by the next run
+		watermark = Watermark.of(conn.path)
+		data_version = self._data_version(conn)
+
+		# The same key may be used in several object stores
+		known: ty.Dict[ty.Tuple[int, bytes], bytes] = {}
+		if not full:
+			known = {(store_id, key_name): digest for store_id, key_name, digest in self._state.execute(
+				"SELECT store_id, key, hash FROM row_hash WHERE db_path=?", (db_key,)
+			)}
+
+		updated: ty.List[ty.Tuple[str, int, bytes, bytes]] = []
+		cur = conn.execute("SELECT object_store_id, key, data, file_ids FROM object_data")
+		for store_id, key_name, data, file_ids in cur:
+			digest = row_hash(data, file_ids)
+			if known.pop((store_id, key_name), None) != digest:
+				updated.append((db_key, store_id, key_name, digest))
+				yield "put", store_id, key_name, data, file_ids
+
+		# Keys that were not seen anymore have been deleted
+		for store_id, key_name in known:
+			yield "delete", store_id, key_name, None, None
+
+		with self._state:
+			if full:
+				self._state.execute("DELETE FROM row_hash WHERE db_path=?", (db_key,))
+			self._state.executemany("INSERT OR REPLACE INTO row_hash VALUES (?, ?, ?, ?)", updated)
+			self._state.executemany("DELETE FROM row_hash WHERE db_path=? AND store_id=? AND key=?",
+			                        ((db_key, *store_key) for store_key in known))
+			self._state.execute("INSERT OR REPLACE INTO watermark VALUES (?, ?, ?, ?, ?)",
+			                    (db_key, *watermark))
+		self._data_versions[db_key] = (conn, data_version)
@@ -7,6 +7,7 @@
 #     https://searchfox.org/mozilla-central/rev/cc2040bf219ca3279405e09428f9457d41616bf9/dom/indexedDB/Key.cpp
 #   – Python source code by Erin Yuki Schlarb, 2020–2024.
 
+import concurrent.futures
 import datetime
 import enum
 import math
@@ -21,6 +22,11 @@ import typing as ty
 from . import mozserial
 # from . import mozsnappy
 from . import ccl_simplesnappy
+from . import scheduler
+from .stats import StageStats, Stats
+
+if ty.TYPE_CHECKING:
+	from .dedup import DecodeCache
 
 class KeyType(enum.IntEnum):
 	TERMINATOR = 0
@@ -40,6 +46,9 @@ class KeyCodec:
 
 	MAX_ARRAY_COLLAPSE = 3
 
+	# Maps each character (up to `ONE_BYTE_LIMIT`) to its one-byte encoding
+	_ONE_BYTE_TABLE = bytes(range(ONE_BYTE_ADJUST, 256)) + bytes(range(ONE_BYTE_ADJUST))
+
 	@classmethod
 	def encode(cls, value: object) -> bytes:
 		buf = bytearray()
@@ -81,7 +90,7 @@ class KeyCodec:
 
 		if isinstance(value, datetime.datetime):
 			value = value.astimezone(datetime.timezone.utc).timestamp()
-			buf += cls._encode_number(value, int(KeyType.DATE) + type_off)
+			cls._encode_number(buf, value * 1000, int(KeyType.DATE) + type_off)
 			return
 
 		if isinstance(value, (bytes, bytearray, memoryview)):
@@ -120,7 +129,7 @@ class KeyCodec:
 		elif type == KeyType.DATE:
 			timestamp, index = cls._decode_number(buf, index, KeyType.DATE)
 
-			result = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+			result = datetime.datetime.fromtimestamp(timestamp / 1000, datetime.timezone.utc)
 			return result, index
 		elif type == KeyType.FLOAT:
 			return cls._decode_number(buf, index, KeyType.FLOAT)
@@ -135,18 +144,20 @@ class KeyCodec:
 		cls._encode_number(buf, float(value), int(KeyType.FLOAT) + type_off)
 		return bytes(buf)
 
-	def _encode_number(cls, buf: bytearray, value: float, type: int) -> bytes:
+	@classmethod
+	def _encode_number(cls, buf: bytearray, value: float, type: int):
 		# Write type marker
 		buf.append(type)
 
-		as_int = struct.unpack("=q", struct.pack("=d", value))[0]
-		if value < 0:
+		as_int = struct.unpack("<Q", struct.pack("<d", value))[0]
+		if as_int & 0x8000000000000000:
 			as_int = (0 - as_int) & 0xFFFFFFFFFFFFFFFF
 		else:
-			as_int |= 0x7000000000000000
+			as_int |= 0x8000000000000000
 
-		buf.append(struct.pack(">q", as_int))
+		buf += struct.pack(">Q", as_int)
 
+	@classmethod
 	def _decode_number(cls, buf: bytes, index: int, type: int) -> float:
 		assert buf[index] % int(KeyType.ARRAY) == type, "Don't call me!"
 		index += 1
@@ -177,12 +188,19 @@ class KeyCodec:
 		# Write type marker
 		buf.append(type)
 
+		# Fast path for strings made up of characters encoded as one byte
+		if value.isascii() and "\x7f" not in value:
+			buf += value.encode("ascii").translate(cls._ONE_BYTE_TABLE)
+			buf.append(int(KeyType.TERMINATOR))
+			return
+
 		# Encode string
 		for uscalar in map(ord, value):
 			# Strings are encoded per UTF-16 codepoint
 			if uscalar <= 0xFFFF:
 				codepoints = (uscalar,)
 			else:
+				uscalar -= 0x10000
 				codepoints = ((uscalar >> 10) | 0xD800, (uscalar & 0x3FF) | 0xDC00)
 
 			for c in codepoints:
@@ -206,7 +224,7 @@ class KeyCodec:
 		index += 1
 
 		result = bytearray()
-		while index < len(buf) and buf[index] - type_off != KeyType.TERMINATOR:
+		while index < len(buf) and buf[index] != KeyType.TERMINATOR:
 			c = buf[index]
 			index += 1
 
@@ -217,7 +235,7 @@ class KeyCodec:
 				if index < len(buf):
 					c |= buf[index]
 					index += 1
-				c -= cls.TWO_BYTE_ADJUST - 0x8000
+				c = (c & 0x7FFF) - cls.TWO_BYTE_ADJUST
 			elif type != KeyType.BINARY:
 				c = c << (16 - cls.THREE_BYTE_SHIFT)
 				if index < len(buf):
@@ -226,14 +244,19 @@ class KeyCodec:
 				if index < len(buf):
 					c |= buf[index] >> cls.THREE_BYTE_SHIFT
 					index += 1
+				c &= 0xFFFF
 
 			if type != KeyType.BINARY:
-				result += c.to_bytes(4, "little")
+				# Strings are encoded per UTF-16 codepoint
+				result += c.to_bytes(2, "little")
 			else:
 				result.append(c & 0xFF)
 
+		if index < len(buf):
+			index += 1  # Skip terminator
+
 		if type != KeyType.BINARY:
-			result = result.decode("UTF-32le")
+			result = result.decode("utf-16le", "surrogatepass")
 		return result, index
 
 	@classmethod
@@ -256,11 +279,47 @@ class KeyCodec:
 		buf.append(int(KeyType.TERMINATOR) + type_off)
 
 
-class IndexedDB(sqlite3.Connection):
-	files_dir: pathlib.Path
+_NO_DEFAULT = object()
+
+#: Exceptions raised when reading a record fails because its stored data is
+#: damaged, uses unsupported features or was removed (values in `.files`)
+DECODE_ERRORS = (ValueError, EOFError, NotImplementedError, OSError)
+
 
-	def __init__(self, dbpath: ty.Union[os.PathLike, str, bytes]):
-		super().__init__(dbpath)
+class IndexedDB(sqlite3.Connection):
+	# Number of keys looked up by each query of `read_many`, staying below
+	# the limit of bound parameters of older SQLite versions
+	_KEYS_PER_QUERY = 500
+
+	# The primary key of `object_data` is (`object_store_id`, `key`), so a
+	# condition on the object store is required for looking up keys using it
+	# rather than scanning the whole table
+	_KEY_LOOKUP = "object_store_id IN (SELECT id FROM object_store)"
+
+	path:          pathlib.Path
+	files_dir:     pathlib.Path
+	decode_cache:  ty.Optional["DecodeCache"]
+	intern_values: int
+	mmap:          bool
+	plain_ints:    bool
+	stats:         ty.Optional[Stats]
+
+	def __init__(self, dbpath: ty.Union[os.PathLike, str, bytes], *, plain_ints: bool = False,
+	             intern_values: int = 0, stats: ty.Optional[Stats] = None,
+	             readonly: bool = False, check_same_thread: bool = True, mmap: bool = False,
+	             decode_cache: ty.Optional["DecodeCache"] = None):
+		if readonly:
+			uri = pathlib.Path(os.fsdecode(dbpath)).absolute().as_uri() + "?mode=ro"
+			super().__init__(uri, uri=True, check_same_thread=check_same_thread)
+		else:
+			super().__init__(dbpath, check_same_thread=check_same_thread)
+		self.decode_cache  = decode_cache
+		self.intern_values = intern_values
+		self.mmap          = mmap
+		self.plain_ints    = plain_ints
+		self.stats         = stats
+		self.path          = pathlib.Path(os.fsdecode(dbpath))
+		self._stats_name   = os.fsdecode(dbpath)
 		try:
 			self.files_dir = pathlib.Path(os.fsdecode(dbpath).removesuffix(".sqlite") + ".files")
 		except:
@@ -275,7 +334,85 @@ class IndexedDB(sqlite3.Connection):
 			return None
 		return result[0]
 
-	def read_object(self, key_name: object) -> object:
+	def _new_string_table(self) -> mozserial.StringTable:
+		return mozserial.StringTable(max_value_length=self.intern_values)
+
+	def stage(self, name: str) -> StageStats:
+		"""Returns the counters of stage `name` of this database (new ones that
+		are discarded if `stats` is not set)"""
+		if self.stats is None:
+			return StageStats()
+		return self.stats.stage(name, self._stats_name)
+
+	def _decompress(self, data: ty.Union[bytes, memoryview], file_ids: ty.Optional[str]) \
+	    -> ty.Union[bytes, memoryview]:
+		if file_ids is not None:
+			# Large values are not stored inline but in a separate file below
+			# `files_dir`, its ID being marked with a leading dot in the
+			# space-separated list of referenced files
+			for file_id in file_ids.split():
+				if file_id.startswith(".") and file_id[1:].isnumeric():
+					with open(self.files_dir / file_id[1:], "rb") as file:
+						decompressed = io.BytesIO()
+						ccl_simplesnappy.decompress_framed(file, decompressed, mozilla_mode=True)
+						self.stage("snappy.decompress").bytes_in += file.tell()
+					return decompressed.getbuffer()
+
+		# return mozsnappy.decompress_raw(data)
+		self.stage("snappy.decompress").bytes_in += len(data)
+		return ccl_simplesnappy.decompress_buffer(data)
+
+	def _decode_data(self, data: ty.Union[bytes, memoryview], file_ids: ty.Optional[str],
+	                 strings: ty.Optional[mozserial.StringTable] = None) -> object:
+		# Identical values are decoded once per cache, values stored in
+		# files (with an empty `data` column) are always decoded
+		if self.decode_cache is not None and (file_ids is None or "." not in file_ids):
+			return self.decode_cache.decode(
+				self.decode_cache.digest(data, self.plain_ints),
+				scheduler.uncompressed_size(data, None, self.files_dir),
+				lambda: self._decode_uncached(data, file_ids, strings),
+			)
+		return self._decode_uncached(data, file_ids, strings)
+
+	def _decode_uncached(self, data: ty.Union[bytes, memoryview], file_ids: ty.Optional[str],
+	                     strings: ty.Optional[mozserial.StringTable] = None) -> object:
+		if strings is None:
+			strings = self._new_string_table()
+
+		with self.stage("snappy.decompress") as stage:
+			decompressed = self._decompress(data, file_ids)
+			stage.bytes_out += len(decompressed)
+		with self.stage("mozserial.read") as stage:
+			stage.bytes_in += len(decompressed)
+			reader = mozserial.Reader(decompressed, plain_ints=self.plain_ints, strings=strings)
+			return reader.read()
+
+	def _decode_key(self, key: bytes) -> object:
+		"""Decodes the given key, falling back to its hexadecimal representation
+		if it cannot be decoded"""
+		with self.stage("key.decode") as stage:
+			stage.bytes_in += len(key)
+			try:
+				return KeyCodec.decode(key)
+			except:
+				stage.errors += 1
+				return key.hex()
+
+	def _fetch_rows(self, rows: ty.Iterator[ty.Tuple[bytes, ...]]) -> ty.Iterator[ty.Tuple[bytes, ...]]:
+		"""Yields the rows of `rows` (such as a cursor), timing each fetch"""
+		stage = self.stage("sqlite.fetch")
+		while True:
+			with stage:
+				row = next(rows, None)
+			if row is None:
+				break
+			stage.rows += 1
+			stage.bytes_in += sum(len(column) for column in row if column is not None)
+			yield row
+
+	def read_raw_object(self, key_name: object) -> ty.Tuple[bytes, ty.Optional[str]]:
+		"""Returns the still compressed data and the file IDs of the record with
+		the given key, to be decoded by `decode_record`"""
 		if isinstance(key_name, bytes):
 			key = key_name
 		else:
@@ -283,61 +420,123 @@ class IndexedDB(sqlite3.Connection):
 			
 		# Query data
 		cur = self.cursor()
-		cur.execute("SELECT data, file_ids FROM object_data WHERE key=?", (key,))
-		result = cur.fetchone()
+		cur.execute(f"SELECT data, file_ids FROM object_data WHERE {self._KEY_LOOKUP} AND key=?", (key,))
+		result = next(self._fetch_rows(cur), None)
 		if result is None:
 			raise KeyError(key_name)
+		return result
 
-		# Validate data
-		data, file_ids = result
-
+	def read_object(self, key_name: object) -> object:
 		# Parse data
-		if file_ids is None:
-			# decompressed = mozsnappy.decompress_raw(data)			
-			decompressed = ccl_simplesnappy.decompress(io.BytesIO(data))
-			reader = mozserial.Reader(io.BufferedReader(io.BytesIO(decompressed)))
-			return reader.read()
-		else:
-			#FIXME: Figure out the actual format of `file_ids`
-			assert file_ids.startswith(".") and file_ids.removeprefix(".").isnumeric()
-
-			# with open(self.files_dir / file_ids.removeprefix("."), "rb") as file:
-			# 	reader = mozserial.Reader(io.BufferedReader(mozsnappy.Decompressor(file)))
-			# 	return reader.read()
-
-	def read_objects(self) -> ty.Dict[object, object]:
-		items = {}
+		data, file_ids = self.read_raw_object(key_name)
+		return self._decode_data(data, file_ids)
+
+	def read_many(self, key_names: ty.Iterable[object], *, default: object = _NO_DEFAULT,
+	              executor: ty.Optional[concurrent.futures.Executor] = None,
+	              max_decode_bytes: int = scheduler.DEFAULT_MAX_BYTES) -> ty.List[object]:
+		"""Returns the decoded values of the records with the given keys, in the
+		order of the keys
+
+		Rather than querying each key on its own, keys are looked up in batches
+		and each distinct key is only decoded once. If any of the keys does not
+		exist, `KeyError` is raised with the list of all missing keys, unless
+		`default` is given, which is returned for them instead. Values are
+		decoded using `executor` if given (such as a `ThreadPoolExecutor`),
+		with at most `max_decode_bytes` of decompressed data being decoded at
+		the same time (see `scheduler.DecodeScheduler`).
+		"""
+		key_names = list(key_names)
+		keys = [key_name if isinstance(key_name, bytes) else KeyCodec.encode(key_name)
+		        for key_name in key_names]
+		unique_keys = list(dict.fromkeys(keys))
 
 		# Query data
+		rows: ty.Dict[bytes, ty.Tuple[bytes, ty.Optional[str]]] = {}
 		cur = self.cursor()
-		cur.execute("SELECT key, data, file_ids FROM object_data")
-		result = cur.fetchone()
-		while result is not None:
-			# Validate data
-			key_name, data, file_ids = result
+		for start in range(0, len(unique_keys), self._KEYS_PER_QUERY):
+			chunk = unique_keys[start:start + self._KEYS_PER_QUERY]
+			cur.execute(f"SELECT key, data, file_ids FROM object_data WHERE {self._KEY_LOOKUP} "
+			            f"AND key IN ({', '.join('?' * len(chunk))})", chunk)
+			for key, data, file_ids in self._fetch_rows(cur):
+				rows[key] = data, file_ids
 
-			# Parse data
-			if file_ids is None:
-				# decompressed = mozsnappy.decompress_raw(data)
-				decompressed = ccl_simplesnappy.decompress(io.BytesIO(data))
-				reader = mozserial.Reader(io.BufferedReader(io.BytesIO(decompressed)))
-				content = reader.read()
-			else:
-				#FIXME: Figure out the actual format of `file_ids`
-				assert file_ids.startswith(".") and file_ids.removeprefix(".").isnumeric()
+		missing = [key_name for key_name, key in zip(key_names, keys) if key not in rows]
+		if missing and default is _NO_DEFAULT:
+			raise KeyError(missing)
 
-				# with open(self.files_dir / file_ids.removeprefix("."), "rb") as file:
-				# 	reader = mozserial.Reader(io.BufferedReader(mozsnappy.Decompressor(file)))
-				# 	content = reader.read()
-				# 	print(content)
-			try:
-				items[KeyCodec.decode(key_name)] = content
-			except:
-				items[key_name.hex()] = content
+		# Parse data
+		found = list(rows.items())
+		if executor is None:
+			strings = self._new_string_table()
+			decoded = [self._decode_data(data, file_ids, strings) for _, (data, file_ids) in found]
+		else:
+			sizes = (scheduler.uncompressed_size(data, file_ids, self.files_dir)
+			         for _, (data, file_ids) in found)
+			decoder = scheduler.DecodeScheduler(executor, max_decode_bytes)
+			decoded = list(decoder.map(self._decode_data, (row for _, row in found), sizes))
+		values = dict(zip((key for key, _ in found), decoded))
+		return [values.get(key, default) for key in keys]
+
+	def decode_record(self, key_name: bytes, data: bytes, file_ids: ty.Optional[str]) \
+	    -> ty.Tuple[object, object]:
+		"""Decodes the raw columns of an `object_data` row into its key and value
+
+		Does not use the database connection, so it may be called from any thread.
+		"""
+		return self._decode_key(key_name), self._decode_data(data, file_ids)
+
+	def iter_objects(self) -> ty.Iterator[ty.Tuple[object, object]]:
+		"""Yields each key and its decoded value without collecting all of them
+		in memory first
+
+		If `mmap` is set, rows are read from the memory-mapped database file
+		rather than through SQLite, avoiding copies of the stored data (see
+		`sqlitefile` for the restrictions).
+		"""
+		# Share interned property names between all records of this pass
+		strings = self._new_string_table()
 
-			result = cur.fetchone()
+		# Query data
+		if self.mmap:
+			from . import sqlitefile
+			cur: ty.Iterator[ty.Tuple[bytes, ...]] = sqlitefile.iter_object_data(self)
+		else:
+			cur = self.cursor()
+			cur.execute("SELECT key, data, file_ids FROM object_data")
+		for key_name, data, file_ids in self._fetch_rows(cur):
+			# Parse data
+			content = self._decode_data(data, file_ids, strings)
+			yield self._decode_key(key_name), content
 
-		return items
+	def read_objects(self) -> ty.Dict[object, object]:
+		return dict(self.iter_objects())
+
+	def iter_range(self, lower: object = None, upper: object = None, *,
+	               lower_open: bool = False, upper_open: bool = False,
+	               limit: int = -1) -> ty.Iterator[ty.Tuple[object, object]]:
+		"""Yields the keys and decoded values of the records with keys between
+		`lower` and `upper` (`None` meaning unbounded) in key order
+
+		As the key encoding preserves the order of keys, this only decodes the
+		matching rows.
+		"""
+		conditions = [self._KEY_LOOKUP]
+		params: ty.List[object] = []
+		if lower is not None:
+			conditions.append("key > ?" if lower_open else "key >= ?")
+			params.append(KeyCodec.encode(lower))
+		if upper is not None:
+			conditions.append("key < ?" if upper_open else "key <= ?")
+			params.append(KeyCodec.encode(upper))
+		params.append(limit)
+
+		strings = self._new_string_table()
+		cur = self.cursor()
+		cur.execute(f"SELECT key, data, file_ids FROM object_data WHERE {' AND '.join(conditions)} "
+		            f"ORDER BY key LIMIT ?", params)
+		for key_name, data, file_ids in self._fetch_rows(cur):
+			content = self._decode_data(data, file_ids, strings)
+			yield self._decode_key(key_name), content
 
 	def list_objects(self) -> ty.List[object]:
 		key_names = []
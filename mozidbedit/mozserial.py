@@ -8,15 +8,26 @@
 #     and many helpful comments were copied as-is.
 #   – Python source code by Erin Yuki Schlarb, 2020.
 
-import collections
+import array
+import collections.abc
 import datetime
 import enum
 import io
 import re
 import struct
+import sys
 import typing as ty
 
 
+#: Version of the values `Reader` produces, to be increased whenever it decodes
+#: data differently or the layout of the types it returns changes (values
+#: kept by `diskcache` from other versions are decoded again)
+DECODER_VERSION = 1
+
+_DOUBLE = struct.Struct("<d")
+_UINT64 = struct.Struct("<Q")
+
+
 class ParseError(ValueError):
 	pass
 
@@ -27,23 +38,37 @@ class InvalidHeaderError(ParseError):
 
 class JSInt32(int):
 	"""Type to represent the standard 32-bit signed integer"""
-	def __init__(self, *a):
+	__slots__ = ()
+
+	def __new__(cls, *a):
+		self = int.__new__(cls, *a)
 		if not (-0x80000000 <= self <= 0x7FFFFFFF):
 			raise TypeError("JavaScript integers are signed 32-bit values")
+		return self
+
+	@classmethod
+	def _from_wire(cls, value: int) -> "JSInt32":
+		"""Creates a new instance without range checking `value`
+
+		Only to be used for values that are known to be in range, such as the
+		ones decoded by `Reader`."""
+		return int.__new__(cls, value)
 
 
 class JSBigInt(int):
 	"""Type to represent the arbitrary precision JavaScript “BigInt” type"""
+	__slots__ = ()
 
 	def __repr__(self) -> str:
-		return f"BigInt({self!s})"
+		return f"BigInt({int.__repr__(self)})"
 
 
 class JSBigIntObj(JSBigInt):
 	"""Type to represent the JavaScript BigInt object type (vs the primitive type)"""
+	__slots__ = ()
 
 	def __repr__(self) -> str:
-		return f"new BigInt({self!s})"
+		return f"new BigInt({int.__repr__(self)})"
 
 
 class JSBooleanObj(int):
@@ -52,8 +77,8 @@ class JSBooleanObj(int):
 	Note: This derives from `int`, since one cannot directly derive from `bool`."""
 	__slots__ = ()
 
-	def __new__(self, inner: object = False):
-		return int.__new__(bool(inner))
+	def __new__(cls, inner: object = False):
+		return int.__new__(cls, bool(inner))
 
 	def __and__(self, other: bool) -> bool:
 		return bool(self) & other
@@ -82,11 +107,18 @@ class JSBooleanObj(int):
 
 
 class _HashableContainer:
+	"""Wrapper making unhashable (mutable) objects usable as dictionary keys
+	by comparing them by identity, like JavaScript does for object keys"""
+	__slots__ = ("inner",)
+
 	inner: object
 
 	def __init__(self, inner: object):
 		self.inner = inner
 
+	def __eq__(self, other: object) -> bool:
+		return isinstance(other, _HashableContainer) and self.inner is other.inner
+
 	def __hash__(self):
 		return id(self.inner)
 
@@ -97,8 +129,25 @@ class _HashableContainer:
 		return str(self.inner)
 
 
-class JSMapObj(collections.UserDict):
-	"""JavaScript compatible Map object that allows arbitrary values for the key."""
+def _unwrap_key(key: object) -> object:
+	return key.inner if type(key) is _HashableContainer else key
+
+
+class JSMapObj(dict):
+	"""JavaScript compatible Map object that allows arbitrary values for the key.
+
+	Hashable keys are stored in the underlying `dict` as-is, only unhashable
+	keys (JavaScript objects and arrays) are wrapped to be compared by identity.
+	"""
+	__slots__ = ("_wrapped",)
+
+	_wrapped: int  # Number of keys currently stored wrapped
+
+	def __init__(self, other: object = (), **kwargs):
+		super().__init__()
+		self._wrapped = 0
+		self.update(other, **kwargs)
+
 	@staticmethod
 	def key_to_hashable(key: object) -> collections.abc.Hashable:
 		try:
@@ -112,33 +161,90 @@ class JSMapObj(collections.UserDict):
 		return super().__contains__(self.key_to_hashable(key))
 
 	def __delitem__(self, key: object) -> None:
-		return super().__delitem__(self.key_to_hashable(key))
+		key = self.key_to_hashable(key)
+		super().__delitem__(key)
+		if type(key) is _HashableContainer:
+			self._wrapped -= 1
 
 	def __getitem__(self, key: object) -> object:
 		return super().__getitem__(self.key_to_hashable(key))
 
 	def __iter__(self) -> ty.Iterator[object]:
-		for key in super().__iter__():
-			if isinstance(key, _HashableContainer):
-				key = key.inner
-			yield key
+		if not self._wrapped:
+			return super().__iter__()
+		return map(_unwrap_key, super().__iter__())
 
 	def __setitem__(self, key: object, value: object):
-		super().__setitem__(self.key_to_hashable(key), value)
+		key = self.key_to_hashable(key)
+		if type(key) is _HashableContainer and not super().__contains__(key):
+			self._wrapped += 1
+		super().__setitem__(key, value)
+
+	def clear(self) -> None:
+		super().clear()
+		self._wrapped = 0
+
+	def copy(self) -> "JSMapObj":
+		return type(self)(self.items())
+
+	def get(self, key: object, default: object = None) -> object:
+		return super().get(self.key_to_hashable(key), default)
+
+	def items(self) -> ty.Iterable[ty.Tuple[object, object]]:
+		if not self._wrapped:
+			return super().items()
+		return [(_unwrap_key(k), v) for k, v in super().items()]
+
+	def keys(self) -> ty.Iterable[object]:
+		if not self._wrapped:
+			return super().keys()
+		return list(self)
+
+	def pop(self, key: object, *default: object) -> object:
+		if key not in self and default:
+			return default[0]
+		value = self[key]
+		del self[key]
+		return value
+
+	def popitem(self) -> ty.Tuple[object, object]:
+		key, value = super().popitem()
+		if type(key) is _HashableContainer:
+			self._wrapped -= 1
+		return _unwrap_key(key), value
+
+	def setdefault(self, key: object, default: object = None) -> object:
+		if key not in self:
+			self[key] = default
+		return self[key]
+
+	def update(self, other: object = (), **kwargs) -> None:
+		if isinstance(other, collections.abc.Mapping):
+			other = other.items()
+		for key, value in other:
+			self[key] = value
+		for key, value in kwargs.items():
+			self[key] = value
+
+	def __reduce__(self):
+		return (type(self), (list(self.items()),))
 
 	def __repr__(self) -> str:
-		inner_repr = ", ".join(repr(k.inner) + ": " + repr(v) for k, v in self.items())
+		inner_repr = ", ".join(repr(k) + ": " + repr(v) for k, v in self.items())
 		return f"new Map({{{inner_repr}}})"
 
 
 class JSNumberObj(float):
 	"""Type to represent JavaScript number/float “objects” (vs the primitive type)"""
+	__slots__ = ()
 
 	def __repr__(self) -> str:
-		return f"new Number({self!r})"
+		return f"new Number({float.__repr__(self)})"
 
 
 class JSRegExpObj:
+	__slots__ = ("expr", "flags")
+
 	expr:  str
 	flags: "RegExpFlag"
 
@@ -177,21 +283,84 @@ class JSRegExpObj:
 		return f"/{escaped_expr!s}/{self.flags!s}"
 
 
+class Float16Array(array.array):
+	"""Contents of a `Float16Array`, which neither `memoryview` nor `array`
+	can hold, as 32-bit floats (representing every 16-bit float exactly)
+
+	`format` and `tobytes` refer to the 16-bit little-endian data, as for
+	`memoryview`s of the other typed arrays.
+	"""
+	format = "e"
+
+	def __new__(cls, values: ty.Iterable[float] = ()):
+		return super().__new__(cls, "f", values)
+
+	@classmethod
+	def from_bytes(cls, data: ty.Union[bytes, memoryview]) -> "Float16Array":
+		"""Creates an array from 16-bit little-endian floats"""
+		return cls(struct.unpack(f"<{len(data) // 2}e", data))
+
+	def tobytes(self) -> bytes:
+		return struct.pack(f"<{len(self)}e", *self)
+
+	def __copy__(self) -> "Float16Array":
+		return type(self)(self)
+
+	def __deepcopy__(self, memo: ty.Dict[int, object]) -> "Float16Array":
+		return type(self)(self)
+
+	def __repr__(self) -> str:
+		return f"new Float16Array({self.tolist()!r})"
+
+
 class JSSavedFrame:
+	__slots__ = ()
+
 	def __init__(self):
 		raise NotImplementedError()
 
 
-class JSSetObj:
-	def __init__(self):
-		raise NotImplementedError()
+class JSSetObj(collections.abc.MutableSet):
+	"""JavaScript compatible Set object that allows arbitrary values (compared
+	the same way as `JSMapObj` keys) and preserves their insertion order"""
+	__slots__ = ("_items",)
+
+	_items: JSMapObj
+
+	def __init__(self, items: ty.Iterable[object] = ()):
+		self._items = JSMapObj()
+		for item in items:
+			self.add(item)
+
+	def __contains__(self, value: object) -> bool:
+		return value in self._items
+
+	def __iter__(self) -> ty.Iterator[object]:
+		return iter(self._items)
+
+	def __len__(self) -> int:
+		return len(self._items)
+
+	def add(self, value: object) -> None:
+		self._items[value] = None
+
+	def discard(self, value: object) -> None:
+		self._items.pop(value, None)
+
+	def __reduce__(self):
+		return (type(self), (list(self),))
+
+	def __repr__(self) -> str:
+		inner_repr = ", ".join(map(repr, self))
+		return f"new Set([{inner_repr}])"
 
 
 class JSStringObj(str):
 	"""Type to represent JavaScript string “objects” (vs the primitive type)"""
+	__slots__ = ()
 
 	def __repr__(self) -> str:
-		return f"new String({self!r})"
+		return f"new String({str.__repr__(self)})"
 
 
 
@@ -212,19 +381,19 @@ class DataType(enum.IntEnum):
 	REGEXP_OBJECT         = 0xFFFF0006
 	ARRAY_OBJECT          = 0xFFFF0007
 	OBJECT_OBJECT         = 0xFFFF0008
-	ARRAY_BUFFER_OBJECT   = 0xFFFF0009
+	ARRAY_BUFFER_OBJECT_V2 = 0xFFFF0009  # Length stored in pair data
 	BOOLEAN_OBJECT        = 0xFFFF000A
 	STRING_OBJECT         = 0xFFFF000B
 	NUMBER_OBJECT         = 0xFFFF000C
 	BACK_REFERENCE_OBJECT = 0xFFFF000D
 	#DO_NOT_USE_1
 	#DO_NOT_USE_2
-	TYPED_ARRAY_OBJECT    = 0xFFFF0010
+	TYPED_ARRAY_OBJECT_V2 = 0xFFFF0010  # Element count stored in pair data
 	MAP_OBJECT            = 0xFFFF0011
 	SET_OBJECT            = 0xFFFF0012
 	END_OF_KEYS           = 0xFFFF0013
 	#DO_NOT_USE_3
-	DATA_VIEW_OBJECT      = 0xFFFF0015
+	DATA_VIEW_OBJECT_V2   = 0xFFFF0015  # Byte length stored in pair data
 	SAVED_FRAME_OBJECT    = 0xFFFF0016  # ?
 
 	# Principals ?
@@ -241,6 +410,13 @@ class DataType(enum.IntEnum):
 	BIGINT        = 0xFFFF001D
 	BIGINT_OBJECT = 0xFFFF001E
 
+	# Binary data with 64-bit lengths
+	ARRAY_BUFFER_OBJECT           = 0xFFFF001F
+	TYPED_ARRAY_OBJECT            = 0xFFFF0020
+	DATA_VIEW_OBJECT              = 0xFFFF0021
+	ERROR_OBJECT                  = 0xFFFF0022
+	RESIZABLE_ARRAY_BUFFER_OBJECT = 0xFFFF0023
+
 	# Older typed arrays
 	TYPED_ARRAY_V1_MIN           = 0xFFFF0100
 	TYPED_ARRAY_V1_INT8          = TYPED_ARRAY_V1_MIN + 0
@@ -261,6 +437,39 @@ class DataType(enum.IntEnum):
 	TRANSFER_MAP_STORED_ARRAY_BUFFER = 0xFFFF0203
 
 
+class ArrayType(enum.IntEnum):
+	"""Element type of a TypedArray (`js::Scalar::Type`)"""
+	INT8          = 0
+	UINT8         = 1
+	INT16         = 2
+	UINT16        = 3
+	INT32         = 4
+	UINT32        = 5
+	FLOAT32       = 6
+	FLOAT64       = 7
+	UINT8_CLAMPED = 8
+	BIGINT64      = 9
+	BIGUINT64     = 10
+	FLOAT16       = 11
+
+
+# `struct`/`memoryview` format characters of the TypedArray element types
+ARRAY_TYPE_FORMATS: ty.Dict[ArrayType, str] = {
+	ArrayType.INT8:          "b",
+	ArrayType.UINT8:         "B",
+	ArrayType.INT16:         "h",
+	ArrayType.UINT16:        "H",
+	ArrayType.INT32:         "i",
+	ArrayType.UINT32:        "I",
+	ArrayType.FLOAT32:       "f",
+	ArrayType.FLOAT64:       "d",
+	ArrayType.UINT8_CLAMPED: "B",
+	ArrayType.BIGINT64:      "q",
+	ArrayType.BIGUINT64:     "Q",
+	ArrayType.FLOAT16:       "e",
+}
+
+
 class RegExpFlag(enum.IntFlag):
 	IGNORE_CASE = 0b00001
 	GLOBAL      = 0b00010
@@ -289,61 +498,134 @@ class Scope(enum.IntEnum):
 
 
 class _Input:
-	stream: io.BufferedReader
+	"""Cursor over the in-memory serialized data
+
+	All reads happen directly on the underlying buffer, so that binary data
+	can be handed out as `memoryview` slices of it without copying."""
+	__slots__ = ("buffer", "pos")
+
+	buffer: memoryview
+	pos:    int
 
-	def __init__(self, stream: io.BufferedReader):
-		self.stream = stream
+	def __init__(self, buffer: ty.Union[bytes, bytearray, memoryview]):
+		self.buffer = memoryview(buffer).cast("B")
+		self.pos    = 0
 
 	def peek(self) -> int:
 		try:
-			return struct.unpack_from("<q", self.stream.peek(8))[0]
+			return _UINT64.unpack_from(self.buffer, self.pos)[0]
 		except struct.error:
 			raise EOFError() from None
 
 	def peek_pair(self) -> (int, int):
 		v = self.peek()
-		return ((v >> 32) & 0xFFFFFFFF, (v >> 0) & 0xFFFFFFFF)
+		return (v >> 32, v & 0xFFFFFFFF)
 
 	def drop_padding(self, read_length):
-		length = 8 - ((read_length - 1) % 8) - 1
-		result = self.stream.read(length)
-		if len(result) < length:
+		self.pos += -read_length % 8
+		if self.pos > len(self.buffer):
 			raise EOFError()
 
 	def read(self, fmt="q"):
 		try:
-			return struct.unpack("<" + fmt, self.stream.read(8))[0]
+			result = struct.unpack_from("<" + fmt, self.buffer, self.pos)[0]
 		except struct.error:
 			raise EOFError() from None
+		self.pos += 8
+		return result
 
-	def read_bytes(self, length: int) -> bytes:
-		result = self.stream.read(length)
-		if len(result) < length:
+	def read_view(self, length: int) -> memoryview:
+		"""Returns the next `length` bytes (and skips the padding following
+		them) without copying"""
+		end = self.pos + length
+		if end > len(self.buffer):
 			raise EOFError()
+		result = self.buffer[self.pos:end]
+		self.pos = end
 		self.drop_padding(length)
 		return result
 
+	def read_bytes(self, length: int) -> bytes:
+		return self.read_view(length).tobytes()
+
 	def read_pair(self) -> (int, int):
-		v = self.read()
-		return ((v >> 32) & 0xFFFFFFFF, (v >> 0) & 0xFFFFFFFF)
+		try:
+			v = _UINT64.unpack_from(self.buffer, self.pos)[0]
+		except struct.error:
+			raise EOFError() from None
+		self.pos += 8
+		return (v >> 32, v & 0xFFFFFFFF)
 
 	def read_double(self) -> float:
 		return self.read("d")
 
+	def read_uint64(self) -> int:
+		return self.read("Q")
 
-class Reader:
-	all_objs: ty.List[ty.Union[list, dict]]
-	compat:   bool
-	input:    _Input
-	objs:     ty.List[ty.Union[list, dict]]
+
+class StringTable(dict):
+	"""Size-bounded table of interned strings
+
+	Records of the same shape repeat the same property names over and over
+	again, sharing a single table between all readers of a database ensures
+	that each distinct name is only kept in memory once. Once `max_size`
+	strings have been interned, no further strings are added.
+	"""
+	__slots__ = ("max_size", "max_value_length")
+
+	max_size:         int
+	max_value_length: int
+
+	def __init__(self, max_size: int = 65536, max_value_length: int = 0):
+		"""
+		:param max_size:         Maximum number of distinct strings to intern
+		:param max_value_length: Also intern string values (not only property
+		                         names) of up to this length
+		"""
+		super().__init__()
+		self.max_size         = max_size
+		self.max_value_length = max_value_length
+
+	def intern(self, value: str) -> str:
+		try:
+			return self[value]
+		except KeyError:
+			if len(self) < self.max_size:
+				self[value] = value
+			return value
 
 
-	def __init__(self, stream: io.BufferedReader):
+class Reader:
+	__slots__ = ("all_objs", "compat", "input", "objs", "plain_ints", "strings")
+
+	all_objs:   ty.List[ty.Union[list, dict]]
+	compat:     bool
+	input:      _Input
+	objs:       ty.List[ty.Union[list, dict]]
+	plain_ints: bool
+	strings:    StringTable
+
+
+	def __init__(self, stream: ty.Union[io.BufferedReader, bytes, bytearray, memoryview], *,
+	             plain_ints: bool = False, strings: ty.Optional[StringTable] = None):
+		"""
+		:param stream:     Serialized data, either as stream or as buffer (binary
+		                   data is returned as `memoryview` slices of this buffer)
+		:param plain_ints: Return JavaScript Int32 values as plain `int`s rather
+		                   than `JSInt32` instances (saving an allocation per
+		                   value in number-heavy data)
+		:param strings:    Table of interned strings to share with other readers
+		                   (a private table is used if not given)
+		"""
+		if not isinstance(stream, (bytes, bytearray, memoryview)):
+			stream = stream.read()
 		self.input = _Input(stream)
 
-		self.all_objs = []
-		self.compat   = False
-		self.objs     = []
+		self.all_objs   = []
+		self.compat     = False
+		self.objs       = []
+		self.plain_ints = plain_ints
+		self.strings    = strings if strings is not None else StringTable()
 
 
 	def read(self):
@@ -393,10 +675,15 @@ class Reader:
 				self.objs.pop()
 				continue
 
+			# Deduplicate property names of plain objects
+			if type(key) is str and type(obj) is dict:
+				key = self.strings.intern(key)
+
 			# Set object: the values between obj header (from startRead()) and
 			# DataType.END_OF_KEYS are interpreted as values to add to the set.
 			if isinstance(obj, JSSetObj):
 				obj.add(key)
+				continue
 
 			if isinstance(obj, JSSavedFrame):
 				raise NotImplementedError()  #XXX: TODO
@@ -463,7 +750,11 @@ class Reader:
 	def read_bigint(self, info: int) -> JSBigInt:
 		length   = info & 0x7FFFFFFF
 		negative = bool(info & 0x80000000)
-		raise NotImplementedError()
+
+		# Digits are stored as 64-bit words, least significant word first, so
+		# the entire block forms a single little-endian number
+		value = int.from_bytes(self.input.read_view(length * 8), "little")
+		return JSBigInt(-value if negative else value)
 
 
 	def read_string(self, info: int) -> str:
@@ -471,37 +762,107 @@ class Reader:
 		latin1 = bool(info & 0x80000000)
 
 		if latin1:
-			return self.input.read_bytes(length).decode("latin-1")
+			return str(self.input.read_view(length), "latin-1")
 		else:
-			return self.input.read_bytes(length * 2).decode("utf-16le")
+			return str(self.input.read_view(length * 2), "utf-16le")
+
+	def read_array_buffer(self, tag: int, info: int) -> memoryview:
+		if tag == DataType.ARRAY_BUFFER_OBJECT_V2:
+			length = info
+		elif tag == DataType.RESIZABLE_ARRAY_BUFFER_OBJECT:
+			length = self.input.read_uint64()
+			self.input.read_uint64()  # Maximum length
+		else:
+			length = self.input.read_uint64()
+		return self.input.read_view(length)
 
-	def read_array_buffer(self, info: bytes) -> list: # by Kate
-		length = info & 0x7FFFFFFF
-		result = self.input.read_bytes(length=length)
-		return [str(result)]
-	
-	def read_typed_array(self, _type, info: bytes):  #XXX: TODO by Kate
-		length = info & 0x7FFFFFFF
-		array_type = _type | 0xFFFF0000
-		results = []
-		for x in range(length):
-			len2 = self.input.read()
-			len2 = len2 & 0x7FFFFFFF
-			result = ""
-			if len2 == 0:
-				break
-			if array_type == DataType.NULL:
-				result = (self.input.read_bytes(length=len2))
-			elif array_type == DataType.UNDEFINED:
-				result = (self.input.read_bytes(length=len2))
-			elif array_type == DataType.BOOLEAN:
-				result = (self.input.read_bytes(length=len2))
-			elif array_type == DataType.INT32:
-				result = (self.input.read_bytes(length=len2))
-			elif array_type == DataType.STRING:
-				result = (self.read_string(len2))
-			results.append(str(result))
-		return results
+	def read_shared_array_buffer(self, info: int) -> ty.NoReturn:
+		# Only a pointer into the memory of the writing process is serialized
+		raise ParseError("SharedArrayBuffer objects cannot be part of persistent data")
+
+	def read_shared_wasm_memory(self, info: int) -> ty.NoReturn:
+		raise ParseError("Shared WebAssembly.Memory objects cannot be part of persistent data")
+
+	def _view_as(self, view: memoryview, array_type: int) -> ty.Union[memoryview, array.array]:
+		try:
+			format = ARRAY_TYPE_FORMATS[ArrayType(array_type)]
+		except ValueError:
+			raise ParseError(f"Unsupported TypedArray element type: {array_type}") from None
+
+		if len(view) % struct.calcsize(format) != 0:
+			raise ParseError("TypedArray length must be a multiple of its element size")
+
+		if format == "e":
+			return Float16Array.from_bytes(view)
+		if sys.byteorder != "little" and format not in "bB":
+			# Native formats cannot express the little-endian wire format
+			result = array.array(format, view.tobytes())
+			result.byteswap()
+			return result
+		return view.cast(format)
+
+	def read_typed_array(self, tag: int, info: int) -> ty.Union[memoryview, array.array]:
+		if DataType.TYPED_ARRAY_V1_MIN <= tag <= DataType.TYPED_ARRAY_V1_MAX:
+			array_type = tag - DataType.TYPED_ARRAY_V1_MIN
+			length     = info
+		elif tag == DataType.TYPED_ARRAY_OBJECT_V2:
+			array_type = self.input.read_uint64()
+			length     = info
+		else:
+			array_type = info
+			length     = self.input.read_uint64()
+
+		try:
+			item_size = struct.calcsize(ARRAY_TYPE_FORMATS[ArrayType(array_type)])
+		except ValueError:
+			raise ParseError(f"Unsupported TypedArray element type: {array_type}") from None
+
+		# The typed array takes the back-reference slot before its buffer
+		placeholder = len(self.all_objs)
+		self.all_objs.append(None)
+
+		if DataType.TYPED_ARRAY_V1_MIN <= tag <= DataType.TYPED_ARRAY_V1_MAX:
+			# Version 1 stores the elements inline, without separate buffer
+			buffer, offset = self.input.read_view(length * item_size), 0
+		else:
+			buffer, offset = self._read_view_buffer()
+
+		view = buffer[offset:offset + length * item_size]
+		if len(view) < length * item_size:
+			raise ParseError("TypedArray extends beyond the end of its buffer")
+
+		result = self._view_as(view, array_type)
+		self.all_objs[placeholder] = result
+		return result
+
+	def read_data_view(self, tag: int, info: int) -> memoryview:
+		if tag == DataType.DATA_VIEW_OBJECT_V2:
+			length = info
+		else:
+			length = self.input.read_uint64()
+
+		# The data view takes the back-reference slot before its buffer
+		placeholder = len(self.all_objs)
+		self.all_objs.append(None)
+
+		buffer, offset = self._read_view_buffer()
+		result = buffer[offset:offset + length]
+		if len(result) < length:
+			raise ParseError("DataView extends beyond the end of its buffer")
+
+		self.all_objs[placeholder] = result
+		return result
+
+	def _read_view_buffer(self) -> (memoryview, int):
+		"""Reads the ArrayBuffer backing a TypedArray or DataView and the byte
+		offset of the view into it"""
+		add_obj, buffer = self.start_read()
+		if add_obj:
+			self.all_objs.append(buffer)
+		if not isinstance(buffer, memoryview):
+			raise ParseError("TypedArray or DataView must be backed by an ArrayBuffer")
+		offset = self.input.read_uint64()
+		return buffer.cast("B"), offset
 
 	def start_read(self):
 		tag, data = self.input.read_pair()
@@ -514,8 +875,8 @@ class Reader:
 
 		elif tag == DataType.INT32:
 			if data > 0x7FFFFFFF:
-				data -= 0x80000000
-			return False, JSInt32(data)
+				data -= 0x100000000
+			return False, data if self.plain_ints else JSInt32._from_wire(data)
 
 		elif tag == DataType.BOOLEAN:
 			return False, bool(data)
@@ -523,7 +884,10 @@ class Reader:
 			return True, JSBooleanObj(data)
 
 		elif tag == DataType.STRING:
-			return False, self.read_string(data)
+			value = self.read_string(data)
+			if len(value) <= self.strings.max_value_length:
+				value = self.strings.intern(value)
+			return False, value
 		elif tag == DataType.STRING_OBJECT:
 			return True, JSStringObj(self.read_string(data))
 
@@ -531,9 +895,9 @@ class Reader:
 			return True, JSNumberObj(self.input.read_double())
 
 		elif tag == DataType.BIGINT:
-			return False, self.read_bigint()
+			return False, self.read_bigint(data)
 		elif tag == DataType.BIGINT_OBJECT:
-			return True, JSBigIntObj(self.read_bigint())
+			return True, JSBigIntObj(self.read_bigint(data))
 
 		elif tag == DataType.DATE_OBJECT:
 			# These timestamps are always UTC
@@ -564,21 +928,23 @@ class Reader:
 			except IndexError:
 				raise ParseError("Object backreference to non-existing object") from None
 
-		elif tag == DataType.ARRAY_BUFFER_OBJECT:
-			return True, self.read_array_buffer(data)  #XXX: TODO
+		elif tag in (DataType.ARRAY_BUFFER_OBJECT_V2, DataType.ARRAY_BUFFER_OBJECT,
+		             DataType.RESIZABLE_ARRAY_BUFFER_OBJECT):
+			return True, self.read_array_buffer(tag, data)
 
 		elif tag == DataType.SHARED_ARRAY_BUFFER_OBJECT:
-			return True, self.read_shared_array_buffer(data)  #XXX: TODO
+			return True, self.read_shared_array_buffer(data)
 
 		elif tag == DataType.SHARED_WASM_MEMORY_OBJECT:
-			return True, self.read_shared_wasm_memory(data)  #XXX: TODO
+			return True, self.read_shared_wasm_memory(data)
 
-		elif tag == DataType.TYPED_ARRAY_OBJECT:
-			array_type = self.input.read()
-			return False, self.read_typed_array(array_type, data)  #XXX: TODO
+		elif tag in (DataType.TYPED_ARRAY_OBJECT_V2, DataType.TYPED_ARRAY_OBJECT):
+			# Adds itself to `all_objs`
+			return False, self.read_typed_array(tag, data)
 
-		elif tag == DataType.DATA_VIEW_OBJECT:
-			return False, self.read_data_view(data)  #XXX: TODO
+		elif tag in (DataType.DATA_VIEW_OBJECT_V2, DataType.DATA_VIEW_OBJECT):
+			# Adds itself to `all_objs`
+			return False, self.read_data_view(tag, data)
 
 		elif tag == DataType.MAP_OBJECT:
 			obj = JSMapObj()
@@ -597,10 +963,11 @@ class Reader:
 
 		elif tag < int(DataType.FLOAT_MAX):
 			# Reassemble double floating point value
-			return False, struct.unpack("=d", struct.pack("=q", (tag << 32) | data))[0]
+			return False, _DOUBLE.unpack(_UINT64.pack((tag << 32) | data))[0]
 
 		elif DataType.TYPED_ARRAY_V1_MIN <= tag <= DataType.TYPED_ARRAY_V1_MAX:
-			return False, self.read_typed_array(tag - DataType.TYPED_ARRAY_V1_MIN, data)
+			# Adds itself to `all_objs`
+			return False, self.read_typed_array(tag, data)
 
 		else:
 			raise ParseError(f"Unsupported type: 0x{tag:X}")
@@ -0,0 +1,169 @@
+"""Cached lookups in the metadata files of a Firefox profile.
+
+`prefs.js`, `containers.json` and `extensions.json` are each parsed when
+first needed and again only after their modification time or size changed,
+so long-running commands notice new extensions and containers while repeated
+lookups (such as one per site directory) stay cheap.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import pathlib
+import threading
+import typing as ty
+
+from . import USER_CONTEXT_WEB_EXT, read_user_contexts, read_user_prefs
+
+
+T = ty.TypeVar("T")
+
+#: Pref mapping extension IDs to the UUIDs used in their `moz-extension://` origins
+EXT_UUIDS_PREF = "extensions.webextensions.uuids"
+#: User context ID used for extension storage if `containers.json` lacks it
+#: (-1 as unsigned 32-bit value)
+DEFAULT_WEB_EXT_CONTEXT_ID = 4294967295
+
+EXT_ORIGIN_PREFIX = "moz-extension+++"
+USER_CONTEXT_SUFFIX = "^userContextId="
+
+
+class _CachedFile(ty.Generic[T]):
+	"""Result of parsing a file, parsed again once the file changed"""
+	__slots__ = ("path", "parse", "_stamp", "_value")
+
+	def __init__(self, path: pathlib.Path, parse: ty.Callable[[pathlib.Path], T]):
+		self.path   = path
+		self.parse  = parse
+		self._stamp: ty.Optional[ty.Tuple[int, int]] = None
+		self._value: ty.Optional[T] = None
+
+	def get(self) -> T:
+		try:
+			stat = os.stat(self.path)
+			stamp: ty.Optional[ty.Tuple[int, int]] = (stat.st_mtime_ns, stat.st_size)
+		except FileNotFoundError:
+			stamp = None
+		if self._value is None or stamp != self._stamp:
+			self._value = self.parse(self.path)
+			self._stamp = stamp
+		return self._value
+
+
+class _Extensions(ty.NamedTuple):
+	uuids:    ty.Dict[str, str]  # Extension ID → UUID
+	ext_ids:  ty.Dict[str, str]  # UUID → extension ID
+
+
+class _Contexts(ty.NamedTuple):
+	ids:   ty.Dict[str, int]  # Name → user context ID
+	names: ty.Dict[int, str]  # User context ID → name
+
+
+def _parse_prefs(path: pathlib.Path) -> _Extensions:
+	for name, value in read_user_prefs(path):
+		if name == EXT_UUIDS_PREF:
+			try:
+				uuids = json.loads(value)
+			except ValueError:
+				continue
+			return _Extensions(uuids, {uuid: ext_id for ext_id, uuid in uuids.items()})
+	return _Extensions({}, {})
+
+
+def _parse_contexts(path: pathlib.Path) -> _Contexts:
+	ids: ty.Dict[str, int] = {}
+	names: ty.Dict[int, str] = {}
+	# The first of several contexts with the same name or ID takes precedence
+	for ctx_id, ctx_name in read_user_contexts(path.parent):
+		ids.setdefault(ctx_name, ctx_id)
+		names.setdefault(ctx_id, ctx_name)
+	return _Contexts(ids, names)
+
+
+def _parse_ext_info(path: pathlib.Path) -> ty.List[ty.Tuple[str, str]]:
+	with open(path, "rb") as file:
+		ext_data = json.load(file)
+	assert ext_data.get("schemaVersion") in [36, 33]
+	return [(extension["id"], extension["defaultLocale"]["name"])
+	        for extension in ext_data.get("addons") or ()]
+
+
+class ProfileIndex:
+	"""Lookups of extension UUIDs, user contexts and storage directories of
+	the Firefox profile in `profile_dir`"""
+	profile_dir: pathlib.Path
+	storage_dir: pathlib.Path
+
+	def __init__(self, profile_dir: pathlib.Path):
+		self.profile_dir = profile_dir
+		self.storage_dir = profile_dir / "storage" / "permanent"
+		self._prefs      = _CachedFile(profile_dir / "prefs.js", _parse_prefs)
+		self._contexts   = _CachedFile(profile_dir / "containers.json", _parse_contexts)
+		self._ext_info   = _CachedFile(profile_dir / "extensions.json", _parse_ext_info)
+
+	def ext_uuid(self, ext_id: str) -> ty.Optional[str]:
+		"""Returns the internal UUID of the given extension, if installed"""
+		return self._prefs.get().uuids.get(ext_id)
+
+	def ext_id(self, ext_uuid: str) -> ty.Optional[str]:
+		"""Returns the ID of the extension with the given internal UUID"""
+		return self._prefs.get().ext_ids.get(ext_uuid)
+
+	def extensions(self) -> ty.List[ty.Tuple[str, str]]:
+		"""Returns the ID and name of each extension listed in `extensions.json`"""
+		return self._ext_info.get()
+
+	def context_id(self, name: str) -> int:
+		"""Returns the ID of the user context with the given name, raising
+		`KeyError` for unknown names"""
+		try:
+			return self._contexts.get().ids[name]
+		except KeyError:
+			if name == USER_CONTEXT_WEB_EXT:
+				return DEFAULT_WEB_EXT_CONTEXT_ID
+			raise
+
+	def context_name(self, ctx_id: int) -> str:
+		"""Returns the name of the user context with the given ID, raising
+		`KeyError` for unknown IDs"""
+		return self._contexts.get().names[ctx_id]
+
+	def extension_dir(self, ext_id: str, ctx_id: ty.Optional[int] = None) -> ty.Optional[pathlib.Path]:
+		"""Returns the storage directory of the given extension within the user
+		context `ctx_id` (that of extension storage if `None`), or `None` if
+		the extension is not installed"""
+		ext_uuid = self.ext_uuid(ext_id)
+		if ext_uuid is None:
+			return None
+		if ctx_id is None:
+			ctx_id = self.context_id(USER_CONTEXT_WEB_EXT)
+		origin_label = EXT_ORIGIN_PREFIX + ext_uuid
+		if ctx_id:
+			origin_label += f"{USER_CONTEXT_SUFFIX}{ctx_id}"
+		return self.storage_dir / origin_label
+
+	def extension_by_dir(self, path: pathlib.Path) -> ty.Optional[str]:
+		"""Returns the ID of the extension the given storage directory (or any
+		path below it) belongs to, if any"""
+		for part in reversed(path.parts):
+			if part.startswith(EXT_ORIGIN_PREFIX):
+				ext_uuid = part[len(EXT_ORIGIN_PREFIX):].split(USER_CONTEXT_SUFFIX, 1)[0]
+				return self.ext_id(ext_uuid)
+		return None
+
+
+_indexes: ty.Dict[pathlib.Path, ProfileIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(profile_dir: pathlib.Path) -> ProfileIndex:
+	"""Returns the index of the given profile shared by all callers"""
+	with _indexes_lock:
+		try:
+			return _indexes[profile_dir]
+		except KeyError:
+			index = _indexes[profile_dir] = ProfileIndex(profile_dir)
+			return index
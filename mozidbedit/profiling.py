@@ -0,0 +1,197 @@
+"""Run commands under `cProfile` or a low-overhead sampling profiler."""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+import os
+import pathlib
+import sys
+import threading
+import time
+import typing as ty
+
+
+PROFILERS = ("cprofile", "sample")
+
+#: Time between two samples taken by `SamplingProfiler`, in seconds
+SAMPLE_INTERVAL = 0.001
+
+_PACKAGE_DIR = str(pathlib.Path(__file__).parent)
+
+T = ty.TypeVar("T")
+FuncKey = ty.Tuple[str, int, str]  # (filename, first line, function name) as used by `pstats`
+
+
+def _is_own_func(func: FuncKey) -> bool:
+	return func[0].startswith(_PACKAGE_DIR)
+
+
+def _func_label(func: FuncKey) -> str:
+	filename, lineno, name = func
+	if filename.startswith(_PACKAGE_DIR):
+		filename = "mozidbedit" + filename[len(_PACKAGE_DIR):]
+	else:
+		filename = os.path.basename(filename)
+	return f"{name} ({filename}:{lineno})"
+
+
+class SamplingProfiler:
+	"""Periodically records the call stack of the thread that started it
+
+	The collected samples can be written as collapsed stacks (as consumed by
+	`flamegraph.pl` or speedscope) or as `pstats` file, where sample counts are
+	converted into (estimated) times.
+	"""
+	interval: float
+	elapsed:  float
+	samples:  ty.Counter[ty.Tuple[FuncKey, ...]]
+
+	def __init__(self, interval: float = SAMPLE_INTERVAL):
+		self.interval = interval
+		self.elapsed  = 0.0
+		self.samples  = collections.Counter()
+		self._stop    = threading.Event()
+		self._thread: ty.Optional[threading.Thread] = None
+		self._target  = 0
+		self._switch_interval = 0.0
+
+	def start(self) -> None:
+		self._target = threading.get_ident()
+		self._stop.clear()
+		# Without a short switch interval the sampler thread would mostly get to
+		# run when the profiled thread releases the GIL by itself (such as while
+		# waiting for SQLite), heavily biasing the samples towards those places
+		self._switch_interval = sys.getswitchinterval()
+		sys.setswitchinterval(min(self._switch_interval, self.interval / 10))
+		self.elapsed -= time.perf_counter()
+		self._thread = threading.Thread(target=self._run, name="mozidbedit-sampler", daemon=True)
+		self._thread.start()
+
+	def stop(self) -> None:
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+			sys.setswitchinterval(self._switch_interval)
+			self.elapsed += time.perf_counter()
+
+	def _run(self) -> None:
+		while not self._stop.wait(self.interval):
+			frame = sys._current_frames().get(self._target)
+			stack = []
+			while frame is not None:
+				code = frame.f_code
+				stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+				frame = frame.f_back
+			del frame
+			if stack:
+				stack.reverse()
+				self.samples[tuple(stack)] += 1
+
+	def filter(self, predicate: ty.Callable[[FuncKey], bool]) -> None:
+		"""Drops all stack frames not matching `predicate` (and samples left
+		without any frames)"""
+		samples: ty.Counter[ty.Tuple[FuncKey, ...]] = collections.Counter()
+		for stack, count in self.samples.items():
+			stack = tuple(filter(predicate, stack))
+			if stack:
+				samples[stack] += count
+		self.samples = samples
+
+	def write_collapsed(self, path: ty.Union[os.PathLike, str]) -> None:
+		with open(path, "w", encoding="utf-8") as file:
+			for stack, count in sorted(self.samples.items()):
+				file.write(";".join(map(_func_label, stack)) + f" {count}\n")
+
+	def create_stats(self) -> None:
+		"""Converts the samples into the `stats` dictionary format of `cProfile`,
+		making this object loadable by `pstats.Stats`"""
+		# {func: [primitive calls, calls, total time, cumulative time, {caller: […]}]}
+		# with the number of samples standing in for the number of calls
+		stats: ty.Dict[FuncKey, list] = {}
+		def entry(func: FuncKey) -> list:
+			try:
+				return stats[func]
+			except KeyError:
+				result = stats[func] = [0, 0, 0.0, 0.0, {}]
+				return result
+
+		# Samples are usually taken less often than requested
+		sample_count = sum(self.samples.values())
+		sample_time = self.elapsed / sample_count if sample_count else self.interval
+		for stack, count in self.samples.items():
+			duration = count * sample_time
+			for func in set(stack):
+				entry(func)[3] += duration
+			entry(stack[-1])[2] += duration
+			for caller, callee in set(zip(stack, stack[1:])):
+				callers = entry(callee)[4]
+				calls = callers.setdefault(caller, [0, 0, 0.0, 0.0])
+				calls[0] += count
+				calls[1] += count
+				calls[3] += duration
+				entry(callee)[0] += count
+				entry(callee)[1] += count
+
+		self.stats = {
+			func: (cc, nc, tt, ct, {caller: tuple(c) for caller, c in callers.items()})
+			for func, (cc, nc, tt, ct, callers) in stats.items()
+		}
+
+
+def run(
+		profiler: str,
+		func: ty.Callable[[], T],
+		output_prefix: ty.Union[os.PathLike, str],
+		*,
+		own_only: bool = False,
+		top: int = 20,
+) -> T:
+	"""Calls `func` under the given profiler and returns its result
+
+	Always writes `<output_prefix>.pstats`; the sampling profiler additionally
+	writes `<output_prefix>.collapsed` (`cProfile` does not record full call
+	stacks). If `own_only` is set, only functions of this package are kept.
+	The `top` functions by own time are printed to stderr.
+	"""
+	# Imported only here, as the command-line interface imports this module
+	# for `PROFILERS` on every start
+	import cProfile
+	import marshal
+	import pstats
+
+	output_prefix = os.fspath(output_prefix)
+	if profiler not in PROFILERS:
+		raise ValueError(f"Unknown profiler: {profiler}")
+
+	prof: ty.Union[cProfile.Profile, SamplingProfiler]
+	if profiler == "cprofile":
+		prof = cProfile.Profile()
+		prof.enable()
+	else:
+		prof = SamplingProfiler()
+		prof.start()
+	try:
+		return func()
+	finally:
+		if isinstance(prof, cProfile.Profile):
+			prof.disable()
+		else:
+			prof.stop()
+			if own_only:
+				prof.filter(_is_own_func)
+			prof.write_collapsed(output_prefix + ".collapsed")
+			print(f"Collapsed stacks written to: {output_prefix}.collapsed", file=sys.stderr)
+
+		prof.create_stats()
+		data = prof.stats
+		if own_only:
+			data = {key: value for key, value in data.items() if _is_own_func(key)}
+		with open(output_prefix + ".pstats", "wb") as file:
+			marshal.dump(data, file)
+		print(f"Profile written to: {output_prefix}.pstats", file=sys.stderr)
+
+		if top > 0:
+			stats = pstats.Stats(output_prefix + ".pstats", stream=sys.stderr)
+			stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
@@ -0,0 +1,131 @@
+"""Evaluate JMESPath expressions decoding only the records they refer to.
+
+The expression is analysed before evaluating it: As long as the database
+(the root object) is only accessed through the names of its keys, such as in
+`"settings".theme` or `{a: a, b: b.c}`, only the records with these keys are
+looked up and decoded (`keys(@)` and `length(@)` only list the keys of the
+database). Expressions using the database as a whole, for instance through
+`@` or `*`, are evaluated against the database itself, decoding records as
+they are accessed, which usually means all of them.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import typing as ty
+
+from . import mozidb
+
+
+# Nodes evaluating their first child against the current object and all
+# further children against its result (or the items of its result)
+_LEFT_ONLY = frozenset((
+	"subexpression", "index_expression", "projection", "value_projection",
+	"filter_projection", "pipe", "flatten", "key_val_pair",
+))
+# Nodes evaluating all of their children against the current object
+_ALL_CHILDREN = frozenset((
+	"multi_select_dict", "multi_select_list", "or_expression", "and_expression",
+	"not_expression", "comparator",
+))
+# Nodes not accessing the current object at all
+_CONSTANT = frozenset(("literal", "index", "slice", "expref"))
+# Functions that only need the keys when applied to the current object
+_KEYS_ONLY_FUNCTIONS = frozenset(("keys", "length"))
+
+_MISSING = object()
+
+
+class Plan(ty.NamedTuple):
+	"""Records needed to evaluate an expression
+
+	`keys` lists the keys of all records whose value is accessed, or is `None`
+	if the expression may access any record (`reason` telling why). If
+	`list_keys` is set, the expression also needs to know all existing keys.
+	"""
+	keys:      ty.Optional[ty.FrozenSet[str]]
+	list_keys: bool = False
+	reason:    ty.Optional[str] = None
+
+
+class _Unplannable(Exception):
+	pass
+
+
+def _fields(node: ty.Dict[str, ty.Any], flags: ty.Set[str]) -> ty.Set[str]:
+	"""Returns the names of the keys of the current object accessed by `node`,
+	adding `"list_keys"` to `flags` if all of its keys are needed too"""
+	node_type = node["type"]
+	children = node["children"]
+	if node_type == "field":
+		return {node["value"]}
+	elif node_type in _LEFT_ONLY:
+		return _fields(children[0], flags)
+	elif node_type in _ALL_CHILDREN:
+		return set().union(*(_fields(child, flags) for child in children))
+	elif node_type in _CONSTANT:
+		return set()
+	elif node_type == "function_expression":
+		names: ty.Set[str] = set()
+		for child in children:
+			if child["type"] == "current" and node["value"] in _KEYS_ONLY_FUNCTIONS:
+				flags.add("list_keys")
+			else:
+				names |= _fields(child, flags)
+		return names
+	elif node_type in ("current", "identity"):
+		raise _Unplannable("the expression uses the database as a whole")
+	raise _Unplannable(f"unsupported expression type `{node_type}`")
+
+
+def plan(parsed: ty.Dict[str, ty.Any]) -> Plan:
+	"""Determines the records needed by the parsed JMESPath expression (the
+	`parsed` attribute of a compiled expression)"""
+	flags: ty.Set[str] = set()
+	try:
+		names = _fields(parsed, flags)
+	except _Unplannable as exc:
+		return Plan(None, reason=str(exc))
+	return Plan(frozenset(names), "list_keys" in flags)
+
+
+def search(conn: mozidb.IndexedDB, expression: str, *,
+           explain: ty.Optional[ty.Callable[[str], None]] = None) -> object:
+	"""Evaluates the JMESPath `expression` against the database of `conn`
+
+	If `explain` is given, it is called with a description of the plan and of
+	the records decoded.
+	"""
+	from . import IDBObjectWrapper, _import_jmespath
+	jmespath = _import_jmespath()
+
+	compiled = jmespath.compile(expression)
+	query_plan = plan(compiled.parsed)
+	if query_plan.keys is None:
+		if explain is not None:
+			explain(f"Query plan: reading records as accessed, {query_plan.reason}")
+		database = IDBObjectWrapper(conn)
+		result = compiled.search(database)
+		if explain is not None:
+			if result is database:
+				explain("Query plan: the result is the whole database, decoding all records for output")
+			elif database.accessed is None:
+				explain(f"Query plan: decoded all {conn.count_objects()} record(s)")
+			else:
+				explain(f"Query plan: decoded {len(database.accessed)} record(s): "
+				        f"{', '.join(map(repr, sorted(database.accessed, key=repr))) or '-'}")
+		return result
+
+	names = sorted(query_plan.keys)
+	values = conn.read_many(names, default=_MISSING)
+	found = {name: value for name, value in zip(names, values) if value is not _MISSING}
+
+	if explain is not None:
+		explain(f"Query plan: decoded {len(found)} record(s) by key: {', '.join(map(repr, found)) or '-'}")
+		if len(found) < len(names):
+			explain(f"Query plan: keys not found: {', '.join(repr(name) for name in names if name not in found)}")
+		if query_plan.list_keys:
+			explain("Query plan: listing keys without decoding their records")
+	if query_plan.list_keys:
+		return compiled.search(IDBObjectWrapper(conn, found))
+	return compiled.search(found)
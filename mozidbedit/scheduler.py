@@ -0,0 +1,103 @@
+"""Decode stored values in parallel within a memory budget.
+
+The length header at the start of every Snappy stream tells how large a value
+will be once decompressed before decoding it, so rows are only handed to the
+decoding threads while the decompressed sizes of all values being decoded
+stay within a byte budget, no matter which rows happen to come together.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+import concurrent.futures
+import os
+import pathlib
+import typing as ty
+
+from . import ccl_simplesnappy
+
+
+R = ty.TypeVar("R")
+
+#: Default limit of the decompressed size of values decoded at the same time
+DEFAULT_MAX_BYTES = 256 << 20
+
+
+def uncompressed_size(data: ty.Union[bytes, memoryview], file_ids: ty.Optional[str],
+                      files_dir: ty.Union[os.PathLike, str]) -> int:
+	"""Returns the size of a stored value once decompressed, read from the
+	length headers of its Snappy data without decompressing it"""
+	if file_ids is not None:
+		for file_id in file_ids.split():
+			if file_id.startswith(".") and file_id[1:].isnumeric():
+				try:
+					with open(pathlib.Path(files_dir) / file_id[1:], "rb") as file:
+						return ccl_simplesnappy.framed_uncompressed_length(file)
+				except (OSError, ValueError):
+					return 0  # Left for decoding to report
+	try:
+		return ccl_simplesnappy.uncompressed_length(data[:10])
+	except ValueError:
+		return len(data)
+
+
+class DecodeScheduler:
+	"""Runs decoding functions on `executor` while the decompressed size of
+	the values being decoded, or decoded but not yet consumed, stays within
+	`max_bytes`
+
+	Values larger than `max_bytes` on their own are decoded on the calling
+	thread after all others have been consumed, so they are the only value
+	being held. At most `max_pending` values (four per worker thread of the
+	executor if `None`) are decoded ahead of the consumer.
+	"""
+	max_bytes:   int
+	max_pending: int
+	peak_bytes:  int  # Largest total size of values decoded at the same time
+	oversized:   int  # Number of values decoded on the calling thread
+
+	def __init__(self, executor: concurrent.futures.Executor,
+	             max_bytes: int = DEFAULT_MAX_BYTES, *, max_pending: ty.Optional[int] = None):
+		if max_pending is None:
+			max_pending = 4 * (getattr(executor, "_max_workers", None) or os.cpu_count() or 1)
+		self.executor    = executor
+		self.max_bytes   = max_bytes
+		self.max_pending = max_pending
+		self.peak_bytes  = 0
+		self.oversized   = 0
+
+	def map(self, func: ty.Callable[..., R], rows: ty.Iterable[ty.Sequence[object]],
+	        sizes: ty.Iterable[int]) -> ty.Iterator[R]:
+		"""Yields `func(*row)` for each of `rows` in order, admitting each row
+		by its decompressed size as given by `sizes`"""
+		pending: ty.Deque[ty.Tuple["concurrent.futures.Future[R]", int]] = collections.deque()
+		in_use = 0
+
+		def finish_oldest() -> R:
+			nonlocal in_use
+			future, future_size = pending.popleft()
+			in_use -= future_size
+			return future.result()
+
+		try:
+			for row, size in zip(rows, sizes):
+				if size > self.max_bytes:
+					while pending:
+						yield finish_oldest()
+					self.oversized += 1
+					self.peak_bytes = max(self.peak_bytes, size)
+					yield func(*row)
+					continue
+
+				while pending and (in_use + size > self.max_bytes or len(pending) >= self.max_pending):
+					yield finish_oldest()
+				pending.append((self.executor.submit(func, *row), size))
+				in_use += size
+				self.peak_bytes = max(self.peak_bytes, in_use)
+
+			while pending:
+				yield finish_oldest()
+		finally:
+			for future, _ in pending:
+				future.cancel()
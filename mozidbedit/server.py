@@ -0,0 +1,363 @@
+"""JSON-RPC server answering queries from a pool of open IndexedDB connections.
+
+Requests and responses are JSON-RPC 2.0 objects, one per line, read from
+stdin/written to stdout or exchanged over a Unix domain socket. Every method
+takes a `db` parameter selecting the database using the same options as the
+command line (`dbpath`, `extension`, `site`, `sdb` and `userctx`):
+
+  list(db)                  → [key, …]
+  get(db, key)              → value
+  get_many(db, keys, default=<error>)
+                            → [value, …] (in the order of `keys`)
+  range(db, lower=null, upper=null, lower_open=false, upper_open=false,
+        limit=-1)           → [[key, value], …]
+  query(db, expression)     → result of the JMESPath expression
+
+Records that cannot be decoded are reported with error code `DECODE_ERROR`.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+import contextlib
+import errno
+import json
+import os
+import pathlib
+import socketserver
+import stat
+import sys
+import threading
+import time
+import typing as ty
+
+from . import mozidb
+
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR      = -32700
+INVALID_REQUEST  = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS   = -32602
+INTERNAL_ERROR   = -32603
+# Application-defined error codes
+DB_NOT_FOUND  = 1
+KEY_NOT_FOUND = 2
+DECODE_ERROR  = 3
+
+
+class RPCError(Exception):
+	code: int
+
+	def __init__(self, code: int, message: str):
+		super().__init__(message)
+		self.code = code
+
+
+class _PoolEntry:
+	__slots__ = ("conn", "lock", "last_used", "users")
+
+	def __init__(self, conn: mozidb.IndexedDB):
+		self.conn      = conn
+		self.lock      = threading.Lock()
+		self.last_used = time.monotonic()
+		self.users     = 0  # Callers given the connection (changed with the pool's lock held)
+
+
+class ConnectionPool:
+	"""Keeps read-only database connections open for reuse
+
+	Connections not used for `idle_timeout` seconds are closed by `evict_idle`,
+	and the least recently used one is closed whenever more than `max_size`
+	would be open. Connections in use are never closed, so more than
+	`max_size` may be open while all of them are.
+	"""
+	idle_timeout: float
+	max_size:     int
+
+	def __init__(self, *, idle_timeout: float = 300.0, max_size: int = 16):
+		self.idle_timeout = idle_timeout
+		self.max_size     = max_size
+		self._entries: ty.OrderedDict[pathlib.Path, _PoolEntry] = collections.OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	@contextlib.contextmanager
+	def connection(self, db_path: pathlib.Path) -> ty.Iterator[mozidb.IndexedDB]:
+		"""Provides exclusive use of the (possibly newly opened) connection to
+		the given database"""
+		with self._lock:
+			entry = self._entries.get(db_path)
+			if entry is None:
+				# Values are converted to JSON, so there is no need for `JSInt32` wrappers
+				conn = mozidb.IndexedDB(db_path, plain_ints=True, readonly=True,
+				                        check_same_thread=False)
+				entry = self._entries[db_path] = _PoolEntry(conn)
+			self._entries.move_to_end(db_path)
+			# Counted before evicting, so the entry is never closed while handed out
+			entry.users += 1
+			self._evict(len(self._entries) - self.max_size)
+
+		try:
+			with entry.lock:
+				try:
+					yield entry.conn
+				finally:
+					entry.last_used = time.monotonic()
+		finally:
+			with self._lock:
+				entry.users -= 1
+
+	def _evict(self, count: int, idle_before: ty.Optional[float] = None) -> None:
+		for db_path, entry in list(self._entries.items()):
+			if count <= 0 and (idle_before is None or entry.last_used >= idle_before):
+				continue
+			if entry.users:
+				continue  # Currently in use or about to be
+			entry.conn.close()
+			del self._entries[db_path]
+			count -= 1
+
+	def evict_idle(self) -> None:
+		with self._lock:
+			self._evict(0, time.monotonic() - self.idle_timeout)
+
+	def close(self) -> None:
+		with self._lock:
+			self._evict(len(self._entries))
+
+
+class Server:
+	"""Dispatches JSON-RPC requests to the database connections of a pool
+
+	Database paths resolved from profile-relative selectors are cached, so the
+	profile metadata is only parsed once per database.
+	"""
+	pool: ConnectionPool
+
+	def __init__(self, pool: ConnectionPool,
+	             profile: ty.Optional[ty.Tuple[pathlib.Path, pathlib.Path]] = None):
+		self.pool     = pool
+		self._profile = profile
+		self._paths: ty.Dict[ty.Tuple[object, ...], pathlib.Path] = {}
+		self._methods: ty.Dict[str, ty.Callable[[mozidb.IndexedDB, ty.Dict[str, object]], object]] = {
+			"list":     self._list,
+			"get":      self._get,
+			"get_many": self._get_many,
+			"range":    self._range,
+			"query":    self._query,
+		}
+
+	def resolve(self, selector: object) -> pathlib.Path:
+		if not isinstance(selector, dict):
+			raise RPCError(INVALID_PARAMS, "Parameter `db` must be an object")
+
+		options = {name: selector.get(name) for name in ("extension", "site", "sdb", "userctx", "dbpath")}
+		for name, value in options.items():
+			if value is not None and not isinstance(value, str):
+				raise RPCError(INVALID_PARAMS, f"Option `{name}` of parameter `db` must be a string")
+		cache_key = tuple(options.values())
+		db_path = self._paths.get(cache_key)
+		if db_path is not None and db_path.is_file():
+			return db_path
+
+		if options["dbpath"] is not None:
+			options["dbpath"] = pathlib.Path(options["dbpath"])
+		if options["dbpath"] and not options["extension"] and not options["site"]:
+			db_path = options["dbpath"]
+			if not db_path.is_file():
+				raise RPCError(DB_NOT_FOUND, "Invalid `dbpath` given")
+		else:
+			if self._profile is None:
+				raise RPCError(DB_NOT_FOUND, "No profile directory known, pass --profile")
+
+			from . import find_db_path
+			try:
+				db_path = find_db_path(*self._profile, **options)
+			except KeyError:
+				raise RPCError(DB_NOT_FOUND, f"Unknown extension: {options['extension']}") from None
+			except ValueError as exc:
+				raise RPCError(DB_NOT_FOUND, str(exc)) from None
+		self._paths[cache_key] = db_path
+		return db_path
+
+	def _list(self, conn: mozidb.IndexedDB, params: ty.Dict[str, object]) -> object:
+		return conn.list_objects()
+
+	def _get(self, conn: mozidb.IndexedDB, params: ty.Dict[str, object]) -> object:
+		if "key" not in params:
+			raise RPCError(INVALID_PARAMS, "Missing parameter `key`")
+		_check_key("key", params["key"])
+		try:
+			return conn.read_object(params["key"])
+		except KeyError:
+			raise RPCError(KEY_NOT_FOUND, f"No such key: {params['key']!r}") from None
+
+	def _get_many(self, conn: mozidb.IndexedDB, params: ty.Dict[str, object]) -> object:
+		keys = params.get("keys")
+		if not isinstance(keys, list):
+			raise RPCError(INVALID_PARAMS, "Parameter `keys` must be an array")
+		for key in keys:
+			_check_key("keys", key)
+		if "default" in params:
+			return conn.read_many(keys, default=params["default"])
+		try:
+			return conn.read_many(keys)
+		except KeyError as exc:
+			raise RPCError(KEY_NOT_FOUND, f"No such keys: {exc.args[0]!r}") from None
+
+	def _range(self, conn: mozidb.IndexedDB, params: ty.Dict[str, object]) -> object:
+		limit = params.get("limit", -1)
+		if not isinstance(limit, int) or isinstance(limit, bool):
+			raise RPCError(INVALID_PARAMS, "Parameter `limit` must be an integer")
+		for name in ("lower", "upper"):
+			if params.get(name) is not None:
+				_check_key(name, params[name])
+		return [list(item) for item in conn.iter_range(
+			params.get("lower"), params.get("upper"),
+			lower_open=bool(params.get("lower_open")), upper_open=bool(params.get("upper_open")),
+			limit=limit,
+		)]
+
+	def _query(self, conn: mozidb.IndexedDB, params: ty.Dict[str, object]) -> object:
+		from . import _import_jmespath, query
+		expression = params.get("expression")
+		if not isinstance(expression, str):
+			raise RPCError(INVALID_PARAMS, "Parameter `expression` must be a string")
+		jmespath = _import_jmespath()
+		try:
+			return query.search(conn, expression)
+		except jmespath.exceptions.JMESPathError as exc:
+			raise RPCError(INVALID_PARAMS, f"Invalid expression: {exc}") from None
+
+	def call(self, method: object, params: object) -> object:
+		"""Runs a single method call and returns its JSON-compatible result"""
+		from . import to_json
+		handler = self._methods.get(method) if isinstance(method, str) else None
+		if handler is None:
+			raise RPCError(METHOD_NOT_FOUND, f"Unknown method: {method!r}")
+		if not isinstance(params, dict):
+			raise RPCError(INVALID_PARAMS, "Parameters must be given by name")
+
+		db_path = self.resolve(params.get("db"))
+		self.pool.evict_idle()
+		with self.pool.connection(db_path) as conn:
+			try:
+				return to_json(handler(conn, params))
+			except mozidb.DECODE_ERRORS as exc:
+				raise RPCError(DECODE_ERROR, f"Cannot decode record: {type(exc).__name__}: {exc}") from None
+
+	def handle(self, request: object) -> ty.Optional[ty.Dict[str, object]]:
+		"""Processes a decoded JSON-RPC request object and returns its response
+		(or `None` for notifications)"""
+		request_id = None
+		try:
+			if not isinstance(request, dict) or request.get("jsonrpc") != "2.0":
+				raise RPCError(INVALID_REQUEST, "Not a JSON-RPC 2.0 request")
+			request_id = request.get("id")
+			result = self.call(request.get("method"), request.get("params", {}))
+		except RPCError as exc:
+			response = {"jsonrpc": "2.0", "id": request_id,
+			            "error": {"code": exc.code, "message": str(exc)}}
+		except Exception as exc:
+			response = {"jsonrpc": "2.0", "id": request_id,
+			            "error": {"code": INTERNAL_ERROR, "message": f"{type(exc).__name__}: {exc}"}}
+		else:
+			response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+		if isinstance(request, dict) and request.get("jsonrpc") == "2.0" and "id" not in request:
+			return None  # Notifications are never answered
+		return response
+
+	def handle_line(self, line: ty.Union[str, bytes]) -> ty.Optional[str]:
+		"""Processes one line of JSON input (a request or batch of requests) and
+		returns the line of JSON output, if any"""
+		try:
+			request = json.loads(line)
+		except ValueError as exc:
+			response: object = {"jsonrpc": "2.0", "id": None,
+			                    "error": {"code": PARSE_ERROR, "message": str(exc)}}
+		else:
+			if isinstance(request, list) and request:
+				response = [r for r in map(self.handle, request) if r is not None] or None
+			else:
+				response = self.handle(request)
+		if response is None:
+			return None
+		return json.dumps(response, ensure_ascii=False) + "\n"
+
+
+def _check_key(name: str, value: object) -> None:
+	"""Raises `RPCError` unless `value` (given as parameter `name`) is a valid
+	IndexedDB key"""
+	try:
+		mozidb.KeyCodec.encode(value)
+	except (TypeError, ValueError) as exc:
+		raise RPCError(INVALID_PARAMS, f"Parameter `{name}` is not a valid key: {exc}") from None
+
+
+def serve_stdio(server: Server, stdin: ty.TextIO = sys.stdin, stdout: ty.TextIO = sys.stdout) -> None:
+	for line in stdin:
+		if not line.strip():
+			continue
+		response = server.handle_line(line)
+		if response is not None:
+			stdout.write(response)
+			stdout.flush()
+
+
+class _StreamHandler(socketserver.StreamRequestHandler):
+	server: "_UnixServer"
+
+	def handle(self) -> None:
+		for line in self.rfile:
+			if not line.strip():
+				continue
+			response = self.server.rpc.handle_line(line)
+			if response is not None:
+				self.wfile.write(response.encode("utf-8"))
+				self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+	daemon_threads = True
+
+	def __init__(self, path: str, rpc: Server):
+		self.rpc = rpc
+		super().__init__(path, _StreamHandler)
+
+	def service_actions(self) -> None:
+		self.rpc.pool.evict_idle()
+
+
+def serve_unix(server: Server, path: ty.Union[os.PathLike, str]) -> None:
+	"""Answers requests of any number of clients connecting to the Unix domain
+	socket at `path` until interrupted
+
+	A socket left behind at `path` is replaced, while any other file there
+	raises `FileExistsError`.
+	"""
+	path = os.fspath(path)
+	try:
+		if not stat.S_ISSOCK(os.lstat(path).st_mode):
+			raise FileExistsError(errno.EEXIST, "File exists and is not a socket", path)
+		os.unlink(path)
+	except FileNotFoundError:
+		pass
+
+	# Only allow the current user to connect
+	umask = os.umask(0o177)
+	try:
+		unix_server = _UnixServer(path, server)
+	finally:
+		os.umask(umask)
+
+	try:
+		with unix_server:
+			unix_server.serve_forever(poll_interval=1.0)
+	finally:
+		with contextlib.suppress(FileNotFoundError):
+			os.unlink(path)
@@ -0,0 +1,134 @@
+"""Consistent copies of databases that may be in use by Firefox.
+
+While a read transaction is open on a database, SQLite neither lets writers
+restart its write-ahead log nor (in rollback journal mode) commit, so copying
+the database file and then its write-ahead log during one yields a consistent
+state of the database: Frames appended to the log in the meantime are either
+complete transactions or discarded by SQLite when reading the copy. Files
+are cloned (reflinked) or copied within the kernel where supported.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import contextlib
+import os
+import pathlib
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import typing as ty
+
+from .stats import StageStats, Stats
+
+
+FICLONE = 0x40049409  # From <linux/fs.h>
+
+#: Directory holding snapshots unless another one is given (memory-backed)
+DEFAULT_DIR = pathlib.Path("/dev/shm")
+
+
+def _copy_file(source: pathlib.Path, target: pathlib.Path) -> int:
+	"""Copies `source` to `target`, returning the number of bytes copied"""
+	with open(source, "rb") as source_file, open(target, "wb") as target_file:
+		if sys.platform == "linux":
+			import fcntl
+			try:
+				fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+				return os.fstat(target_file.fileno()).st_size
+			except OSError:
+				pass  # Not supported by (or across) the file systems
+
+		copied = 0
+		if hasattr(os, "copy_file_range"):
+			try:
+				while True:
+					size = os.copy_file_range(source_file.fileno(), target_file.fileno(), 1 << 30)
+					if size == 0:
+						return copied
+					copied += size
+			except OSError:
+				if copied:
+					raise
+		shutil.copyfileobj(source_file, target_file, 1 << 20)
+		return target_file.tell()
+
+
+@contextlib.contextmanager
+def _read_transaction(db_path: pathlib.Path) -> ty.Iterator[None]:
+	"""Keeps a read transaction open on the given database"""
+	uri = db_path.absolute().as_uri() + "?mode=ro"
+	with contextlib.closing(sqlite3.connect(uri, uri=True, isolation_level=None)) as conn:
+		conn.execute("BEGIN")
+		conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+		yield
+
+
+class Snapshot:
+	"""Copy of a database, its write-ahead log and its `.files` directory
+	within a new temporary directory, which is removed again by `close`
+
+	The copy is created in `directory` (`DEFAULT_DIR` if it exists and `None`
+	is given). Changes in the write-ahead log are applied to the copy, so it
+	can also be read by `sqlitefile`.
+	"""
+	path:         pathlib.Path
+	bytes_copied: int
+	time_ns:      int
+
+	def __init__(self, db_path: ty.Union[os.PathLike, str], *,
+	             directory: ty.Optional[pathlib.Path] = None,
+	             stats: ty.Optional[Stats] = None):
+		db_path = pathlib.Path(db_path)
+		if directory is None and DEFAULT_DIR.is_dir() and os.access(DEFAULT_DIR, os.W_OK):
+			directory = DEFAULT_DIR
+		self._tmpdir = tempfile.TemporaryDirectory(prefix="moz-idb-edit-", dir=directory)
+		self.path = pathlib.Path(self._tmpdir.name) / db_path.name
+
+		stage = StageStats() if stats is None else stats.stage("snapshot.copy", os.fsdecode(db_path))
+		self.bytes_copied = 0
+		start = time.perf_counter_ns()
+		try:
+			with stage:
+				with _read_transaction(db_path):
+					self.bytes_copied += self._copy(db_path, self.path)
+					wal_path = pathlib.Path(os.fspath(db_path) + "-wal")
+					if wal_path.exists():
+						self.bytes_copied += self._copy(wal_path, pathlib.Path(os.fspath(self.path) + "-wal"))
+
+					# Stored files are never modified, but may be deleted once
+					# no record refers to them anymore
+					files_dir = db_path.with_name(db_path.name.removesuffix(".sqlite") + ".files")
+					if files_dir.is_dir():
+						target_dir = self.path.with_name(files_dir.name)
+						target_dir.mkdir()
+						for file_path in files_dir.iterdir():
+							if file_path.is_file():
+								self.bytes_copied += self._copy(file_path, target_dir / file_path.name)
+
+				with contextlib.closing(sqlite3.connect(self.path)) as conn:
+					conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+		except BaseException:
+			self.close()
+			raise
+		self.time_ns = time.perf_counter_ns() - start
+		stage.bytes_in  += self.bytes_copied
+		stage.bytes_out += self.bytes_copied
+
+	@staticmethod
+	def _copy(source: pathlib.Path, target: pathlib.Path) -> int:
+		try:
+			return _copy_file(source, target)
+		except FileNotFoundError:
+			return 0  # Removed while copying (such as a checkpointed write-ahead log)
+
+	def __enter__(self) -> "Snapshot":
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
+
+	def close(self) -> None:
+		self._tmpdir.cleanup()
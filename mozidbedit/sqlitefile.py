@@ -0,0 +1,220 @@
+"""Read records directly from the B-tree pages of memory-mapped SQLite files.
+
+Only meant for database files nobody writes to (such as forensic copies): The
+file is read as it is on disk, without any locking, so changes still in a
+write-ahead log or rollback journal are refused rather than silently missed.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import mmap
+import os
+import pathlib
+import struct
+import typing as ty
+
+if ty.TYPE_CHECKING:
+	from . import mozidb
+
+
+HEADER_MAGIC = b"SQLite format 3\0"
+
+# B-tree page types
+INDEX_INTERIOR = 0x02
+TABLE_INTERIOR = 0x05
+INDEX_LEAF     = 0x0A
+TABLE_LEAF     = 0x0D
+
+_TEXT_ENCODINGS = {1: "utf-8", 2: "utf-16-le", 3: "utf-16-be"}
+_INT_SIZES = (0, 1, 2, 3, 4, 6, 8)
+
+Buffer = ty.Union[bytes, memoryview]
+
+
+def _read_varint(buf: Buffer, pos: int) -> ty.Tuple[int, int]:
+	"""Reads the big-endian variable-length integer at `pos` and returns it
+	with the position following it"""
+	result = 0
+	for i in range(8):
+		byte = buf[pos + i]
+		result = (result << 7) | (byte & 0x7F)
+		if byte < 0x80:
+			return result, pos + i + 1
+	return (result << 8) | buf[pos + 8], pos + 9
+
+
+def pending_journal(path: ty.Union[os.PathLike, str]) -> ty.Optional[pathlib.Path]:
+	"""Returns the path of the non-empty write-ahead log or rollback journal
+	of the given database, if any"""
+	for suffix in ("-wal", "-journal"):
+		journal_path = pathlib.Path(os.fspath(path) + suffix)
+		try:
+			if journal_path.stat().st_size > 0:
+				return journal_path
+		except FileNotFoundError:
+			pass
+	return None
+
+
+class SQLiteFile:
+	"""Read-only access to the B-trees of an SQLite database file
+
+	Values are returned as `memoryview` slices of the mapped file wherever
+	possible, so they must not be used anymore after calling `close`. Unless
+	`ignore_journal` is set, files with pending changes are refused.
+	"""
+	path:        pathlib.Path
+	page_size:   int
+	usable_size: int
+	encoding:    str
+
+	def __init__(self, path: ty.Union[os.PathLike, str], *, ignore_journal: bool = False):
+		self.path = pathlib.Path(path)
+		journal_path = None if ignore_journal else pending_journal(self.path)
+		if journal_path is not None:
+			raise ValueError(f"Database has pending changes in: {journal_path}")
+
+		with open(self.path, "rb") as file:
+			self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		self.view = memoryview(self._mmap)
+		if len(self.view) < 100 or self.view[:16] != HEADER_MAGIC:
+			self.close()
+			raise ValueError(f"Not an SQLite database: {self.path}")
+
+		page_size, = struct.unpack_from(">H", self.view, 16)
+		self.page_size   = 65536 if page_size == 1 else page_size
+		self.usable_size = self.page_size - self.view[20]
+		encoding, = struct.unpack_from(">I", self.view, 56)
+		self.encoding    = _TEXT_ENCODINGS.get(encoding, "utf-8")
+
+		# Payloads of index cells larger than this spill onto overflow pages
+		self._max_local = (self.usable_size - 12) * 64 // 255 - 23
+		self._min_local = (self.usable_size - 12) * 32 // 255 - 23
+
+	def __enter__(self) -> "SQLiteFile":
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
+
+	def close(self) -> None:
+		try:
+			self.view.release()
+			self._mmap.close()
+		except BufferError:
+			pass  # Slices are still in use, the mapping is closed once they are gone
+
+	def iter_index(self, root_page: int) -> ty.Iterator[Buffer]:
+		"""Yields the payload of each entry of the index B-tree (such as the
+		table B-tree of a `WITHOUT ROWID` table) starting at `root_page` in
+		key order"""
+		view = self.view
+		page_offset = (root_page - 1) * self.page_size
+		header = page_offset + 100 if root_page == 1 else page_offset
+		page_type = view[header]
+		cell_count, = struct.unpack_from(">H", view, header + 3)
+
+		if page_type == INDEX_LEAF:
+			for cell_ptr in struct.unpack_from(f">{cell_count}H", view, header + 8):
+				yield self._payload(page_offset + cell_ptr)
+		elif page_type == INDEX_INTERIOR:
+			# Interior pages hold entries too, ordered after those of their left child
+			for cell_ptr in struct.unpack_from(f">{cell_count}H", view, header + 12):
+				left_child, = struct.unpack_from(">I", view, page_offset + cell_ptr)
+				yield from self.iter_index(left_child)
+				yield self._payload(page_offset + cell_ptr + 4)
+			right_child, = struct.unpack_from(">I", view, header + 8)
+			yield from self.iter_index(right_child)
+		else:
+			raise ValueError(f"Page {root_page} is not an index B-tree page (type {page_type:#04x})")
+
+	def _payload(self, pos: int) -> Buffer:
+		view = self.view
+		size = view[pos]
+		if size < 0x80:
+			pos += 1
+		else:
+			size, pos = _read_varint(view, pos)
+		if size <= self._max_local:
+			return view[pos:pos + size]
+
+		local_size = self._min_local + (size - self._min_local) % (self.usable_size - 4)
+		if local_size > self._max_local:
+			local_size = self._min_local
+		parts = [view[pos:pos + local_size]]
+		overflow_page, = struct.unpack_from(">I", view, pos + local_size)
+		remaining = size - local_size
+		while remaining > 0:
+			if overflow_page == 0:
+				raise ValueError(f"Overflow chain ends early: {self.path}")
+			page_offset = (overflow_page - 1) * self.page_size
+			overflow_page, = struct.unpack_from(">I", view, page_offset)
+			part_size = min(remaining, self.usable_size - 4)
+			parts.append(view[page_offset + 4:page_offset + 4 + part_size])
+			remaining -= part_size
+		return b"".join(parts)
+
+	def parse_record(self, payload: Buffer) -> ty.List[object]:
+		"""Decodes the column values of a record, returning blobs as slices of
+		`payload`"""
+		# Most varints in record headers are a single byte, skip the call for them
+		header_size, pos = _read_varint(payload, 0)
+		serial_types = []
+		while pos < header_size:
+			serial_type = payload[pos]
+			if serial_type < 0x80:
+				pos += 1
+			else:
+				serial_type, pos = _read_varint(payload, pos)
+			serial_types.append(serial_type)
+
+		values: ty.List[object] = []
+		pos = header_size
+		for serial_type in serial_types:
+			if serial_type >= 12:
+				size = (serial_type - 12) >> 1
+				value: object = payload[pos:pos + size]
+				if serial_type & 1:
+					value = str(value, self.encoding)
+				pos += size
+			elif serial_type == 7:
+				value, = struct.unpack_from(">d", payload, pos)
+				pos += 8
+			elif serial_type in (8, 9):
+				value = serial_type - 8
+			elif serial_type == 0:
+				value = None
+			else:
+				size = _INT_SIZES[serial_type]
+				value = int.from_bytes(payload[pos:pos + size], "big", signed=True)
+				pos += size
+			values.append(value)
+		return values
+
+
+def iter_object_data(conn: "mozidb.IndexedDB") \
+    -> ty.Iterator[ty.Tuple[bytes, Buffer, ty.Optional[str]]]:
+	"""Yields the `key`, `data` and `file_ids` columns of each `object_data`
+	row of the database of `conn` in storage order, reading them from the
+	memory-mapped file rather than through SQLite
+
+	`data` is a slice of the mapped file unless the record overflows its page.
+	"""
+	row = conn.execute("SELECT rootpage FROM sqlite_master WHERE type='table' AND name='object_data'").fetchone()
+	if row is None:
+		raise ValueError(f"No `object_data` table in database: {conn.path}")
+	root_page = row[0]
+
+	# Records of `WITHOUT ROWID` tables store the primary key columns first
+	columns = sorted(conn.execute("PRAGMA table_info(object_data)"),
+	                 key=lambda column: (column[5] == 0, column[5], column[0]))
+	index = {column[1]: i for i, column in enumerate(columns)}
+	key_index, data_index, file_ids_index = index["key"], index["data"], index["file_ids"]
+
+	with SQLiteFile(conn.path) as db:
+		for payload in db.iter_index(root_page):
+			values = db.parse_record(payload)
+			# Columns added later are missing from older records
+			file_ids = values[file_ids_index] if file_ids_index < len(values) else None
+			yield bytes(values[key_index]), values[data_index], file_ids
@@ -0,0 +1,159 @@
+"""Opt-in timers and counters for the stages of the IndexedDB reading pipeline."""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import contextvars
+import time
+import typing as ty
+
+
+#: Stages recorded by `mozidb.IndexedDB` and the command-line interface,
+#: in pipeline order
+STAGES = (
+	"snapshot.copy",
+	"sqlite.fetch",
+	"snappy.decompress",
+	"mozserial.read",
+	"key.decode",
+	"columnar.convert",
+	"to_json",
+	"output",
+)
+
+#: Start times of the `StageStats` blocks entered in the current thread or
+#: task, innermost last (blocks of a thread or task are always nested)
+_starts: contextvars.ContextVar[ty.Tuple[int, ...]] = contextvars.ContextVar("_starts", default=())
+
+
+class StageStats:
+	"""Counters of a single stage
+
+	Entering the object as context manager starts a timer that is stopped and
+	added to `time_ns` on exit; exceptions escaping the block are counted in
+	`errors` (and not suppressed). The object may be entered by several threads
+	or asyncio tasks at the same time.
+	"""
+	__slots__ = ("time_ns", "calls", "bytes_in", "bytes_out", "rows", "errors")
+
+	time_ns:   int
+	calls:     int
+	bytes_in:  int
+	bytes_out: int
+	rows:      int
+	errors:    int
+
+	def __init__(self):
+		self.time_ns   = 0
+		self.calls     = 0
+		self.bytes_in  = 0
+		self.bytes_out = 0
+		self.rows      = 0
+		self.errors    = 0
+
+	def __enter__(self) -> "StageStats":
+		self.calls += 1
+		_starts.set(_starts.get() + (time.perf_counter_ns(),))
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback) -> None:
+		starts = _starts.get()
+		_starts.set(starts[:-1])
+		self.time_ns += time.perf_counter_ns() - starts[-1]
+		if exc_type is not None:
+			self.errors += 1
+
+	def __iadd__(self, other: "StageStats") -> "StageStats":
+		self.time_ns   += other.time_ns
+		self.calls     += other.calls
+		self.bytes_in  += other.bytes_in
+		self.bytes_out += other.bytes_out
+		self.rows      += other.rows
+		self.errors    += other.errors
+		return self
+
+	def __repr__(self) -> str:
+		return f"<StageStats {self.to_dict()!r}>"
+
+	def to_dict(self) -> ty.Dict[str, int]:
+		return {
+			"time_ns":   self.time_ns,
+			"calls":     self.calls,
+			"bytes_in":  self.bytes_in,
+			"bytes_out": self.bytes_out,
+			"rows":      self.rows,
+			"errors":    self.errors,
+		}
+
+
+class CountingWriter:
+	"""Text stream writing to `stream`, adding the size of all text written
+	(encoded as UTF-8) to the `bytes_out` counter of `stage`"""
+	def __init__(self, stream: ty.TextIO, stage: StageStats):
+		self._stream = stream
+		self._stage  = stage
+
+	def write(self, text: str) -> int:
+		self._stage.bytes_out += len(text.encode("utf-8", "surrogatepass"))
+		return self._stream.write(text)
+
+	def flush(self) -> None:
+		self._stream.flush()
+
+
+class Stats:
+	"""Collects `StageStats` per stage and per database
+
+	Pass an instance as `stats=` to `mozidb.IndexedDB` to have it record its
+	work; without one no measurements are taken at all.
+	"""
+	databases: ty.Dict[str, ty.Dict[str, StageStats]]
+
+	def __init__(self):
+		self.databases = {}
+
+	def stage(self, name: str, database: str = "") -> StageStats:
+		"""Returns the (possibly new) counters of stage `name` of `database`"""
+		stages = self.databases.setdefault(database, {})
+		try:
+			return stages[name]
+		except KeyError:
+			result = stages[name] = StageStats()
+			return result
+
+	def totals(self) -> ty.Dict[str, StageStats]:
+		"""Returns the counters of each stage summed over all databases"""
+		result: ty.Dict[str, StageStats] = {}
+		for stages in self.databases.values():
+			for name, stage in stages.items():
+				result.setdefault(name, StageStats())
+				result[name] += stage
+		return _sorted_stages(result)
+
+	def to_dict(self) -> ty.Dict[str, object]:
+		return {
+			"databases": {
+				database: {name: stage.to_dict() for name, stage in _sorted_stages(stages).items()}
+				for database, stages in self.databases.items()
+			},
+			"totals": {name: stage.to_dict() for name, stage in self.totals().items()},
+		}
+
+	def format_table(self) -> str:
+		"""Formats the totals of each stage as human-readable table"""
+		lines = [f"{'stage':<18} {'time ms':>10} {'calls':>9} {'rows':>9} "
+		         f"{'MiB in':>9} {'MiB out':>9} {'MB/s':>9} {'errors':>7}"]
+		for name, stage in self.totals().items():
+			seconds = stage.time_ns / 1e9
+			rate = stage.bytes_in / seconds / 1e6 if seconds else 0.0
+			lines.append(f"{name:<18} {stage.time_ns / 1e6:10.2f} {stage.calls:9} {stage.rows:9} "
+			             f"{stage.bytes_in / 2**20:9.2f} {stage.bytes_out / 2**20:9.2f} "
+			             f"{rate:9.2f} {stage.errors:7}")
+		return "\n".join(lines)
+
+
+def _sorted_stages(stages: ty.Dict[str, StageStats]) -> ty.Dict[str, StageStats]:
+	"""Orders stages as in `STAGES`, followed by unknown ones by name"""
+	def sort_key(name: str) -> ty.Tuple[int, str]:
+		return (STAGES.index(name) if name in STAGES else len(STAGES), name)
+	return {name: stages[name] for name in sorted(stages, key=sort_key)}
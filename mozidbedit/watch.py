@@ -0,0 +1,203 @@
+"""Follow live IndexedDB databases and report changed records as they are written."""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import ctypes
+import ctypes.util
+import os
+import pathlib
+import select
+import struct
+import sys
+import time
+import typing as ty
+
+from . import incremental
+from . import mozidb
+from .dedup import DecodeCache
+
+
+# From <sys/inotify.h>
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+	"""Minimal inotify binding using `ctypes`, reporting only which watched
+	directories had changes"""
+	def __init__(self, fd: int, libc: ctypes.CDLL):
+		self.fd = fd
+		self._libc = libc
+		self._dirs: ty.Dict[int, pathlib.Path] = {}
+
+	@classmethod
+	def create(cls) -> ty.Optional["Inotify"]:
+		"""Returns a new instance or `None` if inotify is unavailable"""
+		if not sys.platform.startswith("linux"):
+			return None
+		try:
+			libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+			fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		except (OSError, AttributeError):
+			return None
+		if fd < 0:
+			return None
+		return cls(fd, libc)
+
+	def close(self) -> None:
+		os.close(self.fd)
+
+	def add_dir(self, path: pathlib.Path) -> None:
+		mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+		wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+		if wd < 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno), str(path))
+		self._dirs[wd] = path
+
+	def wait(self, timeout: float) -> ty.Set[pathlib.Path]:
+		"""Waits up to `timeout` seconds for events and returns the directories
+		they happened in"""
+		readable, _, _ = select.select([self.fd], [], [], timeout)
+		changed: ty.Set[pathlib.Path] = set()
+		if not readable:
+			return changed
+
+		while True:
+			try:
+				buf = os.read(self.fd, 65536)
+			except BlockingIOError:
+				break
+			offset = 0
+			while offset < len(buf):
+				wd, _, _, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+				offset += _EVENT_HEADER.size + name_len
+				if wd in self._dirs:
+					changed.add(self._dirs[wd])
+		return changed
+
+
+class Watcher:
+	"""Reports changes of a set of databases as they happen
+
+	Every `interval` seconds each database is checked using `PRAGMA data_version`
+	on a connection kept open, which is cheap enough to not matter for idle
+	profiles. With inotify available, databases are instead only checked when
+	their directory had changes (or at least every `interval * 10` seconds).
+	Changed databases are then diffed against the row hashes of the previous
+	check, so only changed records are decoded.
+
+	`find_databases` is called again every `rescan_interval` seconds to pick up
+	newly created databases. Values are decoded using `decode_cache` if given
+	(see `dedup.DecodeCache`). Records that cannot be decoded are reported on
+	stderr and skipped.
+	"""
+	def __init__(
+			self,
+			find_databases: ty.Callable[[], ty.Iterable[pathlib.Path]],
+			*,
+			interval: float = 1.0,
+			rescan_interval: float = 30.0,
+			use_inotify: bool = True,
+			decode_cache: ty.Optional[DecodeCache] = None,
+	):
+		self.find_databases  = find_databases
+		self.interval        = interval
+		self.rescan_interval = rescan_interval
+		self.decode_cache    = decode_cache
+		self._tracker = incremental.ChangeTracker(":memory:")
+		self._conns: ty.Dict[pathlib.Path, mozidb.IndexedDB] = {}
+		self._inotify = Inotify.create() if use_inotify else None
+		self._watched_dirs: ty.Set[pathlib.Path] = set()
+
+	def close(self) -> None:
+		for conn in self._conns.values():
+			conn.close()
+		self._conns.clear()
+		self._tracker.close()
+		if self._inotify is not None:
+			self._inotify.close()
+
+	@staticmethod
+	def _reporter(db_path: pathlib.Path) -> ty.Callable[[str, object, Exception], None]:
+		def report(store: str, key: object, exc: Exception) -> None:
+			print(f"Cannot decode record {key!r} of store {store!r} in {db_path}: "
+			      f"{type(exc).__name__}: {exc}", file=sys.stderr)
+		return report
+
+	def _rescan(self, initial: bool) -> ty.Iterator[ty.Tuple[pathlib.Path, incremental.Change]]:
+		found = set(self.find_databases())
+		for db_path in set(self._conns) - found:
+			self._conns.pop(db_path).close()
+
+		for db_path in sorted(found - set(self._conns)):
+			try:
+				conn = mozidb.IndexedDB(db_path, plain_ints=True, readonly=True,
+				                        decode_cache=self.decode_cache)
+			except mozidb.sqlite3.Error as exc:
+				print(f"Cannot watch {db_path}: {exc}", file=sys.stderr)
+				continue
+			self._conns[db_path] = conn
+			if initial:
+				for change in self._tracker.changes(conn, on_error=self._reporter(db_path)):
+					yield db_path, change
+			else:
+				self._tracker.mark_seen(conn)
+
+			if self._inotify is not None and db_path.parent not in self._watched_dirs:
+				try:
+					self._inotify.add_dir(db_path.parent)
+				except OSError as exc:
+					print(f"Falling back to polling: {exc}", file=sys.stderr)
+					self._inotify.close()
+					self._inotify = None
+				else:
+					self._watched_dirs.add(db_path.parent)
+
+	def _check(self, db_paths: ty.Iterable[pathlib.Path]) \
+	    -> ty.Iterator[ty.Tuple[pathlib.Path, incremental.Change]]:
+		for db_path in db_paths:
+			conn = self._conns.get(db_path)
+			if conn is None:
+				continue
+			try:
+				for change in self._tracker.changes(conn, on_error=self._reporter(db_path)):
+					yield db_path, change
+			except mozidb.sqlite3.Error as exc:
+				# Database was deleted or is being rewritten, retry on next rescan
+				print(f"Failed to read {db_path}: {exc}", file=sys.stderr)
+				self._conns.pop(db_path).close()
+
+	def run(self, *, initial: bool = False) -> ty.Iterator[ty.Tuple[pathlib.Path, incremental.Change]]:
+		"""Yields the changed records of all databases with their path, forever
+
+		If `initial` is set, all existing records are reported first.
+		"""
+		yield from self._rescan(initial)
+		last_rescan = last_full_check = time.monotonic()
+		while True:
+			if self._inotify is not None:
+				changed_dirs = self._inotify.wait(self.interval)
+				now = time.monotonic()
+				if now - last_full_check >= self.interval * 10:
+					# Some changes (such as memory-mapped writes) may not be seen by inotify
+					to_check = list(self._conns)
+					last_full_check = now
+				else:
+					to_check = [path for path in self._conns if path.parent in changed_dirs]
+			else:
+				time.sleep(self.interval)
+				to_check = list(self._conns)
+			yield from self._check(to_check)
+
+			if time.monotonic() - last_rescan >= self.rescan_interval:
+				yield from self._rescan(True)
+				last_rescan = time.monotonic()